@@ -1,6 +1,5 @@
 import asyncio
 import concurrent.futures
-import json
 import sys
 import time
 import traceback
@@ -8,10 +7,25 @@ import traceback
 import discord
 import websockets.exceptions
 
+import main_code.announcement_channels
 import main_code.command_decorator
+import main_code.command_router
 import main_code.commands.admin.broadcast
 import main_code.commands.admin.change_icon
 import main_code.commands.admin.repl
+import main_code.commands.admin.stats
+import main_code.config_manager
+import main_code.handoff
+import main_code.heartbeat
+import main_code.help_pages
+import main_code.loop_monitor
+import main_code.member_events
+import main_code.member_update_waiters
+import main_code.metrics
+import main_code.expiring_id_set
+import main_code.message_claims
+import main_code.sharding
+import main_code.stats
 from main_code import helpers
 
 # Setting up the client object
@@ -19,15 +33,31 @@ client = helpers.actual_client
 
 
 @client.event
+@main_code.metrics.timed_event
 async def on_message(message: discord.Message):
-    # We wait for a split second so we can be assured that ignoring of messages and other things have finished before the message is processed here
+    # We store when we received the message, so we can measure how long it takes before a command starts
+    received_time = time.monotonic()
+
+    # We record how long every stage of handling the message takes
+    stage_timer = main_code.metrics.StageTimer("message_stage", received_time)
+    main_code.metrics.increment("messages_received")
+
     # We make sure the message is a regular one
     if message.type != discord.MessageType.default:
         return
 
-    await asyncio.sleep(0.1)
+    # We check if a command has claimed this message (such as a reply it's waiting for), this has to happen before we await anything
+    # so the decision to ignore the message is made as soon as we receive it, and we don't need to wait for other handlers
+    message_claimed = main_code.message_claims.try_claim(message)
+    stage_timer.mark("claim")
 
-    global config
+    # If we're handing off (we're draining, or we're the new process and haven't taken over yet), the other process handles the message
+    if not main_code.handoff.should_handle_events():
+        return
+
+    # We use the same config snapshot for the whole message, even if the config is reloaded while we handle it
+    config = config_manager.get()
+    stage_timer.mark("config")
 
     # The weird mention for the bot user (mention code starts with an exclamation mark instead of just the user ID), the string manipulation is due to mention strings not being the same all the time
     client_mention = client.user.mention[:2] + "!" + client.user.mention[2:]
@@ -66,17 +96,8 @@ async def on_message(message: discord.Message):
                                 message.author.name, attachment["filename"], attachment["size"]))
 
     else:
-        # We sent a message and we are going to increase the sent messages counter in the config
-        # We first load the config
-        with open("config.json", mode="r", encoding="utf-8") as config_file:
-            current_config = json.load(config_file)
-
-        # Now we change the actual value and then dump it back into the file
-        current_config["stats"]["messages_sent"] += 1
-
-        with open("config.json", mode="w", encoding="utf-8") as config_file:
-            # Dump back the changed data
-            json.dump(current_config, config_file, indent=2)
+        # We sent a message and we are going to increase the sent messages counter (it gets written to the config in the background)
+        main_code.stats.increment("messages_sent")
 
         # We sent a message and we are going to log it appropriately
         if message.channel.is_private:
@@ -86,9 +107,9 @@ async def on_message(message: discord.Message):
                 helpers.log_info(
                     "We said: \"" + message.content + "\" in channel: \"" + message.channel.name + "\" on server \"" + message.server.name + "\".")
 
-    # Checking if the user used a command, but we first wait to make sure that the message gets ignored if necessary
-    await asyncio.sleep(0.2)
+    stage_timer.mark("logging")
 
+    # Checking if the user used a command
     # We need to define all the special params as globals to be able to access them without sneaky namespace stuff biting us in the ass
     global ignored_command_message_ids
 
@@ -97,254 +118,358 @@ async def on_message(message: discord.Message):
 
     # Checking if we sent the message, so we don't trigger ourselves and checking if the message should be ignored or not (such as it being a response to another command)
     # We also check if the message was sent by a bot account, as we don't allow them to use commands
-    if not ((message.author.id == client.user.id) or (message.id in ignored_command_message_ids) or message.author.bot):
-        # If a command is used with the message that was passed to the event, we know that a command has been triggered
-        used_command = False
+    # Messages that a command has claimed are never dispatched as commands
+    if not ((message.author.id == client.user.id) or message_claimed or (message.id in ignored_command_message_ids) or
+                message.author.bot):
 
-        # Check if the message was sent in a PM to fluxx
+        # In a PM the whole message is the command, in a server channel the message has to start with a mention of fluxx
         if message.channel.is_private:
-
-            # Going through all the public commands we've specified and checking if they match the message
-            for command in public_commands:
-                if message.content.lower().strip().startswith(command["command"]):
-                    # We log what command was used by who
-                    helpers.log_info("The " + command[
-                        "command"] + " command was triggered by \"" + message.author.name + "\" in a PM.")
-
-                    # The command matches, so we call the method that was specified in the command list
-                    temp_result = await command["method"](message, client, config,
-                                                          *[x[0] for x in
-                                                            zip(special_params,
-                                                                command["special_params"])
-                                                            if x[1]])
-                    x = 0
-                    # We put back all the values that we got returned
-                    if temp_result:
-                        for i in range(len(special_params)):
-                            if command["special_params"][i]:
-                                set_special_param(i, temp_result[x])
-                                x += 1
-
-                    # We note that a command was triggered so we don't output the message about what "!" means
-                    used_command = True
-                    break
-
-            # Checking if the issuing user is in the admin list
-            if helpers.is_member_fluxx_admin(message.author, config):
-
-                # Going through all the admin commands we've specified and checking if they match the message
-                for command in admin_commands:
-                    if message.content.lower().strip().startswith("admin " + command["command"]):
-                        # We log what command was used by who
-                        helpers.log_info("The " + command[
-                            "command"] + " admin command was triggered by admin \"" + message.author.name + "\" in a PM.")
-
-                        # The command matches, so we call the method that was specified in the command list
-                        temp_result = await command["method"](message, client, config, *[x[0] for x in
-                                                                                         zip(special_params,
-                                                                                             command["special_params"])
-                                                                                         if x[1]])
-                        x = 0
-                        # We put back all the values that we got returned
-                        if temp_result:
-                            for i in range(len(special_params)):
-                                if command["special_params"][i]:
-                                    set_special_param(i, temp_result[x])
-                                    x += 1
-
-                        # We note that a command was triggered so we don't output the message about what fluxx can do
-                        used_command = True
-                        break
-
-            # If the message started with an command trigger and it didn't have a valid command we try to teach the user which commands are available
-            if not used_command:
-                # Sending the message to the user
+            command_content = message.content
+        elif helpers.is_message_command(message, client):
+            command_content = helpers.remove_fluxx_mention(client, message)
+        else:
+            # The message isn't trying to use a command
+            return
+
+        # We normalize the message once and do a single walk of the command trie, which also handles the admin gating
+        command, is_admin_command = command_router.match(
+            main_code.command_router.normalize_command_content(command_content),
+            helpers.is_member_fluxx_admin(message.author, config))
+        stage_timer.mark("routing")
+
+        # If the message started with an command trigger and it didn't have a valid command we try to teach the user which commands are available
+        if command is None:
+            # Sending the message to the user, and we format it properly depending on if we're in a PM or not
+            if message.channel.is_private:
                 await client.send_message(message.channel,
                                           "You seemingly just tried to use an " + client_mention + " command, but I couldn't figure out which one you wanted to use, if you want to know what commands I can do for you, please type \"" + client_mention + " help\" :smile:")
             else:
-                # If the message was a command of any sort, we increment the commands received counter on fluxx
-                # We first load the config
-                with open("config.json", mode="r", encoding="utf-8") as config_file:
-                    current_config = json.load(config_file)
-
-                # Now we change the actual value and then dump it back into the file
-                current_config["stats"]["commands_received"] += 1
-
-                with open("config.json", mode="w", encoding="utf-8") as config_file:
-                    # Dump back the changed data
-                    json.dump(current_config, config_file, indent=2)
+                await client.send_message(message.channel,
+                                          message.author.mention + ", you seemingly just tried to use an " + client_mention + " command, but I couldn't figure out which one you wanted to use, if you want to know what commands I can do for you, please type \"" + client_mention + " help\" :smile:")
+            return
 
-        # We're in a regular server channel
+        # We log what command was used by who and where
+        if message.channel.is_private:
+            location = "in a PM"
         else:
-            # Checking if the message is a command, (starts with a mention of fluxx)
-            if helpers.is_message_command(message, client):
-                # Going through all the public commands we've specified and checking if they match the message
-                for command in public_commands:
-                    if helpers.remove_fluxx_mention(client, message).lower().strip().startswith(
-                            command["command"]):
-                        # We log what command was used by who and where
-                        helpers.log_info("The " + command[
-                            "command"] + " command was triggered by \"" + message.author.name + "\" in channel \"" + message.channel.name + "\" on server \"" + message.server.name + "\".")
-
-                        # The command matches, so we call the method that was specified in the command list
-                        temp_result = await command["method"](message, client, config, *[x[0] for x in
-                                                                                         zip(special_params,
-                                                                                             command["special_params"])
-                                                                                         if x[1]])
-                        x = 0
-                        # We put back all the values that we got returned
-                        if temp_result:
-                            for i in range(len(special_params)):
-                                if command["special_params"][i]:
-                                    set_special_param(i, temp_result[x])
-                                    x += 1
-
-                        # We note that a command was triggered so we don't output the message about what fluxx can do
-                        used_command = True
-                        break
-
-                # Checking if the issuing user is in the admin list
-                if helpers.is_member_fluxx_admin(message.author, config):
-                    # Going through all the admin commands we've specified and checking if they match the message
-                    for command in admin_commands:
-                        if helpers.remove_fluxx_mention(client, message).lower().strip().startswith(
-                                        "admin " + command["command"]):
-
-                            # We check if the command was triggered in a private channel/PM or not
-                            if message.channel.is_private:
-
-                                # We log what command was used by who
-                                helpers.log_info("The " + command[
-                                    "command"] + " admin command was triggered by admin \"" + message.author.name + "\" in a PM.")
-
-                            else:
-                                # We log what command was used by who and where
-                                helpers.log_info("The " + command[
-                                    "command"] + " admin command was triggered by admin \"" + message.author.name + "\" in channel \"" + message.channel.name + "\" on server \"" + message.server.name + "\".")
-
-                            # The command matches, so we call the method that was specified in the command list
-                            temp_result = await command["method"](message, client, config, *[x[0] for x in
-                                                                                             zip(special_params,
-                                                                                                 command[
-                                                                                                     "special_params"])
-                                                                                             if x[1]])
-                            x = 0
-                            # We put back all the values that we got returned
-                            if temp_result:
-                                for i in range(len(special_params)):
-                                    if command["special_params"][i]:
-                                        set_special_param(i, temp_result[x])
-                                        x += 1
-
-                            # We note that a command was triggered so we don't output the message about what fluxx can do
-                            used_command = True
-                            break
-
-                # If the message started with an command trigger and it didn't have a valid command we try to teach the user which commands are available
-                if not used_command:
-                    # Sending the message to the user
-                    await client.send_message(message.channel,
-                                              message.author.mention + ", you seemingly just tried to use an " + client_mention + " command, but I couldn't figure out which one you wanted to use, if you want to know what commands I can do for you, please type \"" + client_mention + " help\" :smile:")
-                else:
-                    # If the message was a command of any sort, we increment the commands received counter on fluxx
-                    # We first load the config
-                    with open("config.json", mode="r", encoding="utf-8") as config_file:
-                        current_config = json.load(config_file)
-
-                    # Now we change the actual value and then dump it back into the file
-                    current_config["stats"]["commands_received"] += 1
+            location = "in channel \"" + message.channel.name + "\" on server \"" + message.server.name + "\""
 
-                    with open("config.json", mode="w", encoding="utf-8") as config_file:
-                        # Dump back the changed data
-                        json.dump(current_config, config_file, indent=2)
-
-                    # We remove stream players that are done playing, as this is done on every command and every commands can only create at most 1 stream player, we guarantee no memory leak
-                    server_and_stream_players[:] = [x for x in server_and_stream_players if not x[1].is_done()]
+        if is_admin_command:
+            helpers.log_info("The " + command[
+                "command"] + " admin command was triggered by admin \"" + message.author.name + "\" " + location + ".")
+        else:
+            helpers.log_info(
+                "The " + command["command"] + " command was triggered by \"" + message.author.name + "\" " + location + ".")
+
+        # We record how long it took from receiving the message until the command starts
+        main_code.metrics.observe("dispatch_latency", time.monotonic() - received_time)
+        stage_timer.mark("dispatch")
+
+        # The command matches, so we call the method that was specified in the command list
+        # We keep track of the running commands, so a handoff to a new process can wait for them to finish
+        with main_code.handoff.track_command():
+            temp_result = await command["method"](message, client, config,
+                                                  *[x[0] for x in zip(special_params, command["special_params"]) if x[1]])
+        x = 0
+        # We put back all the values that we got returned
+        if temp_result:
+            for i in range(len(special_params)):
+                if command["special_params"][i]:
+                    set_special_param(i, temp_result[x])
+                    x += 1
+
+        # If the message was a command of any sort, we increment the commands received counter on fluxx (it gets written to the config in the background)
+        main_code.stats.increment("commands_received")
+        stage_timer.mark("command")
+
+        # We remove stream players that are done playing, as this is done on every command and every commands can only create at most 1 stream player, we guarantee no memory leak
+        server_and_stream_players[:] = [x for x in server_and_stream_players if not x[1].is_done()]
 
     else:
         # Checking if we didn't check if the message was a command because the message id was in the ignored ids list
         if message.id in ignored_command_message_ids:
-            # We remove the ignored id from the list so we don't accumulate ids to check against
-            ignored_command_message_ids.remove(message.id)
+            # We remove the ignored id from the set as soon as we can, so it doesn't take up space until it expires
+            ignored_command_message_ids.discard(message.id)
 
 
 @client.event
+@main_code.metrics.timed_event
 async def on_member_join(member: discord.Member):
     """This event is called when a member joins a server, we use it for various features."""
 
-    # We wait as to not do stuff before the user has actually joined the server
-    await asyncio.sleep(0.2)
+    # If we're handing off (we're draining, or we're the new process and haven't taken over yet), the other process greets the member
+    if not main_code.handoff.should_handle_events():
+        return
 
-    # We log that a user has joined the server
-    helpers.log_info(
-        "User {0:s} ({1:s}) has joined server {2:s} ({3:s}).".format(member.name, member.id, member.server.name,
-                                                                     member.server.id))
+    # We keep track of the join like a running command, so a drain waits until the member has been added to the announcements
+    with main_code.handoff.track_command():
+        # We wait as to not do stuff before the user has actually joined the server
+        await asyncio.sleep(0.2)
+
+        # We log that a user has joined the server
+        helpers.log_info(
+            "User {0:s} ({1:s}) has joined server {2:s} ({3:s}).".format(member.name, member.id, member.server.name,
+                                                                         member.server.id))
 
-    # We call all the join functions, and pass them the member who joined
-    for join_function in join_functions:
-        await join_function(member)
+        # We call all the join functions at the same time, and pass them the member who joined
+        await asyncio.gather(*[join_function(member) for join_function in join_functions])
 
 
 @client.event
+@main_code.metrics.timed_event
 async def on_member_remove(member: discord.Member):
     """This event is called when a member leaves a server, we use it for various features."""
 
+    # If we're handing off (we're draining, or we're the new process and haven't taken over yet), the other process handles the leave
+    if not main_code.handoff.should_handle_events():
+        return
+
     # We log that a user has left the server
     helpers.log_info(
         "User {0:s} ({1:s}) has left server {2:s} ({3:s}).".format(member.name, member.id, member.server.name,
                                                                    member.server.id))
 
     # We check if the server is on the list of servers who use the leave message feature
-    if int(member.server.id) in [x[0] for x in config["leave_msg"]["server_and_channel_id_pairs"]]:
-
-        # We send a message to the specified channels in that server (you can have however many channels you want, but we check if they are on the correct server)
-        channel_ids = \
-            [x[1:] for x in config["leave_msg"]["server_and_channel_id_pairs"] if x[0] == int(member.server.id)][0]
-
-        # We loop through all the possible channels and check if they're valid
-        for channel_id in [int(x) for x in channel_ids]:
-            # We check if the channel id is on the server that the member left
-            if discord.utils.find(lambda c: int(c.id) == channel_id, member.server.channels) is not None:
-                # We send the leave message:
-                await client.send_message(discord.utils.find(lambda c: int(c.id) == channel_id, member.server.channels),
-                                          config["leave_msg"]["leave_msg"].format(member.mention, member.server.name))
+    if announcement_channel_index.is_enabled("leave_msg", member.server):
+        # The leave message is sent together with the leave messages of other members that leave at around the same time
+        member_event_batcher.add("leave_msg", member)
 
 
 @client.event
+@main_code.metrics.timed_event
 async def on_ready():
     """This does various things that should be done on startup.
     One of them is outputting info about who we're logged in as."""
+    global metrics_server_task
+
     helpers.log_info("fluxx-bot has now logged in as: {0} with id {1}".format(client.user.name, client.user.id))
 
+    if client.shard_count:
+        helpers.log_info("We're shard {0} of {1}, with {2} servers.".format(client.shard_id, client.shard_count,
+                                                                            len(client.servers)))
+
+    config = config_manager.get()
+
+    # Our permissions might have changed while we were disconnected, and all the server objects have been replaced
+    helpers.bot_permission_cache.clear()
+    helpers.server_object_index.clear()
+
+    # We resolve the join and leave message channels now that we know all our servers
+    announcement_channel_index.rebuild(config, client)
+
+    # We start watching the config file, so changes to it are loaded without having to use the reload command
+    config_manager.start_watching(client.loop, config["somewhat_weird_shit"].get("config_watch_interval", 2))
+
+    # We start writing the stats counters to the config in the background (this doesn't start another task if we reconnect)
+    main_code.stats.start_flushing(client.loop, config["stats"].get("flush_interval", 30))
+
+    # We start watching for anything that blocks the event loop (this doesn't start another monitor if we reconnect)
+    loop_monitor.start()
+
+    # If the metrics endpoint is enabled, we serve the metrics on localhost (every shard on its own port)
+    metrics_port = config["stats"].get("metrics_port")
+    # We do it in the background, since during a handoff the old process serves on the port until it drains
+    if metrics_port and (metrics_server_task is None or metrics_server_task.done()):
+        metrics_server_task = client.loop.create_task(
+            start_metrics_server(metrics_port + main_code.sharding.get_shard_id()))
+
+    # If the launcher supervises us, we start sending it heartbeats from the event loop, so it can restart us if the loop gets stuck
+    # The first heartbeat also tells it we're ready, so if we're in standby it can hand off to us
+    main_code.heartbeat.start(client.loop)
+
+    if main_code.handoff.is_standby():
+        helpers.log_info("Ready, waiting for the launcher to let us take over from the running fluxx-bot process.")
+
+
+async def start_metrics_server(port: int, retry_interval: float = 5.):
+    """Serves the metrics on the port, and keeps retrying if the port is in use.
+    It is in use during a handoff, until the process we take over from stops serving on it when it drains."""
+    warned = False
+    while True:
+        try:
+            await main_code.metrics.start_server(client.loop, port)
+        except OSError as e:
+            # We only warn once, the port is expected to be in use for a while during a handoff
+            if not warned:
+                helpers.log_warning(
+                    "Wasn't able to start the metrics endpoint, we'll keep retrying, error message: {0}".format(str(e)))
+                warned = True
+        else:
+            if warned:
+                helpers.log_info("Started the metrics endpoint on port {0}.".format(port))
+            return
+
+        await asyncio.sleep(retry_interval)
+
+
+async def drain_and_exit():
+    """This is called when the launcher has started a new process that is ready to take over from us.
+    We stop handling events, let the running commands finish, and log out, which makes start_fluxx return."""
+    helpers.log_info("A new fluxx-bot process is taking over, draining {0} running commands...".format(
+        main_code.handoff.get_commands_in_flight()))
+
+    # We free the metrics port right away, so the new process can serve the metrics while we drain
+    if metrics_server_task is not None:
+        metrics_server_task.cancel()
+    await main_code.metrics.stop_server()
+
+    drain_timeout = config_manager.get()["somewhat_weird_shit"].get("drain_timeout", 30)
+    await main_code.handoff.drain(drain_timeout)
+
+    # We announce the members that joined or left during the last announcement window, since they'd never be announced after we log out
+    try:
+        await asyncio.wait_for(member_event_batcher.flush(), drain_timeout)
+    except asyncio.TimeoutError:
+        helpers.log_warning("Timed out while announcing the members that joined or left before the drain.")
+
+    helpers.log_info("Done draining, logging out.")
+    await client.logout()
+
+
+@client.event
+@main_code.metrics.timed_event
+async def on_server_join(server: discord.Server):
+    """This event is called when we join a server."""
+    announcement_channel_index.update_server(server)
+    helpers.bot_permission_cache.invalidate_server(server)
+
+
+@client.event
+@main_code.metrics.timed_event
+async def on_server_available(server: discord.Server):
+    """This event is called when a server becomes available after being unavailable."""
+    announcement_channel_index.update_server(server)
+    helpers.bot_permission_cache.invalidate_server(server)
+    helpers.server_object_index.remove_server(server)
+
+
+@client.event
+@main_code.metrics.timed_event
+async def on_server_remove(server: discord.Server):
+    """This event is called when we leave or get removed from a server."""
+    announcement_channel_index.remove_server(server)
+    helpers.bot_permission_cache.invalidate_server(server)
+    helpers.server_object_index.remove_server(server)
+
+
+@client.event
+@main_code.metrics.timed_event
+async def on_server_update(before: discord.Server, after: discord.Server):
+    """This event is called when a server is changed (such as its owner), we forget our cached permissions on it."""
+    helpers.bot_permission_cache.invalidate_server(after)
+
+
+@client.event
+@main_code.metrics.timed_event
+async def on_server_role_create(role: discord.Role):
+    """This event is called when a role is created, role positions might have changed so we forget our cached permissions on the server."""
+    helpers.bot_permission_cache.invalidate_server(role.server)
+    helpers.server_object_index.update_role(None, role)
+
+
+@client.event
+@main_code.metrics.timed_event
+async def on_server_role_delete(role: discord.Role):
+    """This event is called when a role is deleted, we forget our cached permissions on the server."""
+    helpers.bot_permission_cache.invalidate_server(role.server)
+    helpers.server_object_index.remove_role(role)
+
+
+@client.event
+@main_code.metrics.timed_event
+async def on_server_role_update(before: discord.Role, after: discord.Role):
+    """This event is called when a role is changed, we forget our cached permissions on the server."""
+    helpers.bot_permission_cache.invalidate_server(after.server)
+    helpers.server_object_index.update_role(before, after)
+
+
+@client.event
+@main_code.metrics.timed_event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    """This event is called when a member is changed, if it's us (such as our roles changing) we forget our cached permissions on the server."""
+
+    # We tell the code that's waiting for this update (such as role removals) that it has arrived
+    main_code.member_update_waiters.resolve(before, after)
+
+    if after.id == client.user.id:
+        helpers.bot_permission_cache.invalidate_server(after.server)
+
+
+@client.event
+@main_code.metrics.timed_event
+async def on_channel_create(channel: discord.Channel):
+    """This event is called when a channel is created, we keep the join and leave message channels and our cached permissions up to date with it."""
+    if not channel.is_private:
+        announcement_channel_index.update_server(channel.server)
+        helpers.bot_permission_cache.invalidate_channel(channel)
+        helpers.server_object_index.update_channel(None, channel)
+
+
+@client.event
+@main_code.metrics.timed_event
+async def on_channel_delete(channel: discord.Channel):
+    """This event is called when a channel is deleted, we keep the join and leave message channels and our cached permissions up to date with it."""
+    if not channel.is_private:
+        announcement_channel_index.update_server(channel.server)
+        helpers.bot_permission_cache.invalidate_channel(channel)
+        helpers.server_object_index.remove_channel(channel)
+
+
+@client.event
+@main_code.metrics.timed_event
+async def on_channel_update(before: discord.Channel, after: discord.Channel):
+    """This event is called when a channel is changed, we keep the join and leave message channels and our cached permissions up to date with it."""
+    if not after.is_private:
+        announcement_channel_index.update_server(after.server)
+        helpers.bot_permission_cache.invalidate_channel(after)
+        helpers.server_object_index.update_channel(before, after)
+
 
 async def join_send_pm(member: discord.Member):
     """This function pm's a user when they join a configured server, and gives them a rule rundown."""
 
+    config = config_manager.get()
+
     # We check if the server is on the list of servers who use the pm message feature
-    if int(member.server.id) in [x[0] for x in config["join_msg"]["server_and_channel_id_pairs"]]:
-        # We send the pm message
-        await client.send_message(member, config["join_msg"]["pm_msg"].format(member.mention, member.server.name))
+    if announcement_channel_index.is_enabled("join_msg", member.server):
+        # We send the pm message, but we limit how many we send at the same time
+        await member_event_batcher.send_pm(
+            client.send_message(member, config["join_msg"]["pm_msg"].format(member.mention, member.server.name)))
 
 async def join_welcome_message(member: discord.Member):
     """This function is called when a user joins a server, and welcomes them if the server has enabled the welcome message feature."""
 
     # We check if the server is on the list of servers who use the welcome message feature
-    if int(member.server.id) in [x[0] for x in config["join_msg"]["server_and_channel_id_pairs"]]:
+    if announcement_channel_index.is_enabled("join_msg", member.server):
+        # The welcome message is sent together with the welcome messages of other members that join at around the same time
+        member_event_batcher.add("join_msg", member)
+
+
+async def announce_members(feature: str, server: discord.Server, members: list) -> int:
+    """Sends the join or leave message (depending on feature) for all the passed members of the server, mentioning as many members per message as fits.
+    Returns how many messages we announced the members in."""
+
+    message_format = config_manager.get()[feature]["welcome_msg" if feature == "join_msg" else "leave_msg"]
 
-        # We send a message to the specified channels in that server (you can have however many channels you want, but we check if they are on the correct server)
-        channel_ids = \
-            [x[1:] for x in config["join_msg"]["server_and_channel_id_pairs"] if x[0] == int(member.server.id)][0]
+    # We split the members into groups whose messages fit in discord's 2000 char limit
+    mention_groups = [[]]
+    for member in members:
+        if mention_groups[-1] and len(
+                message_format.format(", ".join(mention_groups[-1] + [member.mention]), server.name)) > 2000:
+            mention_groups.append([])
 
-        # We loop through all the possible channels and check if they're valid
-        for channel_id in [int(x) for x in channel_ids]:
-            # We check if the channel id is on the server that the member joined
-            if discord.utils.find(lambda c: int(c.id) == channel_id, member.server.channels) is not None:
-                # We send the welcome message:
-                await client.send_message(discord.utils.find(lambda c: int(c.id) == channel_id, member.server.channels),
-                                          config["join_msg"]["welcome_msg"].format(member.mention, member.server.name))
+        mention_groups[-1].append(member.mention)
+
+    # We send the messages to the channels that the server has configured (the index only has channels that are on the server)
+    for channel in announcement_channel_index.get_channels(feature, server):
+        for mention_group in mention_groups:
+            await client.send_message(channel, message_format.format(", ".join(mention_group), server.name))
+
+    return len(mention_groups)
 
 
 @client.event
+@main_code.metrics.timed_event
 async def on_error(event, *args, **kwargs):
     """This event is called when an error is raised by the client,
     and we override the default behaviour to be able to log and catch errors."""
@@ -366,48 +491,15 @@ async def cmd_help(message: discord.Message, passed_client: discord.Client, pass
     """This method is called to handle someone needing information about the commands they can use fluxx for.
     Because of code simplicity this is one of the command functions that needs to stay in the __init__py file."""
 
-    # We need to create the helptexts dynamically and on each use of this command as it depends on the bot user mention which needs the client to be logged in
-
+    # The help pages are built once when the command set changes, only the bot user mention depends on the logged in client
     # The correct mention for the bot user, the string manipulation is due to mention strings not being the same depending on if a user or the library generated it
     client_mention = passed_client.user.mention[:2] + "!" + passed_client.user.mention[2:]
 
-    # Generating the combined and formatted helptext of all the public commands (we do this in <2000 char chunks, as 2000 chars is the max length of a discord message)
-    public_commands_helptext = [""]
-
-    # The separator between help entries, it uses discord formatting to look nice
-    help_separator = "__" + (" " * 98) + "__"
-
-    # Looping through all the public commands to add their helptexts to the correct chunks
-    for helpcommand in public_commands:
-
-        # We check if the last chunk is too will become too large or not
-        if len(public_commands_helptext[-1] + "\n" + help_separator + "\n\t" + "**" + helpcommand[
-            "command"] + "**\n" + helpcommand["helptext"] + "\n" + help_separator) > 2000:
-            # We add another string to he list of messages we want to send
-            public_commands_helptext.append("")
-
-        public_commands_helptext[-1] += "\n" + help_separator + "\n\t" + "**" + helpcommand[
-            "command"] + "**\n" + helpcommand["helptext"]
-
     # Checking if the issuer is an admin user, so we know if we should show them the admin commands
-    if int(message.author.id) in passed_config["somewhat_weird_shit"]["admin_user_ids"]:
-        # Generating the combined and formatted helptext of all the admin commands (we do this in >2000 char chunks, as 2000 chars is the max length of a discord message)
-        admin_commands_helptext = [""]
-
-        # Looping through all the admin commands to add their helptexts to the correct chunks
-        for helpcommand in admin_commands:
-
-            # We check if the last chunk is too will become too large or not
-            if len(admin_commands_helptext[-1] + "\n" + help_separator + "\n\t" + "*admin* **" + helpcommand[
-                "command"] + "**\n" + helpcommand["helptext"] + "\n" + help_separator) > 2000:
-                # We add another string to he list of messages we want to send
-                admin_commands_helptext.append("")
-
-            admin_commands_helptext[-1] += "\n" + help_separator + "\n\t" + "*admin* **" + helpcommand[
-                "command"] + "**\n" + helpcommand["helptext"]
-
-    # How many seconds we should wait between each message
-    cooldown_time = 0.5
+    if helpers.is_member_fluxx_admin(message.author, passed_config):
+        help_embeds = help_pages["admin"]
+    else:
+        help_embeds = help_pages["public"]
 
     # Checking if we're in a private channel or a public channel so we can format our messages properly
     if not message.channel.is_private:
@@ -415,47 +507,15 @@ async def cmd_help(message: discord.Message, passed_client: discord.Client, pass
         await passed_client.send_message(message.channel,
                                          "Sure thing " + message.author.mention + ", you'll see the commands and how to use them in our PMs :smile:")
 
-    # Checking if the issuer is an admin user, so we know if we should show them the admin commands
-    if int(message.author.id) in passed_config["somewhat_weird_shit"]["admin_user_ids"]:
-
-        # Just putting the helptexts we made in the PM with the command issuer
-        await passed_client.send_message(message.author, "Ok, here are the commands you can use me for :smile:")
-
-        # We send the helptexts in multiple messages to bypass the 2000 char limit, and we pause between each message to not get rate-limited
-        for helptext in public_commands_helptext:
-            # We wait for a bit to not get rate-limited
-            await asyncio.sleep(cooldown_time)
-
-            # We send the help message
-            await passed_client.send_message(message.author, helptext)
-
-        # Informing the user that they're an admin
+    # We send the help embeds in the PM with the command issuer, the first one along with our greeting
+    for i, help_embed in enumerate(help_embeds):
         await passed_client.send_message(message.author,
-                                         help_separator + "\nSince you're an fluxx-bot admin, you also have access to:")
-
-        for helptext in admin_commands_helptext:
-            # We wait for a bit to not get rate-limited
-            await asyncio.sleep(cooldown_time)
-
-            # We send the help message
-            await passed_client.send_message(message.author, helptext)
-
-    else:
-
-        # Just putting the helptexts we made in the PM with the command issuer
-        await passed_client.send_message(message.author, "Ok, here are the commands you can use me for :smile:")
-
-        # We send the helptexts in multiple messages to bypass the 2000 char limit, and we pause between each message to not get rate-limited
-        for helptext in public_commands_helptext:
-            # We wait for a bit to not get rate-limited
-            await asyncio.sleep(cooldown_time)
-
-            # We send the help message
-            await passed_client.send_message(message.author, helptext)
+                                         "Ok, here are the commands you can use me for :smile:" if i == 0 else None,
+                                         embed=help_embed)
 
     # Sending a finishing message (on how to use the commands in a regular channel)
     await passed_client.send_message(message.author,
-                                     help_separator + "\nTo use commands in a regular server channel, just do \"" + client_mention + " **COMMAND**\"")
+                                     "To use commands in a regular server channel, just do \"" + client_mention + " **COMMAND**\"")
 
 
 @main_code.command_decorator.command("reload config", "Reloads the config file that fluxx-bot uses.", admin=True)
@@ -477,13 +537,12 @@ async def cmd_admin_reload_config(message: discord.Message, passed_client: disco
     # Logging that we're loading the config
     helpers.log_info("Reloading the config file...")
 
-    # Loading the config file and then parsing it as json and storing it in a python object
-    with open("config.json", mode="r", encoding="utf-8") as opened_config_file:
-        global config
-        config = json.load(opened_config_file)
+    # Loading the config file (in an executor, so we don't block) and swapping in the new config snapshot
+    # The join and leave message channels are rebuilt by the config manager's reload listener
+    config = await config_manager.reload(passed_client.loop)
 
     # Logging that we're done loading the config
-    helpers.log_info("Done reloading the config")
+    helpers.log_info("Done reloading the config, it's now version {0}".format(config.version))
 
     # Telling the issuing user that we're done reloading the config file
     await passed_client.send_message(message.channel, "Done reloading the config file!")
@@ -517,55 +576,83 @@ def set_special_param(index: int, value):
     We need this function since python doesn't have a concept of references."""
 
     global ignored_command_message_ids
-    global config
 
     # This code is really ugly because we need performance (dictionaries with lambdas with exec it very slow since it compiles every time we define it),
     # because python doesn't have any concept of references, and because python doesn't have any equivalent to switch/case
     if index == 0:
-        ignored_command_message_ids = value
+        # Commands may return a new plain list of ids, so we make sure we always keep the bounded and expiring set
+        if isinstance(value, main_code.expiring_id_set.ExpiringIdSet):
+            ignored_command_message_ids = value
+        else:
+            ignored_command_message_ids = main_code.expiring_id_set.ExpiringIdSet(
+                value, ignored_command_message_ids.max_size, ignored_command_message_ids.ttl)
     elif index == 1:
-        config = value
+        # We only swap in a new snapshot if the command actually returned a different config
+        if value is not config_manager.get():
+            config_manager.replace(value)
 
 
 # We define the objects that we have to use in the file scope
-# The config object
-config = {}
+# The config manager, it holds the current config snapshot
+config_manager = main_code.config_manager.ConfigManager("config.json")
 # Public commands
 public_commands = []
 # Admin commands
 admin_commands = []
+# The prefix trie used to look up which command a message uses
+command_router = main_code.command_router.CommandRouter([], [])
+# The help embeds for each audience, built from the commands
+help_pages = {"public": [], "admin": []}
 # Functions to run when people join a server
 join_functions = []
 # Msg ideas that should be ignored
-ignored_command_message_ids = []
+ignored_command_message_ids = main_code.expiring_id_set.ExpiringIdSet()
 # Voice stream players for each server
 server_and_stream_players = []
+# The channels that join and leave messages are sent to, indexed by server
+announcement_channel_index = main_code.announcement_channels.AnnouncementChannelIndex()
+# The batcher for join and leave messages
+member_event_batcher = None
+# The monitor that warns when something blocks the event loop
+loop_monitor = None
+# The task that starts the metrics endpoint, which keeps retrying while the port is in use
+metrics_server_task = None
 
 
-def start_fluxx():
-    """Starts fluxx-bot, and returns when fluxx exits. If fluxx throws an exception, this exception is propagated. If fluxx exits peacefully, this returns with no exception."""
+def setup_fluxx():
+    """Loads the config and sets up everything the event handlers need, without connecting to discord.
+    This is separate from start_fluxx so the event handlers can be driven without a connection, such as by the benchmark."""
 
     # Logging that we're loading the config
     helpers.log_info("Loading the config file...")
 
     # We make sure we use the global objects
-    global config, public_commands, admin_commands, join_functions, ignored_command_message_ids, server_and_stream_players
-    config = {}
+    global public_commands, admin_commands, command_router, help_pages, join_functions, member_event_batcher, loop_monitor, ignored_command_message_ids, server_and_stream_players
+
+    # We store the bot start time in the volatile stats section of the config file
+    # This is an update of what's in the file (made while holding the file's lock), so we don't overwrite what other shards or processes write
+    start_time = time.time()
+
+    def set_start_time(current_config: dict) -> dict:
+        current_config["stats"]["volatile"]["start_time"] = start_time
+        return current_config
 
-    # Loading the config file and then parsing it as json and storing it in a python object
-    with open("config.json", mode="r", encoding="utf-8") as config_file:
-        config = json.load(config_file)
+    helpers.config_file_writer.update(set_start_time)
 
-    # We store the bot start time in the volatile stats section
-    config["stats"]["volatile"]["start_time"] = time.time()
+    # We load the config into the config manager, which is what everything reads the config from
+    # The join and leave message channels are rebuilt whenever the config changes
+    config_manager.add_listener(lambda snapshot: announcement_channel_index.rebuild(snapshot, client))
+    config = config_manager.load()
 
-    # We write the modified config back to the file
-    with open("config.json", mode="w", encoding="utf-8") as config_file:
-        json.dump(config, config_file, indent=2, sort_keys=False)
+    # The config file watcher shouldn't reload the config every time we write to the file ourselves (such as when the stats are flushed)
+    helpers.config_file_writer.add_write_listener(config_manager.note_own_write)
 
     # Logging that we're done loading the config
     helpers.log_info("Done loading the config")
 
+    # We load the persisted stats counters so the in memory counters start from the right values
+    main_code.stats.load(config)
+
     commands = main_code.command_decorator.get_command_lists()
 
     # The commands people can use and the method that will be called when a command is used
@@ -580,20 +667,73 @@ def start_fluxx():
     public_commands.extend(commands[0])
     admin_commands.extend(commands[1])
 
+    # We build the command trie and the help pages once, so neither looking up a command nor sending help depends on how many commands there are
+    command_router = main_code.command_router.CommandRouter(public_commands, admin_commands)
+    help_pages = main_code.help_pages.build_help_pages(public_commands, admin_commands)
+
     # The functions to call when someone joins the server, these get passed the member object of the user who joined
     join_functions = [join_welcome_message, join_send_pm]
 
-    # The list of message ids (this list will fill and empty) that the command checker should ignore
-    ignored_command_message_ids = []
+    # The batcher that merges join and leave messages for members that join or leave a server at around the same time
+    member_event_batcher = main_code.member_events.MemberEventBatcher(
+        client.loop, announce_members, window=config["somewhat_weird_shit"].get("member_event_window", 2),
+        pm_concurrency=config["somewhat_weird_shit"].get("max_concurrent_join_pms", 5))
+
+    # We report how many join and leave announcements the batcher merged away
+    main_code.stats.register_gauge("member_announcements_merged",
+                                   lambda: member_event_batcher.get_stats()["announcements_merged"])
+
+    # The set of message ids that the command checker should ignore, ids expire so it can't grow forever if the ignored messages never show up
+    ignored_command_message_ids = main_code.expiring_id_set.ExpiringIdSet(
+        max_size=config["somewhat_weird_shit"].get("max_ignored_message_ids", 10000),
+        ttl=config["somewhat_weird_shit"].get("ignored_message_id_ttl", 600))
+
+    # We report how many ids we're ignoring, we use a lambda since the set object gets replaced by commands
+    main_code.stats.register_gauge("ignored_command_message_ids", lambda: len(ignored_command_message_ids))
+
+    # We report how many servers we're on, when we're sharded the launcher adds up the servers of all the shards
+    main_code.stats.register_gauge("servers", lambda: len(client.servers))
+
+    # We report how well the external api response cache works
+    for cache_stat in ("hits", "misses", "evictions", "coalesced", "entries", "bytes"):
+        main_code.stats.register_gauge("api_cache_" + cache_stat,
+                                       lambda cache_stat=cache_stat: helpers.api_response_cache.get_stats()[cache_stat])
+
+    # We report how many log records are waiting to be written, and how many were dropped because the log queue was full
+    main_code.stats.register_gauge("log_records_queued", lambda: helpers.get_log_stats()["queued_records"])
+    main_code.stats.register_gauge("log_records_dropped", lambda: helpers.get_log_stats()["dropped_records"])
 
     # The list of tuples of voice stream players and server ids
     server_and_stream_players = []
 
+    # The monitor that measures the event loop lag and reports what blocked the loop when it stalls, it's started in on_ready
+    loop_monitor = main_code.loop_monitor.LoopMonitor(
+        client.loop, interval=config["somewhat_weird_shit"].get("loop_lag_interval", 0.5),
+        threshold=config["somewhat_weird_shit"].get("loop_lag_threshold", 0.25),
+        warning_interval=config["somewhat_weird_shit"].get("loop_lag_warning_interval", 60),
+        log_function=helpers.log_warning)
+
+    # asyncio's slow callback warnings make everything slower, so they're only reported if they're turned on in the config
+    if config["somewhat_weird_shit"].get("report_slow_callbacks", False):
+        loop_monitor.enable_slow_callback_reports()
+
+    main_code.stats.register_gauge("event_loop_stalls", lambda: loop_monitor.get_stats()["stalls"])
+
+
+def start_fluxx():
+    """Starts fluxx-bot, and returns when fluxx exits. If fluxx throws an exception, this exception is propagated. If fluxx exits peacefully, this returns with no exception."""
+
+    setup_fluxx()
+    config = config_manager.get()
+
+    # If the launcher hands off between processes, it tells us on stdin when we should drain and exit
+    main_code.handoff.start_listening(client.loop, drain_and_exit)
+
     # Logging that we're starting the bot
     helpers.log_info("fluxx-bot is now logging in (you'll notice if we get any errors)")
 
     # Storing the time at which the bot was started
-    config["stats"]["volatile"]["start_time"] = time.time()
+    start_time = time.time()
 
     try:
         # We have a while loop here because some errors are only catchable from the client.run method, as they are raised by tasks in the event loop
@@ -646,9 +786,19 @@ def start_fluxx():
         helpers.log_info("Client exited, but we didn't get an error, probably CTRL+C or command exit...")
         exit_code = 0
 
+    # The event loop has stopped for good, so there's nothing left to watch
+    loop_monitor.stop()
+
+    # We write out the stats counters and the config updates that haven't been written yet
+    try:
+        main_code.stats.flush()
+        helpers.config_file_writer.flush_sync()
+    except (OSError, ValueError) as e:
+        helpers.log_warning("Wasn't able to write the config on exit, error message: {0}".format(str(e)))
+
     # Calculating and formatting how long the bot was online so we can log it, this is on multiple statements for clarity
     end_time = time.time()
-    uptime_secs_noformat = (end_time - config["stats"]["volatile"]["start_time"]) // 1
+    uptime_secs_noformat = (end_time - start_time) // 1
     formatted_uptime = helpers.get_formatted_duration_fromtime(uptime_secs_noformat)
 
     # Logging that we've stopped the bot
@@ -0,0 +1,364 @@
+#! /usr/bin/env python3.5
+"""The fluxx-bot benchmark, it drives the bot's event handlers with stand-in discord objects and synthetic workloads, without any network.
+It reports how many events per second the handlers get through, their median and 99th percentile latency, and how many API calls they made,
+so changes to the message pipeline can be measured against a saved baseline.
+It runs in a temporary directory with a generated config, so it never touches the real config.json or log file."""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# The directory the bot's code is in, we run in a temporary directory, so we have to be able to import from here
+bot_directory = os.path.dirname(os.path.abspath(__file__))
+
+# The id of the bot user and of the admin user in the generated config
+bot_user_id = "100000000000000000"
+admin_user_id = "100000000000000001"
+
+# The words chat messages are made of
+chat_words = ("fluxx", "modpack", "server", "crash", "lag", "mod", "update", "world", "base", "reactor", "ore", "help",
+              "anyone", "online", "restart", "version", "config", "java", "memory", "pipes", "power", "thanks", "lol")
+
+# The workloads, as the weights of the kinds of events they're made of
+workloads = collections.OrderedDict([
+    ("chat", {"chat": 1.}),
+    ("mixed", {"chat": 0.8, "command": 0.1, "unknown_command": 0.05, "admin_command": 0.05}),
+    ("commands", {"command": 0.7, "unknown_command": 0.3}),
+    ("admin_commands", {"admin_command": 1.}),
+    ("attachments", {"attachments": 1.}),
+    ("join_storm", {"join": 0.5, "leave": 0.5}),
+])
+
+
+def get_server_id(number: int) -> str:
+    """Returns the id of the numberth stand-in server, its channels' ids are the server id followed by the channel number."""
+    return str(200000000000000000 + number * 100)
+
+
+def get_benchmark_config(server_ids: list, member_event_window: float) -> dict:
+    """Returns the config the bot runs with during the benchmark, every server has join and leave messages enabled in its first channel."""
+    return {
+        "credentials": {"token": "benchmark", "mashape_api_key": "benchmark"},
+        "logging": {"log_file_name": "benchmark.log"},
+        "log_config": {"use_email_notifications": False, "ignored_log_user_names": [], "ignored_log_channels": []},
+        "somewhat_weird_shit": {"admin_user_ids": [int(admin_user_id)], "member_event_window": member_event_window},
+        "stats": {"volatile": {}},
+        "join_msg": {"welcome_msg": "Welcome {0} to {1}!", "pm_msg": "Hi {0}, welcome to {1}, please read the rules.",
+                     "server_and_channel_id_pairs": [[server_id, server_id + "0"] for server_id in server_ids]},
+        "leave_msg": {"leave_msg": "{0} left {1}.",
+                      "server_and_channel_id_pairs": [[server_id, server_id + "0"] for server_id in server_ids]},
+    }
+
+
+def get_percentile(sorted_values: list, percentile: float) -> float:
+    if not sorted_values:
+        return 0.
+
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentile))]
+
+
+def run_benchmark(args) -> dict:
+    """Sets up the bot with stand-in discord objects, runs the workloads, and returns the results keyed by workload name.
+    This has to run with the temporary directory as the current directory, since the bot reads config.json when it's imported."""
+
+    # We only import discord and the bot now, since the bot loads the config when it's imported
+    import discord
+    import bot_main
+    from main_code import helpers
+
+    # The bot echoes what it logs to the console, which we don't want to see (or measure the terminal's speed with)
+    # The log pipeline's thread writes it to the stream the console handler got when it was created, so redirecting sys.stdout doesn't help
+    # We don't point it back afterwards, since the records that are still queued would be written to the terminal then
+    helpers.console_handler.acquire()
+    try:
+        helpers.console_handler.stream = open(os.devnull, mode="w")
+    finally:
+        helpers.console_handler.release()
+
+    class StandInUser:
+        """Stands in for a discord.User or discord.Member."""
+
+        def __init__(self, user_id: str, name: str, server=None, bot: bool = False):
+            self.id = user_id
+            self.name = name
+            self.display_name = name
+            self.server = server
+            self.bot = bot
+            self.roles = []
+            self.mention = "<@{0}>".format(user_id)
+
+    class StandInServer:
+        """Stands in for a discord.Server."""
+
+        def __init__(self, server_id: str, name: str, channel_count: int):
+            self.id = server_id
+            self.name = name
+            self.channels = [StandInChannel(server_id + str(number), "channel-{0}".format(number), self) for number in
+                             range(channel_count)]
+            self.roles = []
+            self.members = []
+            self.me = StandInUser(bot_user_id, "fluxx-bot", self, bot=True)
+
+    class StandInChannel:
+        """Stands in for a discord.Channel (or a discord.PrivateChannel if server is None)."""
+
+        def __init__(self, channel_id: str, name: str, server=None, user=None):
+            self.id = channel_id
+            self.name = name
+            self.server = server
+            self.user = user
+            self.is_private = server is None
+            self.type = discord.ChannelType.private if server is None else discord.ChannelType.text
+            self.mention = "<#{0}>".format(channel_id)
+
+    class StandInMessage(discord.Message):
+        """Stands in for a discord.Message, it's a subclass since the helpers check if they're passed a message or a string."""
+
+        def __init__(self, message_id: str, content: str, author, channel, attachments=()):
+            self.id = message_id
+            self.content = content
+            self.author = author
+            self.channel = channel
+            self.server = channel.server
+            self.attachments = list(attachments)
+            self.type = discord.MessageType.default
+            self.mentions = []
+            self.embeds = []
+
+    class StandInClient:
+        """Stands in for the discord client, every API call is counted (and takes api_latency seconds) instead of going over the network."""
+
+        def __init__(self, loop: asyncio.AbstractEventLoop, servers: list, api_latency: float):
+            self.loop = loop
+            self.servers = servers
+            self.api_latency = api_latency
+            self.user = StandInUser(bot_user_id, "fluxx-bot", bot=True)
+            self.shard_id = None
+            self.shard_count = None
+
+            # How many times every API method was called
+            self.api_calls = collections.Counter()
+
+        async def _api_call(self, method_name: str):
+            self.api_calls[method_name] += 1
+
+            if self.api_latency:
+                await asyncio.sleep(self.api_latency)
+
+        async def send_message(self, destination, content=None, *, tts=False, embed=None):
+            await self._api_call("send_message")
+
+            channel = destination if isinstance(destination, StandInChannel) else StandInChannel(
+                destination.id, destination.name, user=destination)
+            return StandInMessage(str(random.getrandbits(60)), content or "", self.user, channel)
+
+        async def edit_message(self, message, new_content=None, *, embed=None):
+            await self._api_call("edit_message")
+
+            message.content = new_content or message.content
+            return message
+
+        def __getattr__(self, name: str):
+            # Any other API method is counted without doing anything
+            async def api_call(*args, **kwargs):
+                await self._api_call(name)
+
+            return api_call
+
+    loop = asyncio.get_event_loop()
+
+    rng = random.Random(args.seed)
+    servers = [StandInServer(get_server_id(number), "server-{0}".format(number), args.channels) for number in
+               range(args.servers)]
+    users = [StandInUser(str(300000000000000000 + number), "user-{0}".format(number)) for number in range(args.users)]
+    admin_user = StandInUser(admin_user_id, "admin")
+
+    stand_in_client = StandInClient(loop, servers, args.api_latency)
+    client_mention = "<@!{0}>".format(bot_user_id)
+
+    # The bot's handlers use the client global, so we put the stand-in there before the bot is set up
+    bot_main.client = stand_in_client
+    bot_main.setup_fluxx()
+    loop.run_until_complete(bot_main.on_ready())
+
+    message_counter = [0]
+
+    def make_message(content: str, author, attachments=()) -> StandInMessage:
+        message_counter[0] += 1
+
+        # Some messages are PMs, the rest are sent in a random channel on a random server
+        if rng.random() < args.pm_fraction:
+            channel = StandInChannel(str(400000000000000000 + message_counter[0]), "pm", user=author)
+        else:
+            channel = rng.choice(rng.choice(servers).channels)
+
+        return StandInMessage(str(500000000000000000 + message_counter[0]), content, author, channel, attachments)
+
+    def make_event(kind: str):
+        """Returns a coroutine that handles a synthetic event of the kind."""
+        if kind == "chat":
+            return bot_main.on_message(
+                make_message(" ".join(rng.choice(chat_words) for _ in range(rng.randint(3, 25))), rng.choice(users)))
+        elif kind == "command":
+            return bot_main.on_message(make_message(client_mention + " help", rng.choice(users)))
+        elif kind == "unknown_command":
+            return bot_main.on_message(make_message(client_mention + " " + rng.choice(chat_words), rng.choice(users)))
+        elif kind == "admin_command":
+            return bot_main.on_message(make_message(client_mention + " admin stats", admin_user))
+        elif kind == "attachments":
+            attachments = []
+            for number in range(rng.randint(1, 10)):
+                attachment = {"filename": "file-{0}.png".format(number), "size": rng.randint(1000, 8000000)}
+                if rng.random() < 0.7:
+                    attachment.update(width=rng.randint(100, 4000), height=rng.randint(100, 4000))
+                attachments.append(attachment)
+
+            return bot_main.on_message(make_message(rng.choice(chat_words), rng.choice(users), attachments))
+        elif kind in ("join", "leave"):
+            # Storms hit one server, so the join and leave messages get merged
+            server = servers[0]
+            member = StandInUser(str(600000000000000000 + rng.getrandbits(32)), "member", server)
+            return bot_main.on_member_join(member) if kind == "join" else bot_main.on_member_remove(member)
+
+        raise ValueError("Unknown event kind " + kind)
+
+    async def timed(coroutine, latencies: list):
+        start_time = time.perf_counter()
+        await coroutine
+        latencies.append(time.perf_counter() - start_time)
+
+    async def run_workload(weights: dict) -> dict:
+        kinds = list(weights.keys())
+        kind_weights = [weights[kind] for kind in kinds]
+        events = [choose_weighted(rng, kinds, kind_weights) for _ in range(args.events)]
+
+        latencies = []
+        api_calls_before = collections.Counter(stand_in_client.api_calls)
+
+        # discord.py runs every event as its own task, we do the same, concurrency events at a time
+        start_time = time.perf_counter()
+        for batch_start in range(0, len(events), args.concurrency):
+            await asyncio.gather(*[timed(make_event(kind), latencies) for kind in
+                                   events[batch_start:batch_start + args.concurrency]])
+        elapsed = time.perf_counter() - start_time
+
+        # We wait for the merged join and leave messages to be sent, so they're counted
+        await asyncio.sleep(args.member_event_window * 2 + 0.1)
+
+        api_calls = stand_in_client.api_calls - api_calls_before
+        latencies.sort()
+        return {"events": len(events), "seconds": elapsed, "events_per_second": len(events) / elapsed,
+                "p50_ms": get_percentile(latencies, 0.5) * 1000, "p99_ms": get_percentile(latencies, 0.99) * 1000,
+                "api_calls": sum(api_calls.values()), "api_calls_by_method": dict(api_calls)}
+
+    results = collections.OrderedDict()
+    for workload_name in args.workloads:
+        results[workload_name] = loop.run_until_complete(run_workload(workloads[workload_name]))
+
+    return results
+
+
+def choose_weighted(rng: random.Random, kinds: list, weights: list):
+    """Picks a kind by weight, random.choices doesn't exist before python 3.6."""
+    target = rng.random() * sum(weights)
+    for kind, weight in zip(kinds, weights):
+        target -= weight
+        if target < 0:
+            return kind
+
+    return kinds[-1]
+
+
+def print_results(results: dict, baseline: dict = None):
+    print("{0:<16}{1:>8}{2:>12}{3:>10}{4:>10}{5:>10}".format("workload", "events", "events/s", "p50 ms", "p99 ms",
+                                                            "api calls"))
+
+    for workload_name, result in results.items():
+        print("{0:<16}{1:>8}{2:>12.1f}{3:>10.2f}{4:>10.2f}{5:>10}".format(
+            workload_name, result["events"], result["events_per_second"], result["p50_ms"], result["p99_ms"],
+            result["api_calls"]))
+
+        # We show how much faster or slower we are than the baseline
+        if baseline and workload_name in baseline:
+            base_result = baseline[workload_name]
+            print("{0:<16}{1:>8}{2:>+11.1f}%{3:>+9.1f}%{4:>+9.1f}%{5:>+10}".format(
+                "  vs baseline", "", (result["events_per_second"] / base_result["events_per_second"] - 1) * 100,
+                (result["p50_ms"] / base_result["p50_ms"] - 1) * 100 if base_result["p50_ms"] else 0.,
+                (result["p99_ms"] / base_result["p99_ms"] - 1) * 100 if base_result["p99_ms"] else 0.,
+                result["api_calls"] - base_result["api_calls"]))
+
+
+def parse_cli_arguments():
+    parser = argparse.ArgumentParser(description="The fluxx-bot benchmark, it runs the event handlers without any network")
+    parser.add_argument("--workloads", "-w",
+                        help="The workloads to run, out of: " + ", ".join(workloads.keys()),
+                        nargs="+", choices=list(workloads.keys()), default=list(workloads.keys()))
+    parser.add_argument("--events", "-n",
+                        help="How many events every workload consists of",
+                        type=int, default=2000)
+    parser.add_argument("--concurrency", "-c",
+                        help="How many events are handled at the same time",
+                        type=int, default=50)
+    parser.add_argument("--servers",
+                        help="How many servers the bot is on",
+                        type=int, default=20)
+    parser.add_argument("--channels",
+                        help="How many channels every server has",
+                        type=int, default=10)
+    parser.add_argument("--users",
+                        help="How many different users send messages",
+                        type=int, default=500)
+    parser.add_argument("--pm-fraction",
+                        help="The fraction of the messages that are sent in PMs",
+                        type=float, default=0.1)
+    parser.add_argument("--api-latency",
+                        help="How long (in seconds) every API call takes",
+                        type=float, default=0.)
+    parser.add_argument("--member-event-window",
+                        help="How long (in seconds) join and leave messages are collected before they're sent",
+                        type=float, default=0.2)
+    parser.add_argument("--seed",
+                        help="The seed of the synthetic workloads, so runs can be compared",
+                        type=int, default=0)
+    parser.add_argument("--save",
+                        help="Saves the results as json to this file, to be used as a baseline later")
+    parser.add_argument("--baseline",
+                        help="Compares the results to the results saved in this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_cli_arguments()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, mode="r", encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+
+    # We run in a temporary directory with a generated config, so we don't touch the real config, stats or logs
+    benchmark_directory = tempfile.mkdtemp(prefix="fluxx_benchmark_")
+    original_directory = os.getcwd()
+    try:
+        server_ids = [get_server_id(number) for number in range(args.servers)]
+        with open(os.path.join(benchmark_directory, "config.json"), mode="w", encoding="utf-8") as config_file:
+            json.dump(get_benchmark_config(server_ids, args.member_event_window), config_file, indent=2)
+
+        os.chdir(benchmark_directory)
+        sys.path.insert(0, bot_directory)
+
+        results = run_benchmark(args)
+    finally:
+        os.chdir(original_directory)
+        shutil.rmtree(benchmark_directory, ignore_errors=True)
+
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, mode="w", encoding="utf-8") as save_file:
+            json.dump(results, save_file, indent=2)
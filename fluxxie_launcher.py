@@ -1,13 +1,19 @@
 #! /usr/bin/env python3.5
 import argparse
+import json
 import os
-import subprocess
+import signal
 import sys
 import time
 import traceback
 from importlib.util import find_spec
 from sys import platform as _platform
 
+from main_code import child_logs
+from main_code import config_writer
+from main_code import sharding
+from main_code import supervisor
+
 # The modules that have to be available for fluxx-bot to be able to run
 required_modules = {"discord", "aiohttp", "aiodns", "asyncio"}
 
@@ -51,6 +57,60 @@ def parse_cli_arguments():
     parser.add_argument("--auto-restart", "-r",
                         help="Autorestarts fluxx-bot if it stops",
                         action="store_true")
+    parser.add_argument("--log-file",
+                        help="The file that fluxx-bot's output is logged to, it can't be the log file from the config (which the bot writes itself)",
+                        default="fluxx_output.log")
+    parser.add_argument("--log-max-bytes",
+                        help="How big the log file may get (in bytes) before it's rotated",
+                        type=int, default=10 * 1024 * 1024)
+    parser.add_argument("--log-backups",
+                        help="How many rotated log files to keep",
+                        type=int, default=5)
+    parser.add_argument("--compress-logs", "-c",
+                        help="Gzips the rotated log files",
+                        action="store_true")
+    parser.add_argument("--supervise",
+                        help="Starts fluxx-bot and keeps it running, restarting it with exponential backoff when it exits or stops responding",
+                        action="store_true")
+    parser.add_argument("--backoff-base",
+                        help="The longest wait (in seconds) before the first restart in supervisor mode, it doubles with every restart in a row",
+                        type=float, default=5)
+    parser.add_argument("--backoff-max",
+                        help="The longest wait (in seconds) before a restart in supervisor mode",
+                        type=float, default=300)
+    parser.add_argument("--stable-time",
+                        help="How long (in seconds) fluxx-bot has to run for the backoff to be reset in supervisor mode",
+                        type=float, default=600)
+    parser.add_argument("--heartbeat-file",
+                        help="The file fluxx-bot touches to show it's alive in supervisor mode",
+                        default="fluxx_heartbeat")
+    parser.add_argument("--heartbeat-interval",
+                        help="How often (in seconds) fluxx-bot sends a heartbeat in supervisor mode",
+                        type=float, default=10)
+    parser.add_argument("--heartbeat-timeout",
+                        help="How long (in seconds) fluxx-bot can go without a heartbeat before it's restarted in supervisor mode",
+                        type=float, default=60)
+    parser.add_argument("--shards",
+                        help="How many gateway shards (each in its own fluxx-bot process) to run in supervisor mode",
+                        type=int, default=1)
+    parser.add_argument("--shard-start-interval",
+                        help="How long (in seconds) to wait between starting the shards, discord only allows logging in every 5 seconds",
+                        type=float, default=6)
+    parser.add_argument("--stats-file",
+                        help="The file the combined stats of all the shards are written to in supervisor mode",
+                        default="fluxx_stats.json")
+    parser.add_argument("--stats-interval",
+                        help="How often (in seconds) the combined stats are written in supervisor mode",
+                        type=float, default=60)
+    parser.add_argument("--handoff-file",
+                        help="Creating this file makes the launcher hand off to a new fluxx-bot process without downtime in supervisor mode",
+                        default="fluxx_handoff")
+    parser.add_argument("--drain-timeout",
+                        help="How long (in seconds) the old fluxx-bot process gets to finish its running commands after a handoff",
+                        type=float, default=60)
+    parser.add_argument("--startup-timeout",
+                        help="How long (in seconds) fluxx-bot has to send its first heartbeat after being started in supervisor mode",
+                        type=float, default=180)
     return parser.parse_args()
 
 
@@ -66,7 +126,24 @@ def verify_requirements():
     return True
 
 
-def start_fluxx_bot_process(auto_restart: bool):
+def run_fluxx_process(start_cmd: tuple, log_file: child_logs.RotatingLogFile) -> int:
+    """Runs fluxx-bot until it exits and returns its exit code. Its stdout and stderr are streamed into the log file (and to the console) line by line,
+    so we never keep more than a line of its output in memory."""
+
+    fluxx_process = supervisor.FluxxProcess(start_cmd, log_file, log_function=launcher_log)
+
+    try:
+        fluxx_process.process.wait()
+    except KeyboardInterrupt:
+        # fluxx-bot gets the CTRL+C as well, so we let it shut down and log its last output before we pass it on
+        fluxx_process.finish()
+        raise
+
+    fluxx_process.finish()
+    return fluxx_process.poll()
+
+
+def start_fluxx_bot_process(auto_restart: bool, log_file: child_logs.RotatingLogFile):
     # We verify that all required modules are installed
     if not verify_requirements():
         launcher_log("You do not have all requirements installed, please see the readme.")
@@ -91,10 +168,8 @@ def start_fluxx_bot_process(auto_restart: bool):
         launcher_log("Launching fluxx-bot file...")
         print("-" * 25 + "fluxx-Bot" + "-" * 25)
         try:
-            # We redirect stderr to the log file
-            with open("discord.log", encoding="utf-8", mode="a") as log_file:
-                exited_process = _start_fluxx(subprocess.run, start_cmd, universal_newlines=True, stdin=subprocess.PIPE,
-                                              stderr=subprocess.PIPE)
+            # We stream fluxx-bot's output to the log file
+            returncode = _start_fluxx(run_fluxx_process, start_cmd, log_file)
         except KeyboardInterrupt:
             print()
             launcher_log("Exiting because of CTRL+C.")
@@ -105,10 +180,10 @@ def start_fluxx_bot_process(auto_restart: bool):
             break
 
         print("-" * 58)
-        launcher_log("fluxx-bot has exited with code {0}.".format(exited_process.returncode))
+        launcher_log("fluxx-bot has exited with code {0}.".format(returncode))
 
         # We analyze how fluxx was exited, and we relaunch if we're supposed to
-        if exited_process.returncode == 0:
+        if returncode == 0:
             # Everything is fine
             if auto_restart:
                 launcher_log("Restarting fluxx-bot since you used the --restart flag.")
@@ -116,10 +191,10 @@ def start_fluxx_bot_process(auto_restart: bool):
             else:
                 launcher_log("Exiting since you didn't use the --restart flag")
                 break
-        elif exited_process.returncode < 0:
+        elif returncode < 0:
             # The process was exited by a POSIX signal, so we don't restart it, no matter what
             launcher_log(
-                "Exiting since fluxx-bot exited by POSIX signal, with code {0}".format(exited_process.returncode))
+                "Exiting since fluxx-bot exited by POSIX signal, with code {0}".format(returncode))
             break
         else:
             # fluxx-bot exited with an error code, but it wasn't by a POSIX signal, so we relaunch
@@ -132,11 +207,108 @@ def start_fluxx_bot_process(auto_restart: bool):
                 break
 
 
+def write_combined_stats(args):
+    """Combines the stats that the shards have exported into one view, and writes it to the stats file."""
+    shard_stats = [sharding.read_shard_stats(sharding.get_shard_stats_file_name(args.stats_file, shard_id)) for
+                   shard_id in range(args.shards)]
+
+    try:
+        config_writer.write_json_atomically(args.stats_file, sharding.combine_shard_stats(shard_stats))
+    except OSError as e:
+        launcher_log("Wasn't able to write the combined stats, error message: {0}".format(str(e)))
+
+
+def supervise_fluxx_bot_process(args, log_file: child_logs.RotatingLogFile):
+    """Runs fluxx-bot (one process per shard) and restarts every shard whenever it exits or stops sending heartbeats, until the launcher is stopped with CTRL+C.
+    The waits between restarts grow exponentially while a shard keeps failing, and are reset once it has run stably.
+    Creating the handoff file (or sending SIGHUP) starts new fluxx-bot processes that take over once they're ready, such as to deploy new code."""
+
+    # We verify that all required modules are installed
+    if not verify_requirements():
+        launcher_log("You do not have all requirements installed, please see the readme.")
+        return
+
+    interpreter = sys.executable
+    start_cmd = (interpreter, "bot_main.py")
+
+    if interpreter is None:
+        launcher_log("Could not find interpreter, exiting.")
+        return
+
+    # Every shard is supervised separately, and they're started one at a time since discord only lets us log in every few seconds
+    shard_supervisors = []
+    for shard_id in range(args.shards):
+        if args.shards > 1:
+            name = "fluxx-bot shard {0}".format(shard_id)
+            heartbeat_file = "{0}.shard{1}".format(args.heartbeat_file, shard_id)
+        else:
+            name = "fluxx-bot"
+            heartbeat_file = args.heartbeat_file
+
+        shard_supervisors.append(supervisor.ProcessSupervisor(
+            start_cmd, log_file,
+            supervisor.RestartBackoff(base=args.backoff_base, maximum=args.backoff_max, stable_time=args.stable_time),
+            heartbeat_file, heartbeat_interval=args.heartbeat_interval, heartbeat_timeout=args.heartbeat_timeout,
+            startup_timeout=args.startup_timeout, drain_timeout=args.drain_timeout,
+            environment=sharding.get_shard_environment(shard_id, args.shards, sharding.get_shard_stats_file_name(
+                args.stats_file, shard_id)),
+            start_delay=shard_id * args.shard_start_interval, name=name, log_function=launcher_log))
+
+    # SIGHUP requests a handoff as well, on the platforms that have it
+    handoff_signal_received = [False]
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signal_number, frame: handoff_signal_received.__setitem__(0, True))
+
+    # The shards that should hand off, we do one at a time so the new processes don't all log in at once
+    handoff_queue = []
+
+    last_stats_time = time.monotonic()
+
+    try:
+        while True:
+            if handoff_signal_received[0] or os.path.exists(args.handoff_file):
+                handoff_signal_received[0] = False
+                try:
+                    os.remove(args.handoff_file)
+                except OSError:
+                    pass
+
+                handoff_queue.extend(
+                    shard_supervisor for shard_supervisor in shard_supervisors if shard_supervisor not in handoff_queue)
+
+            if handoff_queue and not any(shard_supervisor.is_handing_off() for shard_supervisor in shard_supervisors):
+                handoff_queue.pop(0).request_handoff()
+
+            for shard_supervisor in shard_supervisors:
+                shard_supervisor.poll()
+
+            if time.monotonic() - last_stats_time >= args.stats_interval:
+                last_stats_time = time.monotonic()
+                write_combined_stats(args)
+
+            time.sleep(1)
+    except KeyboardInterrupt:
+        # fluxx-bot gets the CTRL+C as well, so we let it shut down and log its last output
+        print()
+        launcher_log("Exiting because of CTRL+C.")
+        for shard_supervisor in shard_supervisors:
+            shard_supervisor.wait_for_exit()
+
+
 def launcher_log(*args):
     """Prints a message from fluxx_launcher instead of regular print."""
     print("fluxx_launcher: ", *args)
 
 
+def get_bot_log_file_name():
+    """Returns the log file that fluxx-bot writes its own log to (from the config), or None if the config can't be read."""
+    try:
+        with open("config.json", mode="r", encoding="utf-8") as config_file:
+            return json.load(config_file)["logging"]["log_file_name"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
 # The command line args passed to the launcher
 args = parse_cli_arguments()
 
@@ -148,14 +320,30 @@ if __name__ == '__main__':
     if args.start:
         launcher_log(
             "fluxx-bot launcher initiated with flags: " + ", ".join([pair for pair in vars(args) if vars(args)[pair]]))
+        # fluxx-bot writes its own log file, if we wrote its output to the same file every line would be in it twice,
+        # and rotating the file would leave the bot writing into the rotated one
+        bot_log_file_name = get_bot_log_file_name()
+        if bot_log_file_name is not None and os.path.abspath(bot_log_file_name) == os.path.abspath(args.log_file):
+            launcher_log("The --log-file ({0}) is the log file fluxx-bot writes itself, please use another file.".format(
+                args.log_file))
+            sys.exit(2)
+
         launcher_log("Starting fluxx-bot...")
+
+        # The log file is kept open across restarts, so it's rotated based on its total size
+        fluxx_log_file = child_logs.RotatingLogFile(args.log_file, max_bytes=args.log_max_bytes,
+                                                    backup_count=args.log_backups, compress=args.compress_logs)
         try:
-            start_fluxx_bot_process(auto_restart=args.auto_restart)
+            if args.supervise or args.shards > 1:
+                supervise_fluxx_bot_process(args, log_file=fluxx_log_file)
+            else:
+                start_fluxx_bot_process(auto_restart=args.auto_restart, log_file=fluxx_log_file)
         except BaseException:
             e_type, e, e_traceback = sys.exc_info()
             launcher_log("Got exception from fluxx-bot, will exit. Here is the traceback: \n{0}".format(
                 str("".join(traceback.format_exception(e_type, e, e_traceback)))))
         finally:
+            fluxx_log_file.close()
             launcher_log("fluxx-bot launcher is now exiting.")
     else:
         launcher_log(
@@ -0,0 +1,57 @@
+"""This file contains the index of the channels that join and leave messages are sent to, keyed by server id.
+It's compiled from the server_and_channel_id_pairs lists in the config, so member events don't have to scan the config and the server's channels."""
+import discord
+
+# The config sections that have server_and_channel_id_pairs lists
+announcement_features = ("join_msg", "leave_msg")
+
+
+class AnnouncementChannelIndex:
+    """Maps (feature, server id) to the resolved channel objects of that server that the feature sends messages to."""
+
+    def __init__(self):
+        # The configured channel ids, as {feature: {server id: [channel id, ...]}}, all ids are strings like discord.py uses
+        self._configured_ids = {feature: {} for feature in announcement_features}
+
+        # The resolved channels, as {feature: {server id: [channel, ...]}}
+        self._channels = {feature: {} for feature in announcement_features}
+
+    def rebuild(self, passed_config: dict, client: discord.Client):
+        """Recompiles the index from the config, and resolves the channels on all the servers the client is in."""
+
+        for feature in announcement_features:
+            # Each pair is a server id followed by any number of channel ids
+            self._configured_ids[feature] = {str(pair[0]): [str(channel_id) for channel_id in pair[1:]] for pair in
+                                             passed_config[feature]["server_and_channel_id_pairs"]}
+            self._channels[feature] = {}
+
+        for server in client.servers:
+            self.update_server(server)
+
+    def update_server(self, server: discord.Server):
+        """Re-resolves the channels of a server, this is called when the server's channels change."""
+
+        server_channels = {channel.id: channel for channel in server.channels}
+
+        for feature in announcement_features:
+            channel_ids = self._configured_ids[feature].get(server.id)
+
+            if channel_ids is None:
+                continue
+
+            # We only keep the channels that actually exist on the server
+            self._channels[feature][server.id] = [server_channels[channel_id] for channel_id in channel_ids if
+                                                  channel_id in server_channels]
+
+    def remove_server(self, server: discord.Server):
+        """Drops the resolved channels of a server we're no longer in."""
+        for feature in announcement_features:
+            self._channels[feature].pop(server.id, None)
+
+    def is_enabled(self, feature: str, server: discord.Server) -> bool:
+        """Returns True if the feature is configured for the server."""
+        return server.id in self._configured_ids[feature]
+
+    def get_channels(self, feature: str, server: discord.Server) -> list:
+        """Returns the channels of the server that the feature sends messages to."""
+        return self._channels[feature].get(server.id, [])
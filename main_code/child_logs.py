@@ -0,0 +1,130 @@
+"""This file contains the log capture that the launcher uses for the bot process's output.
+The output is streamed line by line into a size rotated log file (the rotated files can be gzipped), so the launcher's memory use
+doesn't grow no matter how long the bot runs. This only uses the standard library, since the launcher runs before the requirements are verified."""
+import gzip
+import os
+import shutil
+import sys
+import threading
+
+# The longest line we read at once, longer lines are split up, so a line without newlines can't use up the launcher's memory
+max_line_length = 64 * 1024
+
+
+class RotatingLogFile:
+    """A log file that is rotated when it would grow past max_bytes. The rotated files are named file_name.1 (the newest) to file_name.backup_count,
+    with .gz added if they're compressed. Writes can come from several threads."""
+
+    def __init__(self, file_name: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5, compress: bool = False):
+        self.file_name = file_name
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+
+        # Only one thread at a time may write or rotate
+        self._lock = threading.Lock()
+
+        # The thread that is compressing the last rotated file, we wait for it before rotating again
+        self._compress_thread = None
+
+        self._file = open(self.file_name, mode="ab")
+        self._size = self._file.tell()
+
+    def _backup_name(self, number: int) -> str:
+        return "{0}.{1}{2}".format(self.file_name, number, ".gz" if self.compress else "")
+
+    def _rotate(self):
+        """Moves the current file to file_name.1 (shifting the older backups up one step) and starts a new empty file."""
+        self._file.close()
+
+        # The older backups are renamed below, so the last compression has to be done with file_name.1 first
+        if self._compress_thread is not None:
+            self._compress_thread.join()
+            self._compress_thread = None
+
+        if self.backup_count > 0:
+            for number in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(self._backup_name(number)):
+                    os.replace(self._backup_name(number), self._backup_name(number + 1))
+
+            uncompressed_name = "{0}.1".format(self.file_name)
+            os.replace(self.file_name, uncompressed_name)
+
+            if self.compress:
+                # We compress in another thread so we can keep draining the bot's output meanwhile
+                self._compress_thread = threading.Thread(target=_compress_file,
+                                                         args=(uncompressed_name, self._backup_name(1)), daemon=True)
+                self._compress_thread.start()
+        else:
+            os.remove(self.file_name)
+
+        self._file = open(self.file_name, mode="ab")
+        self._size = 0
+
+    def write(self, data: bytes):
+        """Writes data to the log file, rotating it first if the data would make it too big."""
+        with self._lock:
+            if self._size and self._size + len(data) > self.max_bytes:
+                self._rotate()
+
+            self._file.write(data)
+            self._size += len(data)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        """Closes the log file and waits for any compression to finish."""
+        with self._lock:
+            self._file.close()
+
+            if self._compress_thread is not None:
+                self._compress_thread.join()
+                self._compress_thread = None
+
+
+def _compress_file(file_name: str, compressed_file_name: str):
+    """Gzips file_name into compressed_file_name and removes file_name."""
+    with open(file_name, mode="rb") as uncompressed_file, gzip.open(compressed_file_name + ".tmp",
+                                                                    mode="wb") as compressed_file:
+        shutil.copyfileobj(uncompressed_file, compressed_file)
+
+    os.replace(compressed_file_name + ".tmp", compressed_file_name)
+    os.remove(file_name)
+
+
+def pump_stream(stream, log_file: RotatingLogFile, prefix: bytes = b"", echo_stream=None):
+    """Reads stream line by line until it's closed, and writes every line (with prefix in front) to log_file.
+    If echo_stream is given, the lines are also written to it (such as the launcher's own stdout). This is blocking."""
+
+    for line in iter(lambda: stream.readline(max_line_length), b""):
+        log_file.write(prefix + line)
+
+        if echo_stream is not None:
+            try:
+                echo_stream.write(line)
+                echo_stream.flush()
+            except (OSError, ValueError):
+                # The console going away shouldn't stop us from logging
+                echo_stream = None
+
+    # The stream is closed, so the process has exited, and we make sure everything is on disk
+    log_file.flush()
+
+
+def start_pumping(process, log_file: RotatingLogFile, echo: bool = True) -> list:
+    """Starts threads that stream the process's stdout and stderr into log_file (and to our own stdout and stderr if echo is True),
+    the process has to be started with both of them as pipes.
+    Returns the threads, join them after the process has exited to make sure all its output has been written."""
+
+    threads = [threading.Thread(target=pump_stream,
+                                args=(process.stdout, log_file, b"", sys.stdout.buffer if echo else None), daemon=True),
+               threading.Thread(target=pump_stream,
+                                args=(process.stderr, log_file, b"[stderr] ", sys.stderr.buffer if echo else None),
+                                daemon=True)]
+
+    for thread in threads:
+        thread.start()
+
+    return threads
@@ -1,3 +1,5 @@
+from . import metrics
+
 public_commands = []
 admin_commands = []
 
@@ -12,17 +14,20 @@ def command(command_trigger: str, cmd_helptext: str, cmd_special_params=(False,
     # Decorators with arguments basically return a parametrised decorator that then gets to decorate the actual function
     def real_decorator(cmd_method):
 
+        # Every command is timed and counted, so we register a wrapper that does that
+        timed_method = metrics.timed_command(cmd_method, command_trigger, admin)
+
         # We append a cmd entry to the command list
         if not admin:
             # The command is public so we append to the public command list
-            public_commands.append(dict(command=command_trigger, method=cmd_method, helptext=cmd_helptext,
+            public_commands.append(dict(command=command_trigger, method=timed_method, helptext=cmd_helptext,
                                         special_params=cmd_special_params))
         else:
             # The command is an admin command, so we append to the admin command list
-            admin_commands.append(dict(command=command_trigger, method=cmd_method, helptext=cmd_helptext,
+            admin_commands.append(dict(command=command_trigger, method=timed_method, helptext=cmd_helptext,
                                        special_params=cmd_special_params))
 
-        # We actually don't modify the cmd method itself, we just need to register it as a command
+        # We actually don't modify the cmd method itself, only the registered command is timed
         return cmd_method
 
     return real_decorator
@@ -0,0 +1,58 @@
+"""This file contains the prefix trie that on_message uses to find which command (if any) a message is trying to use."""
+
+# The key in a trie node that holds the command entry that ends at that node (no trigger char can be None, so it never collides with a child)
+_ENTRY_KEY = None
+
+# The namespace that all admin command triggers live under
+ADMIN_PREFIX = "admin "
+
+
+def normalize_command_content(content: str) -> str:
+    """Normalizes command content (without any bot mention) the same way for every lookup, so we only have to do it once per message."""
+    return content.lower().strip()
+
+
+class CommandRouter:
+    """A prefix trie over all the normalized command triggers, including the admin namespace.
+    Looking up a message walks the trie once, so the cost only depends on the length of the message and not on how many commands there are."""
+
+    def __init__(self, public_commands: list, admin_commands: list):
+        # The root node of the trie, every node is a dict of chars to child nodes
+        self._root = {}
+
+        # We insert the admin commands first, so a public command with the same trigger wins (public commands were always checked first)
+        for command in admin_commands:
+            self._insert(ADMIN_PREFIX + normalize_command_content(command["command"]), command, True)
+
+        for command in public_commands:
+            self._insert(normalize_command_content(command["command"]), command, False)
+
+    def _insert(self, trigger: str, command: dict, admin: bool):
+        """Inserts a command entry at the end of the path for trigger, replacing any earlier entry with the exact same trigger."""
+
+        node = self._root
+        for char in trigger:
+            node = node.setdefault(char, {})
+
+        node[_ENTRY_KEY] = (command, admin)
+
+    def match(self, content: str, allow_admin: bool):
+        """Returns (command, is_admin_command) for the longest command trigger that content starts with, or (None, False) if no command matches.
+        content has to already be normalized with normalize_command_content. Admin commands only match if allow_admin is True."""
+
+        # The best match we've found so far
+        best = (None, False)
+
+        node = self._root
+        for char in content:
+            node = node.get(char)
+
+            # We've walked off the trie, so there can't be any longer matches
+            if node is None:
+                break
+
+            entry = node.get(_ENTRY_KEY)
+            if entry is not None and (allow_admin or not entry[1]):
+                best = entry
+
+        return best
@@ -1,41 +1,151 @@
+import asyncio
+import json
+import os
+import time
+
 import discord
 
 from ... import command_decorator
+from ... import config_writer
 from ... import helpers
 
+# The file in which we keep the ids of the channels that an unfinished broadcast has already been sent to
+checkpoint_file_name = "broadcast_checkpoint.json"
+
+
+def get_checkpoint_file_name(client: discord.Client) -> str:
+    """Returns the checkpoint file name, every shard has its own checkpoint since every shard sends to its own servers."""
+    if client.shard_count:
+        return "broadcast_checkpoint.{0}.json".format(client.shard_id)
+
+    return checkpoint_file_name
+
+
+def load_checkpoint(file_name: str, message_content: str) -> set:
+    """Returns the set of channel ids that the broadcast of message_content has already been sent to, if it was interrupted.
+    Returns an empty set if there's no checkpoint for that message."""
+
+    try:
+        with open(file_name, mode="r", encoding="utf-8") as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (OSError, ValueError):
+        return set()
+
+    # We only resume if it's the same message that's being broadcast
+    if checkpoint.get("message") != message_content:
+        return set()
+
+    return set(checkpoint["completed_channel_ids"])
+
+
+async def write_checkpoint(loop: asyncio.AbstractEventLoop, file_name: str, message_content: str,
+                           completed_channel_ids: set):
+    """Writes the ids of the channels that the broadcast has been sent to, so an interrupted broadcast can be resumed.
+    The checkpoint is written crash safely in an executor."""
+
+    await loop.run_in_executor(None, config_writer.write_json_atomically, file_name,
+                               {"message": message_content, "completed_channel_ids": list(completed_channel_ids)})
+
 
 @command_decorator.command("broadcast", "Broadcasts a message to all the channels that anna-bot has access to.",
                            admin=True)
 async def cmd_admin_broadcast(message: discord.Message, client: discord.Client, config: dict):
-    """This method is used to handle admins wanting to broadcast a message to all servers and channel that anna-bot is in."""
+    """This method is used to handle admins wanting to broadcast a message to all servers and channel that anna-bot is in.
+    The message is sent to many channels concurrently, and if the broadcast is interrupted, broadcasting the same message again resumes it."""
 
-    # We know that the issuing user is an admin
+    # The message to send in all the channels, we do this by just stripping off the first characters (the command part of the issuing message)
     if not message.channel.is_private:
-        # The message to send in all the channels, we do this by just stripping off the first characters (the command part of the issuing message)
-        message_content = helpers.remove_anna_mention(client, message).strip()[16:]
-
+        message_content = helpers.remove_fluxx_mention(client, message).strip()[16:]
     else:
-        message_content = message.content
+        message_content = message.content.strip()[16:]
+
+    # How many channels we send to at the same time, and how often (in seconds) we update the status message and the checkpoint
+    concurrency = config["somewhat_weird_shit"].get("broadcast_concurrency", 10)
+    status_interval = config["somewhat_weird_shit"].get("broadcast_status_interval", 5)
+
+    # We figure out where we should send the message once, up front, and skip the channels an interrupted broadcast already got to
+    shard_checkpoint_file_name = get_checkpoint_file_name(client)
+    completed_channel_ids = load_checkpoint(shard_checkpoint_file_name, message_content)
+    target_channels = [channel for channel in helpers.bot_permission_cache.get_sendable_text_channels(client) if
+                       channel.id not in completed_channel_ids]
 
     # Logging that we're going to broadcast the message
-    helpers.log_info(message.author.name + " issued a broadcast of the message \"" + message_content + "\"!")
+    helpers.log_info(
+        message.author.name + " issued a broadcast of the message \"" + message_content + "\" to {0} channels ({1} already done)!".format(
+            len(target_channels), len(completed_channel_ids)))
+
+    # When we're sharded we only know (and can send to) the servers of our own shard, so we make sure the admin knows that
+    if client.shard_count:
+        shard_notice = "This broadcast only reaches the servers of shard {0} of {1}.\n".format(client.shard_id,
+                                                                                           client.shard_count)
+    else:
+        shard_notice = ""
+
+    # Telling the issuing user that we're broadcasting, we edit this message to show the progress
+    if completed_channel_ids:
+        status_prefix = "I'm on it! Resuming the broadcast, {0} channels were already done.\n".format(
+            len(completed_channel_ids)) + shard_notice
+    else:
+        status_prefix = "I'm on it!\n" + shard_notice
+    status_message = await client.send_message(message.channel,
+                                               status_prefix + "Sent to 0/{0} channels.".format(len(target_channels)))
+
+    # How many sends failed (such as because of channel level permission overrides)
+    failed_count = 0
+    sent_count = 0
 
-    # Telling the issuing user that we're broadcasting
-    await client.send_message(message.channel, "I'm on it!")
+    semaphore = asyncio.Semaphore(concurrency)
 
-    # Looping through all the channels on all the servers we have access to
-    for server in client.servers:
-        for channel in server.channels:
+    async def send_to_channel(channel: discord.Channel):
+        nonlocal failed_count, sent_count
 
-            # Doing some sanity checking (you can't send a message in a voice client)
-            if channel.type == discord.ChannelType.text:
-                # Checking permissions for our bot user in the current channel
-                if channel.permissions_for(server.me).send_messages:
-                    # We can (probably, since there might be channel level overrides):
-                    await client.send_message(channel, "Broadcast: " + message_content)
+        # We limit how many channels we send to at the same time, the outbound scheduler takes care of the per route rate limits
+        async with semaphore:
+            try:
+                await client.send_message(channel, "Broadcast: " + message_content)
+            except discord.HTTPException as e:
+                failed_count += 1
+                helpers.log_info("Broadcast to channel {0} on server {1} failed: {2}".format(
+                    helpers.log_ob(channel), helpers.log_ob(channel.server), str(e)))
+            else:
+                sent_count += 1
+                completed_channel_ids.add(channel.id)
+
+    send_tasks = [client.loop.create_task(send_to_channel(channel)) for channel in target_channels]
+
+    # We periodically report the progress and store the checkpoint until all the sends are done
+    last_status_time = time.monotonic()
+    pending_tasks = send_tasks
+    while pending_tasks:
+        done_tasks, pending_tasks = await asyncio.wait(pending_tasks, timeout=status_interval)
+
+        if time.monotonic() - last_status_time >= status_interval or not pending_tasks:
+            last_status_time = time.monotonic()
+            await write_checkpoint(client.loop, shard_checkpoint_file_name, message_content, completed_channel_ids)
+
+            try:
+                await client.edit_message(status_message, status_prefix + "Sent to {0}/{1} channels{2}.".format(
+                    sent_count, len(target_channels),
+                    ", {0} failed".format(failed_count) if failed_count else ""))
+            except discord.HTTPException:
+                # The status message is only informational, so we don't stop the broadcast over it
+                pass
+
+    # The broadcast is done, so there's nothing to resume
+    try:
+        os.remove(shard_checkpoint_file_name)
+    except OSError:
+        pass
 
     # Logging that we're done doing the broadcasting
-    helpers.log_info(message.author.name + "'s broadcast of the message \"" + message_content + "\" is now done.")
+    helpers.log_info(
+        message.author.name + "'s broadcast of the message \"" + message_content + "\" is now done, sent to {0} channels and {1} failed.".format(
+            sent_count, failed_count))
 
     # Telling the issuing user that we're done broadcasting
-    await client.send_message(message.channel, "Ok I'm done broadcasting :smile:")
+    if client.shard_count:
+        await client.send_message(message.channel,
+                                  "Ok I'm done broadcasting, but it reached shard {0} of {1} only, the other shards' servers didn't get it.".format(
+                                      client.shard_id, client.shard_count))
+    else:
+        await client.send_message(message.channel, "Ok I'm done broadcasting :smile:")
@@ -1,9 +1,98 @@
+import asyncio
+import io
+
+import aiohttp
+import async_timeout
 import discord
-import requests
 
 from ... import command_decorator
 from ... import helpers
 
+# Pillow is optional, without it we only validate the image format and can't downscale large icons
+try:
+    import PIL.Image
+except ImportError:
+    PIL = None
+
+# The largest icon (in bytes) we download, and how long (in seconds) we let the download take
+max_icon_size = 8 * 1024 * 1024
+icon_download_timeout = 30
+
+# The largest width and height we upload an icon with, larger icons are downscaled if Pillow is installed
+max_icon_dimension = 1024
+
+# The most pixels an image may have for us to decode it, so a small file can't make us decompress a huge image
+max_icon_pixels = 64 * 1024 * 1024
+
+# The file signatures of the image formats discord accepts as avatars
+icon_signatures = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"GIF87a", b"GIF89a")
+
+
+async def download_icon(client: discord.Client, url: str) -> bytes:
+    """Streams the image at url into memory without blocking the event loop.
+    Raises ValueError if the image is larger than max_icon_size, and asyncio.TimeoutError if the download takes longer than icon_download_timeout."""
+
+    chunks = []
+    downloaded_size = 0
+
+    with async_timeout.timeout(icon_download_timeout):
+        async with client.get_api_session().get(url) as response:
+            response.raise_for_status()
+
+            # We read the image in chunks, so we can stop as soon as it gets too big
+            while True:
+                chunk = await response.content.read(64 * 1024)
+                if not chunk:
+                    break
+
+                downloaded_size += len(chunk)
+                if downloaded_size > max_icon_size:
+                    raise ValueError("The image is larger than {0} bytes.".format(max_icon_size))
+
+                chunks.append(chunk)
+
+    return b"".join(chunks)
+
+
+def prepare_icon(image_data: bytes) -> bytes:
+    """Validates that the image data is an image discord accepts, and downscales it if it's too large (and Pillow is installed).
+    This is blocking, so it should be run in an executor. Raises ValueError if the data isn't a valid image."""
+
+    if not image_data.startswith(icon_signatures):
+        raise ValueError("The file isn't a PNG, JPEG or GIF image.")
+
+    # We can't do anything more without Pillow
+    if PIL is None:
+        return image_data
+
+    try:
+        image = PIL.Image.open(io.BytesIO(image_data))
+
+        # Opening only reads the header, so we can refuse images that would take too much memory before we decode them
+        if image.size[0] * image.size[1] > max_icon_pixels:
+            raise ValueError("The image is larger than {0} pixels.".format(max_icon_pixels))
+
+        image.load()
+
+        # We don't touch images that are small enough, so we don't lose any quality (or animation)
+        if max(image.size) <= max_icon_dimension:
+            return image_data
+
+        # PNG can't store every mode (such as CMYK), so we convert the image to RGB, or to RGBA if it has transparency
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.mode or "transparency" in image.info else "RGB")
+
+        image.thumbnail((max_icon_dimension, max_icon_dimension))
+        output = io.BytesIO()
+        image.save(output, format="PNG")
+    except ValueError:
+        raise
+    except Exception as e:
+        # Pillow raises all kinds of errors for broken or unusual images (such as OSError, SyntaxError and DecompressionBombError)
+        raise ValueError("The image couldn't be read: {0}".format(str(e)))
+
+    return output.getvalue()
+
 
 @command_decorator.command("change icon",
                            "Changes the anna-bot's profile icon to an image that the user attaches to the command message.",
@@ -56,8 +145,26 @@ async def cmd_admin_change_icon(message: discord.Message, client: discord.Client
         "Changing {0:s}'s icon to {1:s} because admin {2:s} ({3:s}) triggered the change icon command.".format(
             client.user.name, attachment["url"], message.author.name, message.author.mention))
 
-    # We download the image and upload it to the discord command simultaneously
-    await client.edit_profile(avatar=requests.get(attachment["url"]).content)
+    # We don't even start downloading images that we know are too large
+    if attachment["size"] > max_icon_size:
+        await client.send_message(message.channel,
+                                  "I can't do that {0:s} because the image is larger than {1} bytes.".format(
+                                      message.author.mention, max_icon_size))
+        return
+
+    # We download the image without blocking the event loop, and validate and downscale it in an executor
+    try:
+        icon_data = await download_icon(client, attachment["url"])
+        icon_data = await client.loop.run_in_executor(None, prepare_icon, icon_data)
+    except (ValueError, asyncio.TimeoutError, aiohttp.ClientError) as e:
+        helpers.log_info("Wasn't able to use {0:s} as the icon: {1}".format(attachment["url"], str(e) or "timed out"))
+        await client.send_message(message.channel,
+                                  "I can't do that {0:s} because I wasn't able to use the image: {1}".format(
+                                      message.author.mention, str(e) or "the download timed out."))
+        return
+
+    # We upload the new icon
+    await client.edit_profile(avatar=icon_data)
 
     # Logging and telling the user that we're done changing the icon
     helpers.log_info("Now done changing the icon.")
@@ -0,0 +1,51 @@
+import discord
+
+from ... import command_decorator
+from ... import metrics
+from ... import stats
+
+
+def format_milliseconds(seconds: float) -> str:
+    return "{0:.1f}ms".format(seconds * 1000)
+
+
+def get_stats_lines() -> list:
+    """Returns the lines of the stats report, the counters and gauges first and then a summary of every latency histogram."""
+    lines = ["Counters:"]
+    lines.extend("  {0}: {1}".format(name, value) for name, value in sorted(stats.get_counters().items()))
+    lines.extend("  {0}{1}: {2}".format(name, list(labels) if labels else "", value) for (name, labels), value in
+                 sorted(metrics.get_counters().items()))
+
+    lines.append("Gauges:")
+    lines.extend("  {0}: {1}".format(name, value) for name, value in sorted(stats.get_gauges().items()))
+
+    lines.append("Latencies (count, average, p50, p95, max):")
+    for (name, labels), histogram in sorted(metrics.get_histograms().items(), key=lambda item: item[0]):
+        summary = histogram.get_summary()
+        lines.append("  {0} {1}: {2}, {3}, {4}, {5}, {6}".format(
+            name, " ".join("{0}={1}".format(label, value) for label, value in labels), summary["count"],
+            format_milliseconds(summary["average"]), format_milliseconds(summary["p50"]),
+            format_milliseconds(summary["p95"]), format_milliseconds(summary["max"])))
+
+    return lines
+
+
+@command_decorator.command("stats", "Shows the stats counters, gauges, and how long handling events and commands takes.",
+                           admin=True)
+async def cmd_admin_stats(message: discord.Message, client: discord.Client, config: dict):
+    """This method is used to handle admins wanting to see the bot's stats and latencies."""
+
+    # We send the report in code blocks, split up so every message is under the 2000 char limit
+    blocks = [[]]
+    block_length = 0
+    for line in get_stats_lines():
+        # We leave room for the code block markers
+        if block_length + len(line) + 1 > 1900 and blocks[-1]:
+            blocks.append([])
+            block_length = 0
+
+        blocks[-1].append(line[:1900])
+        block_length += len(line) + 1
+
+    for block in blocks:
+        await client.send_message(message.channel, "```\n" + "\n".join(block) + "\n```")
@@ -0,0 +1,200 @@
+"""This file contains the config manager, it keeps the config as an immutable, versioned snapshot that is swapped atomically when the config file changes.
+Handlers read the current snapshot without doing any file I/O, and a handler that holds on to a snapshot keeps a consistent view even if the config is reloaded."""
+import asyncio
+import collections.abc
+import json
+import types
+
+from . import config_writer
+from . import helpers
+
+
+def freeze(value):
+    """Returns an immutable version of a json-like value, dicts become read only mappings and lists become tuples."""
+    if isinstance(value, collections.abc.Mapping):
+        return types.MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+
+    return value
+
+
+def thaw(value):
+    """Returns a mutable (and json serializable) copy of a frozen value, so it can be changed and written out."""
+    if isinstance(value, collections.abc.Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+
+    return value
+
+
+# Marks a key that was deleted in a change list
+_deleted = object()
+
+
+def get_changes(old, new, path: tuple = ()) -> list:
+    """Returns the (key path, new value) pairs where new differs from old, nested mappings are compared key by key.
+    Keys that are only in old get _deleted as their new value."""
+    if not (isinstance(old, collections.abc.Mapping) and isinstance(new, collections.abc.Mapping)):
+        return [] if old == new else [(path, new)]
+
+    changes = [(path + (key,), _deleted) for key in old if key not in new]
+    for key, value in new.items():
+        if key not in old:
+            changes.append((path + (key,), value))
+        else:
+            changes.extend(get_changes(old[key], value, path + (key,)))
+
+    return changes
+
+
+def apply_changes(data: dict, changes: list) -> dict:
+    """Applies the changes from get_changes to the (mutable) data and returns it, the parts of data that weren't changed are kept as they are."""
+    for path, value in changes:
+        if not path:
+            data = thaw(value)
+            continue
+
+        parent = data
+        for key in path[:-1]:
+            if not isinstance(parent.get(key), dict):
+                parent[key] = {}
+            parent = parent[key]
+
+        if value is _deleted:
+            parent.pop(path[-1], None)
+        else:
+            parent[path[-1]] = thaw(value)
+
+    return data
+
+
+class ConfigSnapshot(collections.abc.Mapping):
+    """An immutable view of the config at one point in time, it's read just like the config dict.
+    Use to_dict to get a mutable copy that can be changed and written back."""
+
+    def __init__(self, data, version: int):
+        self._data = freeze(data)
+        self.version = version
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return "ConfigSnapshot(version={0})".format(self.version)
+
+    def to_dict(self) -> dict:
+        """Returns a mutable copy of the config."""
+        return thaw(self._data)
+
+
+class ConfigManager:
+    """Loads the config file into snapshots, watches the file for changes, and calls the reload listeners whenever the snapshot is swapped."""
+
+    def __init__(self, file_name: str = "config.json"):
+        self.file_name = file_name
+
+        # The current snapshot, replacing it is a single reference assignment so readers never see a half updated config
+        self.snapshot = ConfigSnapshot({}, 0)
+
+        # The (modification time, size) of the file when we last loaded it, so we can tell when it has changed
+        self._file_signature = None
+
+        # The functions that get called with the new snapshot whenever the config changes
+        self._listeners = []
+
+        # The task that watches the config file
+        self._watch_task = None
+
+    def get(self) -> ConfigSnapshot:
+        """Returns the current config snapshot."""
+        return self.snapshot
+
+    def add_listener(self, listener):
+        """Adds a function that gets called with the new snapshot whenever the config changes."""
+        self._listeners.append(listener)
+
+    def _get_file_signature(self):
+        """Returns the (modification time, size) of the config file, this is blocking."""
+        return config_writer.get_file_signature(self.file_name)
+
+    def _read_file(self):
+        """Reads and parses the config file, returns (data, file signature). This is blocking."""
+        file_signature = self._get_file_signature()
+
+        with open(self.file_name, mode="r", encoding="utf-8") as config_file:
+            data = json.load(config_file)
+
+        return data, file_signature
+
+    def _swap(self, data, file_signature=None) -> ConfigSnapshot:
+        """Swaps in a new snapshot of the passed data, and tells the listeners about it."""
+        self.snapshot = ConfigSnapshot(data, self.snapshot.version + 1)
+
+        if file_signature is not None:
+            self._file_signature = file_signature
+
+        for listener in self._listeners:
+            try:
+                listener(self.snapshot)
+            except Exception as e:
+                helpers.log_error("Config reload listener {0} raised {1}: {2}".format(
+                    getattr(listener, "__name__", listener), type(e).__name__, str(e)))
+
+        return self.snapshot
+
+    def load(self) -> ConfigSnapshot:
+        """Loads the config file into a new snapshot, this is blocking, so it should only be used before the event loop runs."""
+        return self._swap(*self._read_file())
+
+    async def reload(self, loop: asyncio.AbstractEventLoop) -> ConfigSnapshot:
+        """Loads the config file into a new snapshot, the file is read and parsed in an executor so we don't block the loop."""
+        return self._swap(*(await loop.run_in_executor(None, self._read_file)))
+
+    def replace(self, data) -> ConfigSnapshot:
+        """Swaps in a new snapshot of the passed config (such as one a command has changed), and writes what changed to the config file."""
+        old_snapshot = self.snapshot
+        snapshot = self._swap(data)
+
+        # We only write the parts that changed on top of what's in the file, since the rest of our snapshot can be outdated
+        # (such as the stats counters, which we and other processes keep adding to in the file)
+        # The changes are taken from the frozen snapshots, so they can be applied later (in the writer's executor) without copying them now
+        changes = get_changes(old_snapshot, snapshot)
+        if changes:
+            helpers.config_file_writer.update(lambda current_config: apply_changes(current_config, changes))
+
+        return snapshot
+
+    def note_own_write(self, previous_signature, file_signature):
+        """Tells us the bot itself has written the config file (this is a ConfigWriter write listener), so the watcher doesn't reload our own writes.
+        If the file had changed since we last loaded it, we keep our old signature so the watcher still picks that change up."""
+        if previous_signature == self._file_signature:
+            self._file_signature = file_signature
+
+    async def _watch(self, loop: asyncio.AbstractEventLoop, interval: float):
+        """Checks the config file every interval seconds, and reloads it when it has changed."""
+        while True:
+            await asyncio.sleep(interval)
+
+            try:
+                file_signature = await loop.run_in_executor(None, self._get_file_signature)
+                if file_signature == self._file_signature:
+                    continue
+
+                snapshot = await self.reload(loop)
+                helpers.log_info("The config file changed, reloaded it as version {0}.".format(snapshot.version))
+            except (OSError, ValueError) as e:
+                # The file is probably in the middle of being written, we keep the old snapshot and try again on the next check
+                helpers.log_warning("Wasn't able to reload the changed config file, error message: {0}".format(str(e)))
+
+    def start_watching(self, loop: asyncio.AbstractEventLoop, interval: float):
+        """Starts the task that reloads the config when the config file changes, if it isn't already running."""
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = loop.create_task(self._watch(loop, interval))
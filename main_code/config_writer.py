@@ -0,0 +1,211 @@
+"""This file contains the config persistence layer, every write to the config file goes through it.
+Writes are crash safe (we write a temporary file, fsync it and rename it over the config file), bursts of updates are coalesced
+into one write per interval, and the reading, serializing and writing happens in an executor instead of on the event loop."""
+import asyncio
+import contextlib
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # We're on windows
+    fcntl = None
+
+# The errors that mean the file couldn't be read or written right now, writes that fail with these are tried again later
+_retryable_errors = (OSError, json.JSONDecodeError)
+
+
+def write_json_atomically(file_name: str, data):
+    """Writes data as json to file_name so that a crash leaves either the old or the new file, never a truncated one. This is blocking.
+    Read only mappings (such as config snapshots) are written as regular dicts."""
+
+    temp_file_name = file_name + ".tmp"
+
+    with open(temp_file_name, mode="w", encoding="utf-8") as temp_file:
+        json.dump(data, temp_file, indent=2, sort_keys=False, default=dict)
+
+        # We make sure the data is actually on disk before we replace the old file with it
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+
+    os.replace(temp_file_name, file_name)
+
+    # We also fsync the directory, so the rename itself survives a crash (this isn't possible on windows)
+    if hasattr(os, "O_DIRECTORY"):
+        directory_fd = os.open(os.path.dirname(os.path.abspath(file_name)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+
+def get_file_signature(file_name: str) -> tuple:
+    """Returns the (modification time, size) of the file, which changes whenever the file is written. This is blocking."""
+    file_stat = os.stat(file_name)
+    return file_stat.st_mtime_ns, file_stat.st_size
+
+
+@contextlib.contextmanager
+def locked_across_processes(file_name: str):
+    """Holds an exclusive lock on the lock file for file_name while in the with block, so several bot processes (such as shards)
+    don't read, update and write the same file at the same time and lose each other's updates. This is blocking.
+    The lock is advisory and only available on POSIX, on windows this doesn't lock anything."""
+
+    if fcntl is None:
+        yield
+        return
+
+    with open(file_name + ".lock", mode="a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class ConfigWriter:
+    """Serializes all the updates to a json file. An update is a function that gets the current file contents and returns the new contents.
+    Updates are collected for interval seconds and then applied together, in order, on top of what's in the file, with one write."""
+
+    def __init__(self, file_name: str, loop: asyncio.AbstractEventLoop, interval: float = 1., log_function=print):
+        self.file_name = file_name
+        self.loop = loop
+        self.interval = interval
+        self.log_function = log_function
+
+        # The updates that haven't been written yet, in the order they were made
+        self._pending_updates = []
+
+        # The task that writes the pending updates after the interval
+        self._write_task = None
+
+        # Only one thread at a time may read, update and write the file
+        self._file_lock = threading.Lock()
+
+        # The functions that get called with the file signature from before and after every write we do
+        self._write_listeners = []
+
+        # Stats about how much we coalesced
+        self.updates_received = 0
+        self.writes_done = 0
+
+    def update(self, update_function):
+        """Schedules an update of the file, update_function gets the current contents (a dict) and returns the new contents.
+        If the event loop isn't running (such as during startup or shutdown), the update is written right away."""
+
+        self.updates_received += 1
+        self._pending_updates.append(update_function)
+
+        if not self.loop.is_running():
+            self.flush_sync()
+        elif self._write_task is None or self._write_task.done():
+            self._write_task = self.loop.create_task(self._write_after_interval())
+
+    def add_write_listener(self, listener):
+        """Adds a function that gets called with the (modification time, size) of the file from right before and right after every write we do,
+        so a file watcher can tell our own writes apart from other changes. It's called from the thread that did the write."""
+        self._write_listeners.append(listener)
+
+    def replace(self, data):
+        """Schedules replacing the whole file with data, updates made after this are applied on top of it.
+        data mustn't be changed after this (a config snapshot never is), since it's only copied when the update is applied."""
+        # The copy is made in the executor, and every time the update is applied it makes a new one,
+        # so later updates get a mutable dict even if data is a config snapshot
+        self.update(lambda current: json.loads(json.dumps(data, default=dict)))
+
+    def _write_updates(self, updates: list):
+        """Reads the file, applies the updates to it and writes it back atomically. This is blocking."""
+        with self._file_lock, locked_across_processes(self.file_name):
+            previous_signature = get_file_signature(self.file_name)
+            with open(self.file_name, mode="r", encoding="utf-8") as current_file:
+                data = json.load(current_file)
+
+            for update_function in updates:
+                data = update_function(data)
+
+            write_json_atomically(self.file_name, data)
+            self.writes_done += 1
+
+            file_signature = get_file_signature(self.file_name)
+            # The file has already been written, so a failing listener mustn't make the write look failed (the updates would be applied twice)
+            for listener in self._write_listeners:
+                try:
+                    listener(previous_signature, file_signature)
+                except Exception as e:
+                    self.log_function("Write listener {0} raised {1}: {2}".format(
+                        getattr(listener, "__name__", listener), type(e).__name__, str(e)))
+
+    def _write_updates_separately(self, updates: list):
+        """Writes the updates one at a time, the ones that fail are logged and dropped. This is blocking.
+        This is used when a batch failed because of a broken update, so we only lose that update instead of the whole batch."""
+        for update_function in updates:
+            try:
+                self._write_updates([update_function])
+            except Exception as e:
+                self.log_function("Dropped an update to {0} that couldn't be written, error message: {1}: {2}".format(
+                    self.file_name, type(e).__name__, str(e)))
+
+    def _take_pending_updates(self) -> list:
+        """Returns and clears the pending updates."""
+        updates = self._pending_updates
+        self._pending_updates = []
+        return updates
+
+    async def _write_after_interval(self):
+        """Waits for the interval (so more updates can pile up), and then writes all the pending updates in an executor.
+        If the write fails, we try again after another interval."""
+        while True:
+            await asyncio.sleep(self.interval)
+
+            if await self.flush():
+                break
+
+    async def flush(self) -> bool:
+        """Writes all the pending updates now, in an executor. Returns False if the write failed (the updates are kept for the next write)."""
+        updates = self._take_pending_updates()
+        if not updates:
+            return True
+
+        try:
+            await self.loop.run_in_executor(None, self._write_updates, updates)
+        except _retryable_errors as e:
+            # We put the updates back so they are written with the next batch instead of getting lost
+            self._pending_updates[:0] = updates
+            self.log_function("Wasn't able to write {0}, will try again, error message: {1}".format(self.file_name, str(e)))
+
+            # We make sure there's a task that tries again
+            if self._write_task is None or self._write_task.done():
+                self._write_task = self.loop.create_task(self._write_after_interval())
+
+            return False
+        except Exception as e:
+            # One of the updates is broken (it raised, or made the data impossible to serialize), trying the batch again would fail the same way
+            self.log_function("Wasn't able to write {0}, writing the updates one at a time, error message: {1}: {2}".format(
+                self.file_name, type(e).__name__, str(e)))
+            await self.loop.run_in_executor(None, self._write_updates_separately, updates)
+
+        return True
+
+    def flush_sync(self):
+        """Writes all the pending updates now, blocking, this is used when the event loop isn't running."""
+        updates = self._take_pending_updates()
+        if not updates:
+            return
+
+        try:
+            self._write_updates(updates)
+        except _retryable_errors:
+            # We keep the updates, since whoever called us might try again
+            self._pending_updates[:0] = updates
+            raise
+        except Exception as e:
+            self.log_function("Wasn't able to write {0}, writing the updates one at a time, error message: {1}: {2}".format(
+                self.file_name, type(e).__name__, str(e)))
+            self._write_updates_separately(updates)
+
+    def get_stats(self) -> dict:
+        """Returns a dict with how many updates we got, how many writes we did for them, and how many updates are waiting."""
+        return {"updates_received": self.updates_received, "writes_done": self.writes_done,
+                "pending_updates": len(self._pending_updates)}
@@ -0,0 +1,72 @@
+"""This file contains the bounded, expiring set we use for the message ids that the command dispatcher should ignore."""
+import collections
+import time
+
+
+class ExpiringIdSet:
+    """A set of ids with O(1) membership checks, where ids expire after ttl seconds and the oldest ids are dropped when there are more than max_size.
+    It has the list methods (append and remove) that commands use on the ignored message id list, so it can be passed around as that special param."""
+
+    def __init__(self, ids=(), max_size: int = 10000, ttl: float = 600.):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # The ids mapped to when they were added, ordered from oldest to newest
+        self._ids = collections.OrderedDict()
+
+        for id_ in ids:
+            self.add(id_)
+
+    def _expire(self):
+        """Drops all the ids that are older than the ttl."""
+        expire_before = time.monotonic() - self.ttl
+
+        while self._ids:
+            # The first id is always the oldest one
+            oldest_id, added_time = next(iter(self._ids.items()))
+            if added_time > expire_before:
+                break
+
+            del self._ids[oldest_id]
+
+    def add(self, id_):
+        """Adds an id to the set (or refreshes its age if it's already in it), and drops the oldest ids if we get too big."""
+        self._ids.pop(id_, None)
+        self._ids[id_] = time.monotonic()
+
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    # Commands treat the ignored ids as a list, so we support the list way of adding to it
+    append = add
+
+    def extend(self, ids):
+        """Adds all the passed ids to the set."""
+        for id_ in ids:
+            self.add(id_)
+
+    def remove(self, id_):
+        """Removes an id from the set, raises ValueError if it isn't in it (just like list.remove)."""
+        try:
+            del self._ids[id_]
+        except KeyError:
+            raise ValueError("{0!r} isn't in the set".format(id_)) from None
+
+    def discard(self, id_):
+        """Removes an id from the set if it's in it."""
+        self._ids.pop(id_, None)
+
+    def __contains__(self, id_):
+        self._expire()
+        return id_ in self._ids
+
+    def __len__(self):
+        self._expire()
+        return len(self._ids)
+
+    def __iter__(self):
+        self._expire()
+        return iter(list(self._ids))
+
+    def __repr__(self):
+        return "ExpiringIdSet({0!r}, max_size={1}, ttl={2})".format(list(self), self.max_size, self.ttl)
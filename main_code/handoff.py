@@ -0,0 +1,125 @@
+"""This file contains the bot's side of the launcher's zero downtime handoff.
+The launcher starts a new bot process in standby while we're still running, the new process connects but doesn't handle any events yet.
+Once the new one is ready the launcher writes the drain command to our stdin, and the takeover command to the new process's stdin right after.
+We then stop handling new events, let the commands that are running finish, and exit, so there's always exactly one bot handling events."""
+import asyncio
+import contextlib
+import os
+import sys
+import threading
+import time
+
+# The environment variable the launcher sets when it may send us commands on stdin
+control_variable = "FLUXX_CONTROL_STDIN"
+
+# The environment variable the launcher sets when we're started to take over from a running process, we wait for the takeover command then
+standby_variable = "FLUXX_HANDOFF_STANDBY"
+
+# The command the launcher sends when we should drain and exit
+drain_command = b"drain\n"
+
+# The command the launcher sends when we should start handling events, after it told the old process to drain
+takeover_command = b"takeover\n"
+
+# If we're draining, in which case we shouldn't handle any new events
+_draining = False
+
+# If we're a new process that is waiting for the takeover command, in which case we shouldn't handle any events yet
+_standby = False
+
+# How many commands are running right now
+_commands_in_flight = 0
+
+
+def is_draining() -> bool:
+    """Returns True if we're handing off to a new process, events shouldn't be handled then, since the new process handles them."""
+    return _draining
+
+
+def is_standby() -> bool:
+    """Returns True if we're waiting to take over from the old process, events shouldn't be handled then, since the old process handles them."""
+    return _standby
+
+
+def should_handle_events() -> bool:
+    """Returns True if we should handle events, which is unless we're draining or in standby (the other process handles them then)."""
+    return not _draining and not _standby
+
+
+@contextlib.contextmanager
+def track_command():
+    """Counts the command run in the with block as in flight, so draining waits for it to finish."""
+    global _commands_in_flight
+
+    _commands_in_flight += 1
+    try:
+        yield
+    finally:
+        _commands_in_flight -= 1
+
+
+async def drain(timeout: float):
+    """Stops handling new events and waits (for at most timeout seconds) for the commands that are running to finish."""
+    global _draining
+
+    _draining = True
+
+    end_time = time.monotonic() + timeout
+    while _commands_in_flight and time.monotonic() < end_time:
+        await asyncio.sleep(0.1)
+
+
+def get_commands_in_flight() -> int:
+    return _commands_in_flight
+
+
+def _take_over():
+    global _standby
+
+    _standby = False
+
+
+def _listen(loop: asyncio.AbstractEventLoop, drain_function):
+    """Reads commands from stdin until it's closed or we get the drain command, which runs drain_function on the event loop.
+    The takeover command ends the standby. This is blocking."""
+    global _draining
+
+    # We read the file descriptor directly, since a thread that's blocked in a buffered stdin read can crash the interpreter when it shuts down
+    # We keep reading after the takeover command though, so we have to stay blocked in a read for as long as we run
+    stdin_fd = sys.stdin.fileno()
+    pending_data = b""
+
+    while True:
+        data = os.read(stdin_fd, 1024)
+        if not data:
+            return
+
+        pending_data += data
+        while b"\n" in pending_data:
+            line, pending_data = pending_data.split(b"\n", 1)
+            line += b"\n"
+
+            if line == takeover_command:
+                loop.call_soon_threadsafe(_take_over)
+            elif line == drain_command:
+                # We stop handling events right away, instead of once drain_function gets to run, since the new process is about to take over
+                _draining = True
+                asyncio.run_coroutine_threadsafe(drain_function(), loop)
+
+                # There's nothing left to listen for
+                return
+
+
+def start_listening(loop: asyncio.AbstractEventLoop, drain_function):
+    """Starts listening for the launcher's commands, if we were started by a launcher that sends them.
+    If the launcher started us to take over from another process, we're in standby until it sends the takeover command.
+    drain_function is a coroutine function that is called when we should drain and exit."""
+    global _standby
+
+    if os.environ.get(control_variable) != "1":
+        return
+
+    _standby = os.environ.get(standby_variable) == "1"
+
+    # Reading stdin is blocking (and can't be done with the event loop on every platform), so we do it in a thread
+    threading.Thread(target=_listen, args=(loop, drain_function), daemon=True).start()
@@ -0,0 +1,43 @@
+"""This file contains the bot's side of the launcher's liveness watchdog.
+When the launcher supervises us, it tells us (through environment variables) which file to touch and how often,
+and it kills and restarts us if the file stops being touched, such as when the event loop is stuck."""
+import asyncio
+import os
+
+# The environment variables the launcher passes the heartbeat file and interval in
+heartbeat_file_variable = "FLUXX_HEARTBEAT_FILE"
+heartbeat_interval_variable = "FLUXX_HEARTBEAT_INTERVAL"
+
+# The task that touches the heartbeat file
+_heartbeat_task = None
+
+
+async def _beat(file_name: str, interval: float):
+    """Touches the heartbeat file every interval seconds."""
+
+    # We create the file if the launcher hasn't
+    open(file_name, mode="a").close()
+
+    while True:
+        # We touch the file from the event loop itself (and not in an executor), since what we want to prove is that the loop is running callbacks.
+        # Updating the modification time of a small local file is quick enough to not block anything.
+        try:
+            os.utime(file_name, None)
+        except OSError:
+            # The launcher might be rotating the file or something, we'll touch it again next time
+            pass
+
+        await asyncio.sleep(interval)
+
+
+def start(loop: asyncio.AbstractEventLoop):
+    """Starts touching the heartbeat file, if we're started by a supervising launcher and it isn't already running."""
+    global _heartbeat_task
+
+    file_name = os.environ.get(heartbeat_file_variable)
+    if not file_name:
+        # We're not being supervised
+        return
+
+    if _heartbeat_task is None or _heartbeat_task.done():
+        _heartbeat_task = loop.create_task(_beat(file_name, float(os.environ.get(heartbeat_interval_variable, 10))))
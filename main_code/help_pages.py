@@ -0,0 +1,51 @@
+"""This file builds the help pages that cmd_help sends, they are built once when the command set changes instead of on every help command."""
+import discord
+
+# Discord's limits on embeds
+embed_max_fields = 25
+embed_max_characters = 6000
+embed_field_value_max_length = 1024
+
+
+def build_help_embeds(commands: list, title: str, trigger_prefix: str = "") -> list:
+    """Builds a list of embeds that together show the trigger and helptext of every passed command, in as few embeds as discord allows.
+    trigger_prefix is put in front of every command trigger (such as "admin ")."""
+
+    embeds = [discord.Embed(title=title)]
+
+    # How many fields and characters the last embed has
+    field_count = 0
+    character_count = len(title)
+
+    for command in commands:
+        name = trigger_prefix + command["command"]
+        helptext = command["helptext"].strip() or "-"
+
+        # Helptexts that are too long for one field continue in the next fields
+        values = [helptext[i:i + embed_field_value_max_length] for i in
+                  range(0, len(helptext), embed_field_value_max_length)]
+
+        for i, value in enumerate(values):
+            field_name = name if i == 0 else name + " (continued)"
+
+            # We start a new embed if this field wouldn't fit in the last one
+            if field_count == embed_max_fields or character_count + len(field_name) + len(value) > embed_max_characters:
+                embeds.append(discord.Embed(title=title + " (continued)"))
+                field_count = 0
+                character_count = len(title) + len(" (continued)")
+
+            embeds[-1].add_field(name=field_name, value=value, inline=False)
+            field_count += 1
+            character_count += len(field_name) + len(value)
+
+    return embeds
+
+
+def build_help_pages(public_commands: list, admin_commands: list) -> dict:
+    """Builds the help embeds for each audience, as {"public": [embed, ...], "admin": [embed, ...]}.
+    Admins get the public pages followed by the admin command pages."""
+
+    public_embeds = build_help_embeds(public_commands, "Commands")
+    admin_embeds = build_help_embeds(admin_commands, "Admin commands (since you're a fluxx-bot admin)", "admin ")
+
+    return {"public": public_embeds, "admin": public_embeds + admin_embeds}
@@ -1,13 +1,23 @@
 import asyncio
+import atexit
 import json
 import logging.handlers
 import re
-import smtplib
+import sys
 
 import aiohttp
 import async_timeout
 import discord
 
+from . import config_writer
+from . import log_pipeline
+from . import member_update_waiters
+from . import object_index
+from . import outbound
+from . import permission_cache
+from . import response_cache
+from . import sharding
+
 # Setting up logging with the built in discord.py logger
 logger = logging.getLogger('discord')
 logger.setLevel(logging.INFO)
@@ -19,7 +29,6 @@ with open("config.json", mode="r", encoding="utf-8") as config_file:
 
 # Continuing the logger setup
 handler.setFormatter(logging.Formatter('%(asctime)s: %(levelname)s: %(name)s: %(message)s'))
-logger.addHandler(handler)
 
 # We check if the user wants to use email to report errors
 if config["log_config"]["use_email_notifications"]:
@@ -40,21 +49,97 @@ if config["log_config"]["use_email_notifications"]:
     # We change the formatter to the formatter we use in the file handler
     mail_notification_handler.setFormatter(handler.formatter)
 
-    # We add the mail handler to the logger
-    logger.addHandler(mail_notification_handler)
+else:
+    mail_notification_handler = None
+
+# The console only gets the text we log ourselves (see log_text), not discord.py's own records
+console_handler = logging.StreamHandler(sys.stdout)
+console_handler.addFilter(lambda record: getattr(record, "echo", False))
+
+# We don't add the file and mail handlers to the logger directly, as they would block the event loop on disk and SMTP I/O
+# Instead the logger only puts records in a queue, and a background thread writes them to the file and the console and batches the emails into digests
+logging_pipeline = log_pipeline.LogPipeline(handler, mail_notification_handler,
+                                            max_queue_size=config["log_config"].get("log_queue_size", 10000),
+                                            digest_interval=config["log_config"].get("email_digest_interval", 300),
+                                            console_handler=console_handler)
+logger.addHandler(logging_pipeline.handler)
+logging_pipeline.start()
+
+# We make sure everything that's queued gets written when we exit
+atexit.register(logging_pipeline.stop)
 
 # We compile the regular expressions we will need, for performance
 role_id_regex = re.compile(r'<@&\d+>')
 
+# The settings for the connection pool that external api requests share
+api_connection_limit_per_host = 10
+api_keepalive_timeout = 30
+api_dns_cache_ttl = 300
+
+
+class FluxxClient(discord.Client):
+    """The discord client, with a long lived, pooled aiohttp session for external api requests that is closed when the client closes."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # The session is created the first time it's needed, so it's created on the loop the client actually runs on
+        self._api_session = None
+
+        # When (in loop time) we last cleared the connector's DNS cache, aiohttp 2.0 has no DNS cache TTL so we expire it ourselves
+        self._dns_cache_clear_time = 0.
+
+    def get_api_session(self) -> aiohttp.ClientSession:
+        """Returns the shared session for external api requests, it reuses connections and caches DNS lookups."""
+
+        if self._api_session is None or self._api_session.closed:
+            connector = aiohttp.TCPConnector(loop=self.loop, limit_per_host=api_connection_limit_per_host,
+                                             keepalive_timeout=api_keepalive_timeout, use_dns_cache=True,
+                                             resolver=aiohttp.AsyncResolver(loop=self.loop))
+            self._api_session = aiohttp.ClientSession(connector=connector, loop=self.loop)
+            self._dns_cache_clear_time = self.loop.time()
+        elif self.loop.time() - self._dns_cache_clear_time > api_dns_cache_ttl:
+            # The cached addresses are too old, so the next request to every host resolves it again
+            self._api_session.connector.clear_dns_cache()
+            self._dns_cache_clear_time = self.loop.time()
+
+        return self._api_session
+
+    async def close(self):
+        # We close the api session along with the discord connection, so we don't leak any sockets
+        if self._api_session is not None and not self._api_session.closed:
+            self._api_session.close()
+
+        await super().close()
+
+
 # The client object
-actual_client = discord.Client(cache_auth=False)
+# If the launcher started us as one of several shards, the client only connects to its shard of the servers
+actual_client = FluxxClient(cache_auth=False, **sharding.get_client_options())
+
+# The cache of our own permissions and role positions, it's invalidated by the role, channel and member events in bot_main
+bot_permission_cache = permission_cache.PermissionCache()
+
+# The indexes of every server's roles and channels by id and name, they're kept up to date by the role and channel events in bot_main
+server_object_index = object_index.ServerObjectIndex()
+
+# The cache under the external api requests, it's configured in the (optional) api_cache config section
+api_cache_config = config.get("api_cache", {})
+api_response_cache = response_cache.ResponseCache(max_entries=api_cache_config.get("max_entries", 1000),
+                                                  max_bytes=api_cache_config.get("max_bytes", 16 * 1024 * 1024),
+                                                  default_ttl=api_cache_config.get("default_ttl", 60),
+                                                  endpoint_ttls=api_cache_config.get("endpoint_ttls", {}))
+
+# All the client's REST requests go through the outbound scheduler, so we never have to sleep to avoid rate limits ourselves
+outbound_scheduler = outbound.OutboundScheduler()
+outbound_scheduler.install(actual_client.http)
 
 
 def write_config(config_temp: dict):
-    """This function writes the passed dict out to the config file as json."""
-    # We write the out to the file
-    with open("config.json", mode="w", encoding="utf-8") as config_file_temp:
-        json.dump(config_temp, config_file_temp, indent=2, sort_keys=False)
+    """This function writes the passed config snapshot (or a dict that isn't changed afterwards) out to the config file as json.
+    The write goes through the config file writer, so it's crash safe, coalesced with other updates, and done off of the event loop
+    (if the event loop isn't running, it's written right away)."""
+    config_file_writer.replace(config_temp)
 
 
 def get_formatted_duration_fromtime(duration_seconds_noformat):
@@ -90,15 +175,18 @@ def get_formatted_duration_fromtime(duration_seconds_noformat):
 
 
 def log_text(text, level):
-    print(text)
     try:
-        logger.log(level, text)
-    except smtplib.SMTPException as e:
-        print("Got error when trying to send email notification, error message: {0}".format(str(e)))
+        # This only puts the record in the log pipeline's queue, the actual writing (to the file and the console) happens on a background thread
+        logger.log(level, text, extra={"echo": True})
     except Exception as e:
         print("Got error when trying to log, error message {0}.".format(str(e)))
 
 
+def get_log_stats() -> dict:
+    """Returns a dict with the number of queued, dropped and written log records, and how many email digests have been sent."""
+    return logging_pipeline.get_stats()
+
+
 def log_debug(text):
     log_text(text, 10)
 
@@ -119,50 +207,88 @@ def log_critical(text):
     log_text(text, 50)
 
 
+# Every write to the config file goes through this writer, it's defined here since it logs with log_warning
+config_file_writer = config_writer.ConfigWriter("config.json", actual_client.loop,
+                                                config["somewhat_weird_shit"].get("config_write_interval", 1),
+                                                log_function=log_warning)
+
+
 def log_ob(dis_object) -> str:
     """This method returns a string that contains the passed object's name and id, in the format of '{0} ({1})'.format(object.name, object.id)."""
     return "{0} ({1})".format(dis_object.name, dis_object.id)
 
 
-async def remove_roles(client: discord.Client, member: discord.Member, roles: list):
-    """This function is used to remove all roles from a list from a user until the user does not have any of those roles, or the max retries have been attempted.
+async def remove_roles(client: discord.Client, member: discord.Member, roles: list, timeout: float = 5.,
+                       max_attempts: int = 3) -> int:
+    """This function is used to remove all roles from a list from a user with a single member edit, and confirms it by waiting for the member update event.
+    If the update doesn't arrive within timeout seconds we try again, at most max_attempts times. Returns how many API calls it took.
     This raises Forbidden if the client does not have permissions to remove roles from the target user.
     May also raise HTTPException if the network operations failed."""
 
-    # We basically work with the assumption that local membership operations are a lot faster than discord network operations
+    # The ids of the roles we're removing, so we can check the updated member against them
+    role_ids = {role.id for role in roles}
 
-    # The duration to wait between each batch of role removals
-    role_removal_cooldown = 0.1
-
-    # We remove the roles a user has. We do this multiple times or until the user no longer has any of the roles (as doing it once is not reliable)
-    for i in range(5):
+    api_calls = 0
+    for attempt in range(max_attempts):
 
         # We check if the user has any of the roles (just so we don't need to issue a network operation)
-        # We check if the two lists (the member's roles and the removal roles) share any elements
-        if any(x in max(roles, member.roles, key=len) for x in
-               min(roles, member.roles, key=len)):
-            # We remove all the roles from the user
-            for role in [x for x in roles if x in member.roles]:
-                await client.remove_roles(member, role)
-
-            # We wait so we don't get rate limited, and so we have time to receive the updated member
-            await asyncio.sleep(role_removal_cooldown)
-
-        else:
-            # We have removed all the roles
-            i -= 1
+        roles_to_remove = [role for role in member.roles if role.id in role_ids]
+        if not roles_to_remove:
             break
 
-    # We log how many retries it took to remove the roles from the user
-    log_info(
-        "Removing roles from user {0} took {1} retries.".format(log_ob(member), i))
+        # We start waiting for the update before we make the request, so we can't miss it
+        update_future = member_update_waiters.expect_update(
+            lambda before, after: after.id == member.id and after.server.id == member.server.id and not any(
+                role.id in role_ids for role in after.roles), client.loop)
+
+        try:
+            # We remove all the roles with a single edit of the member
+            await client.remove_roles(member, *roles_to_remove)
+            api_calls += 1
+
+            await asyncio.wait_for(update_future, timeout)
+        except asyncio.TimeoutError:
+            # We didn't see the update, so we check the member again (and retry if the roles are still there)
+            continue
+        finally:
+            update_future.cancel()
+
+        # The update confirmed that the roles are gone
+        break
+
+    # We log how many API calls it took to remove the roles from the user
+    log_info("Removing roles from user {0} took {1} API call(s).".format(log_ob(member), api_calls))
+
+    return api_calls
+
+
+async def remove_roles_from_members(client: discord.Client, members: list, roles: list, concurrency: int = 5) -> int:
+    """Removes the roles from all the passed members, editing up to concurrency members at the same time (the outbound scheduler handles rate limits).
+    Returns how many API calls it took in total. Raises the first Forbidden or HTTPException that any of the removals raised, after all of them are done."""
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def remove_from_member(member: discord.Member) -> int:
+        async with semaphore:
+            return await remove_roles(client, member, roles)
+
+    results = await asyncio.gather(*[remove_from_member(member) for member in members], return_exceptions=True)
+
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+    log_info("Removing roles from {0} users took {1} API call(s).".format(len(members), sum(results)))
+
+    return sum(results)
 
 
 def check_add_remove_roles(member: discord.Member, channel: discord.Channel) -> bool:
-    """This method returns true if the currently logged in client can remove and add roles from the passed member in the passed channel."""
+    """This method returns true if the currently logged in client can remove and add roles from the passed member in the passed channel.
+    Our own permissions and top role position come from the permission cache."""
 
-    return channel.permissions_for(
-        channel.server.me).manage_roles and member.top_role.position < member.server.me.top_role.position
+    return bot_permission_cache.permissions_for(channel).manage_roles and \
+           member.top_role.position < bot_permission_cache.top_role_position(member.server)
 
 
 def remove_fluxx_mention(client: discord.Client, message):
@@ -220,11 +346,8 @@ def get_role_from_mention(member: discord.Member, string: str):
 
     # Role mentions are in the format <@&ROLE_ID>, so we try to extract the role id with a precompiled regex
     if match:
-        # We check if the role id is in the server
-        role_id_string = match.group(0)[3:-1]
-        if role_id_string in [x.id for x in member.server.roles]:
-            # We search the member's server's roles for the string role id
-            return discord.utils.get(member.server.roles, id=role_id_string)
+        # We look the role id up in the member's server's role index
+        return server_object_index.get_role_by_id(member.server, match.group(0)[3:-1])
 
 
 def is_member_fluxx_admin(member: discord.Member, passed_config: dict):
@@ -256,14 +379,11 @@ def parse_quote_parameters(raw: str, number_params: int):
 
 
 async def send_long(client: discord.Client, message, channel: discord.Channel, prepend: str = "", append: str = ""):
-    """This method is used to send long messages (longer than 2000 chars) without triggering rate-limiting. 
+    """This method is used to send long messages (longer than 2000 chars), the outbound scheduler makes sure we don't get rate-limited.
     message can be a string or a list of strings, it will be autodetected. If a string in a list is > 2000 chars, it will fail to send.
     Prepend is prepended to all messages, not to the whole message input.
     Append is appended to all messages, not to the whole message input."""
 
-    # How long we wait between each message
-    cooldown_time = 0.5
-
     # We don't let append and prepend increase the length of the message
     msg_part_length = 1999 - (len(prepend) + len(append))
 
@@ -279,11 +399,8 @@ async def send_long(client: discord.Client, message, channel: discord.Channel, p
     else:
         message_parts = [message]
 
-    # We send the message in multiple messages to bypass the 2000 char limit, and we pause between each message to not get rate-limited
+    # We send the message in multiple messages to bypass the 2000 char limit, the outbound scheduler only waits if the channel's bucket is empty
     for split_message in message_parts:
-        # We wait for a bit to not get rate-limited
-        await asyncio.sleep(cooldown_time)
-
         # We send the message part
         await client.send_message(channel, split_message)
 
@@ -296,7 +413,8 @@ async def mashape_json_api_request(passed_config: dict, *args, endpoint: str, ti
     Returns the raw response if return_raw_response is True (defaults to False).
     If return_raw_response is True and return_data_aswell is True, it will return: await response.read(), response
     Returns data in json format if return_json is True (defaults to True).
-    This automatically uses the configured mashape key from the passed_config dict."""
+    This automatically uses the configured mashape key from the passed_config dict.
+    Text and json responses to GET requests are cached (see the api_cache config section), and identical concurrent requests share one request."""
 
     # We configure the HTTP headers to send
     headers = {
@@ -304,22 +422,39 @@ async def mashape_json_api_request(passed_config: dict, *args, endpoint: str, ti
         "Accept": "application/json"
     }
 
+    async def fetch_text():
+        """Does the actual request and returns the response body as text, and whether it's a successful (and so cacheable) response."""
+        # The request has its own timeout, since cached requests run in a task that outlives the callers that time out
+        with async_timeout.timeout(timeout):
+            async with getattr(actual_client.get_api_session(), method)(endpoint, *args, headers=headers,
+                                                                        **kwargs) as response:
+                # We pass on error responses just like successful ones, but we don't want to cache rate limits and server errors
+                return await response.text(), 200 <= response.status < 300
+
     # We do the request
     try:
-        # We create an aiohttp.Client, and fetch the json from the meow api
+        # We use the client's shared session (so we reuse connections), and fetch the json from the api
         with async_timeout.timeout(timeout):
-            async with aiohttp.ClientSession(loop=actual_client.loop) as session:
-                async with getattr(session, method)(endpoint, *args, headers=headers, **kwargs) as response:
-                    if return_raw_response:
-                        if return_data_aswell:
-                            return await response.read(), response
-                        else:
-                            return response
-                    if return_json:
-                        result = json.loads(await response.text())
+            if return_raw_response:
+                # Raw responses can't be cached, so we always do the request
+                async with getattr(actual_client.get_api_session(), method)(endpoint, *args, headers=headers,
+                                                                            **kwargs) as response:
+                    if return_data_aswell:
+                        return await response.read(), response
                     else:
-                        result = await response.text()
-                    return result
+                        return response
+
+            if method == "get":
+                # The request is identified by everything we pass to aiohttp
+                cache_key = (endpoint, repr(args), json.dumps(kwargs, sort_keys=True, default=str))
+                text = await api_response_cache.get_or_fetch(cache_key, endpoint, fetch_text, actual_client.loop)
+            else:
+                text, cacheable = await fetch_text()
+
+            if return_json:
+                return json.loads(text)
+            else:
+                return text
     except (asyncio.TimeoutError, json.JSONDecodeError):
         # We didn't succeed with loading the url
         log_info("Wasn't able to load mashape url {0}.".format(endpoint))
@@ -0,0 +1,162 @@
+"""This file contains the queue based logging pipeline, it moves all log file writes, console output and email notifications off of the event loop and onto a background thread."""
+import logging.handlers
+import queue
+import threading
+import time
+
+
+class _PipelineQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that never blocks, records that don't fit in the queue are dropped and counted instead."""
+
+    def __init__(self, pipeline):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # We would rather lose a log record than stall the event loop
+            with self.pipeline.stats_lock:
+                self.pipeline.dropped_records += 1
+
+
+class LogPipeline:
+    """Writes log records to a file handler in batches from a background thread, (optionally) echoes the records that pass
+    the console handler's filters to the console, and (optionally) collects warnings and errors into periodic email digests
+    instead of sending one email per record."""
+
+    def __init__(self, file_handler: logging.FileHandler, digest_handler: logging.handlers.SMTPHandler = None,
+                 max_queue_size: int = 10000, batch_size: int = 100, digest_interval: float = 300.,
+                 console_handler: logging.StreamHandler = None):
+        self.file_handler = file_handler
+        self.digest_handler = digest_handler
+        self.console_handler = console_handler
+        self.batch_size = batch_size
+        self.digest_interval = digest_interval
+
+        # The queue between the logging calls and the writer thread, it's bounded so a stuck disk can't eat all our memory
+        self.queue = queue.Queue(maxsize=max_queue_size)
+
+        # The handler that should be added to the logger instead of the file and email handlers
+        self.handler = _PipelineQueueHandler(self)
+
+        # The stats we report, they are updated from both the logging callers and the writer thread
+        self.stats_lock = threading.Lock()
+        self.dropped_records = 0
+        self.written_records = 0
+        self.digests_sent = 0
+
+        # The formatted warnings and errors that haven't been emailed yet, and the highest level among them
+        self._digest_lines = []
+        self._digest_level = logging.NOTSET
+        self._last_digest_time = time.monotonic()
+
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log_pipeline", daemon=True)
+
+    def start(self):
+        """Starts the background writer thread."""
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.):
+        """Stops the writer thread after it has written everything that was queued, and sends any pending email digest."""
+        if not self._thread.is_alive():
+            return
+
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def get_stats(self) -> dict:
+        """Returns a dict with the number of queued, dropped and written records, and how many email digests have been sent."""
+        with self.stats_lock:
+            return {"queued_records": self.queue.qsize(), "dropped_records": self.dropped_records,
+                    "written_records": self.written_records, "digests_sent": self.digests_sent}
+
+    def _run(self):
+        """The writer thread, it writes batches of records until we're stopping and the queue is empty."""
+        while not (self._stopping.is_set() and self.queue.empty()):
+            try:
+                # We wake up at least once a second, so we notice when we should stop or send a digest
+                batch = [self.queue.get(timeout=1.)]
+            except queue.Empty:
+                batch = []
+
+            # We take everything else that's already waiting, up to the batch size
+            while batch and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write_batch(batch)
+
+                # The console is a pipe when the launcher runs us, so writing to it can block as well
+                if self.console_handler is not None:
+                    self._write_console(batch)
+
+            if self._digest_lines and (
+                            self._stopping.is_set() or time.monotonic() - self._last_digest_time >= self.digest_interval):
+                self._send_digest()
+
+        # We send whatever digest is left before we exit
+        if self._digest_lines:
+            self._send_digest()
+
+    def _write_batch(self, batch: list):
+        """Formats and writes a batch of records to the log file with one write and one flush."""
+        try:
+            lines = [self.file_handler.format(record) for record in batch]
+
+            self.file_handler.acquire()
+            try:
+                self.file_handler.stream.write("".join(line + self.file_handler.terminator for line in lines))
+                self.file_handler.flush()
+            finally:
+                self.file_handler.release()
+        except Exception as e:
+            print("Got error when trying to log, error message {0}.".format(str(e)))
+            return
+
+        with self.stats_lock:
+            self.written_records += len(batch)
+
+        # We collect the records that should be emailed
+        if self.digest_handler is not None:
+            for record, line in zip(batch, lines):
+                if record.levelno >= self.digest_handler.level:
+                    self._digest_lines.append(line)
+                    self._digest_level = max(self._digest_level, record.levelno)
+
+    def _write_console(self, batch: list):
+        """Writes the records of the batch that pass the console handler's filters to the console with one write and one flush."""
+        try:
+            lines = [self.console_handler.format(record) for record in batch if self.console_handler.filter(record)]
+            if not lines:
+                return
+
+            self.console_handler.acquire()
+            try:
+                self.console_handler.stream.write(
+                    "".join(line + self.console_handler.terminator for line in lines))
+                self.console_handler.flush()
+            finally:
+                self.console_handler.release()
+        except Exception as e:
+            print("Got error when trying to write the log to the console, error message {0}.".format(str(e)))
+
+    def _send_digest(self):
+        """Sends all the collected warnings and errors in a single email."""
+        digest_record = logging.LogRecord("log_pipeline", self._digest_level, __file__, 0,
+                                          "{0} log record(s) since the last notification:\n\n{1}".format(
+                                              len(self._digest_lines), "\n".join(self._digest_lines)), None, None)
+        self._digest_lines = []
+        self._digest_level = logging.NOTSET
+        self._last_digest_time = time.monotonic()
+
+        # The SMTP handler reports its own errors, so a failed email can't kill the writer thread
+        self.digest_handler.handle(digest_record)
+
+        with self.stats_lock:
+            self.digests_sent += 1
@@ -0,0 +1,162 @@
+"""This file contains the event loop lag monitor, it tells us when something blocks the event loop (such as blocking I/O) and what it was.
+A task on the loop measures how late its timer fires (the lag), and a watchdog thread captures the loop thread's stack while the loop is stuck.
+The asyncio debug mode's slow callback warnings can be reported through it as well."""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from . import metrics
+
+
+class LoopMonitor:
+    """Measures the event loop lag every interval seconds, and reports stalls longer than threshold seconds.
+    Warnings are rate limited to one every warning_interval seconds, the stalls in between are counted and mentioned in the next warning."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, interval: float = 0.5, threshold: float = 0.25,
+                 warning_interval: float = 60., log_function=print):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.warning_interval = warning_interval
+        self.log_function = log_function
+
+        # When the lag task last ran (in time.monotonic time), the watchdog thread reads this
+        self._last_tick = time.monotonic()
+
+        # The tick of the stall that the watchdog thread has already reported, so every stall is only reported once
+        self._reported_tick = None
+
+        # The last tick from before the loop stopped running (such as while we log in again), the time after it isn't lag
+        self._paused_tick = None
+
+        # The id of the thread the loop runs in, so the watchdog thread can get its stack
+        self._loop_thread_id = None
+
+        # The rate limiting of the warnings, they can come from the loop and from the watchdog thread
+        self._warning_lock = threading.Lock()
+        self._last_warning_time = None
+        self._suppressed_warnings = 0
+
+        self._lag_task = None
+        self._watchdog_thread = None
+        self._stopping = threading.Event()
+
+        # Stats about the stalls
+        self.stalls = 0
+        self.max_lag = 0.
+
+    def warn(self, text: str):
+        """Logs the warning, unless we've already logged one in the last warning_interval seconds."""
+        with self._warning_lock:
+            now = time.monotonic()
+            if self._last_warning_time is not None and now - self._last_warning_time < self.warning_interval:
+                self._suppressed_warnings += 1
+                return
+
+            suppressed_warnings = self._suppressed_warnings
+            self._last_warning_time = now
+            self._suppressed_warnings = 0
+
+        if suppressed_warnings:
+            text += "\n({0} more event loop warnings were suppressed since the last one)".format(suppressed_warnings)
+
+        self.log_function(text)
+
+    async def _measure_lag(self):
+        """Sleeps for the interval, forever, and records how much later than that we woke up."""
+        self._loop_thread_id = threading.get_ident()
+
+        while True:
+            self._last_tick = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+            # If the loop wasn't running for a while during the sleep, we can't tell the lag from that
+            if self._paused_tick == self._last_tick:
+                continue
+
+            lag = max(0., time.monotonic() - self._last_tick - self.interval)
+            metrics.observe("event_loop_lag", lag)
+            self.max_lag = max(self.max_lag, lag)
+
+            if lag > self.threshold:
+                self.stalls += 1
+                metrics.increment("event_loop_stalls")
+
+                # If the watchdog thread caught this stall it has already reported it with a stack
+                if self._reported_tick != self._last_tick:
+                    self.warn("The event loop was blocked for {0:.3f} seconds.".format(lag))
+
+    def _watch(self):
+        """Checks if the loop is stuck, and if it is, reports what the loop thread is doing. This runs in the watchdog thread, until we're stopped."""
+        while not self._stopping.wait(self.threshold / 2):
+            # A loop that isn't running (such as after the client has logged out) isn't stuck, and its last tick is stale until it ticks again
+            if not self.loop.is_running():
+                self._paused_tick = self._last_tick
+                continue
+
+            last_tick = self._last_tick
+            if last_tick == self._paused_tick:
+                continue
+            stuck_time = time.monotonic() - last_tick - self.interval
+
+            if stuck_time > self.threshold and self._reported_tick != last_tick and self._loop_thread_id is not None:
+                self._reported_tick = last_tick
+
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is None:
+                    continue
+
+                self.warn("The event loop has been blocked for {0:.3f} seconds, it's currently running:\n{1}".format(
+                    stuck_time, "".join(traceback.format_stack(frame))))
+
+    def enable_slow_callback_reports(self):
+        """Turns on asyncio's debug mode, which warns about every callback that takes longer than the threshold, and reports those warnings through us.
+        The debug mode makes everything slower, so this should only be used while looking for a problem."""
+        self.loop.set_debug(True)
+        self.loop.slow_callback_duration = self.threshold
+
+        logging.getLogger("asyncio").addHandler(_SlowCallbackHandler(self))
+
+    def start(self):
+        """Starts measuring the lag and watching the loop, if we aren't already."""
+        if self._lag_task is None or self._lag_task.done():
+            self._lag_task = self.loop.create_task(self._measure_lag())
+
+        if self._watchdog_thread is None:
+            self._stopping.clear()
+            self._watchdog_thread = threading.Thread(target=self._watch, daemon=True)
+            self._watchdog_thread.start()
+
+    def stop(self):
+        """Stops measuring the lag and watching the loop, such as when we're shutting down."""
+        self._stopping.set()
+
+        if self._lag_task is not None and not self.loop.is_closed():
+            self._lag_task.cancel()
+        self._lag_task = None
+
+        if self._watchdog_thread is not None:
+            self._watchdog_thread.join()
+            self._watchdog_thread = None
+
+    def get_stats(self) -> dict:
+        """Returns a dict with how many stalls we've seen and the longest lag."""
+        return {"stalls": self.stalls, "max_lag": self.max_lag}
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """Reports asyncio's slow callback warnings through the loop monitor's rate limited warnings."""
+
+    def __init__(self, loop_monitor: LoopMonitor):
+        super().__init__(logging.WARNING)
+        self.loop_monitor = loop_monitor
+
+    def emit(self, record: logging.LogRecord):
+        message = record.getMessage()
+
+        if message.startswith("Executing "):
+            metrics.increment("slow_callbacks")
+            self.loop_monitor.warn("Slow callback: " + message)
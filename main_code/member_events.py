@@ -0,0 +1,84 @@
+"""This file contains the batching stage for member join and leave announcements.
+During raids or mass prunes we get lots of member events at once, so we collect the events for each server during a short window,
+and announce all the members in as few messages as possible instead of sending one message per member."""
+import asyncio
+import sys
+import traceback
+
+from . import helpers
+
+
+class MemberEventBatcher:
+    """Collects members per (feature, server) for window seconds, and then passes them all to flush_callback(feature, server, members) at once.
+    flush_callback returns how many announcements it made for the members (not counting that each one may be sent to several channels).
+    It also limits how many PMs are sent at the same time."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, flush_callback, window: float = 2., pm_concurrency: int = 5):
+        self.loop = loop
+        self.flush_callback = flush_callback
+        self.window = window
+
+        # The members waiting to be announced, keyed by (feature, server id), as [server, [member, ...]] pairs
+        self._pending = {}
+
+        # The tasks that announce the pending members, and the event that makes them announce right away instead of waiting for the window
+        self._flush_tasks = set()
+        self._flush_requested = asyncio.Event()
+
+        # The semaphore that limits how many PMs we send at the same time
+        self._pm_semaphore = asyncio.Semaphore(pm_concurrency)
+
+        # Stats about how much we merged
+        self.events_received = 0
+        self.announcements_sent = 0
+
+    def add(self, feature: str, member):
+        """Adds a member to the next announcement of the feature on the member's server."""
+        self.events_received += 1
+        key = (feature, member.server.id)
+
+        if key in self._pending:
+            self._pending[key][1].append(member)
+        else:
+            # This is the first member in this window, so we schedule the announcement
+            self._pending[key] = [member.server, [member]]
+            flush_task = self.loop.create_task(self._flush_after_window(key))
+            self._flush_tasks.add(flush_task)
+            flush_task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush_after_window(self, key):
+        """Waits for the window to end (or for flush to be called), and then announces all the members that were collected during it."""
+        try:
+            await asyncio.wait_for(self._flush_requested.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+
+        server, members = self._pending.pop(key)
+
+        try:
+            # We await before adding, since other announcements may be counted while we wait
+            announcements = await self.flush_callback(key[0], server, members)
+            self.announcements_sent += announcements
+        except Exception:
+            helpers.log_error("Ignoring exception when announcing {0} members for {1}, more info:\n{2}".format(
+                len(members), key[0], "".join(["    " + entry for entry in traceback.format_exception(*sys.exc_info())])))
+
+    async def flush(self):
+        """Announces all the pending members right away, and waits until all the announcements have been made.
+        We use this before logging out, since the pending members would never be announced otherwise.
+        Members added after this are announced right away too."""
+        self._flush_requested.set()
+
+        if self._flush_tasks:
+            await asyncio.wait(list(self._flush_tasks))
+
+    async def send_pm(self, coroutine):
+        """Awaits a coroutine that sends a PM, while making sure that not too many PMs are being sent at the same time."""
+        async with self._pm_semaphore:
+            return await coroutine
+
+    def get_stats(self) -> dict:
+        """Returns a dict with how many member events we got, how many announcements we sent for them, and how many announcements we merged away."""
+        return {"events_received": self.events_received, "announcements_sent": self.announcements_sent,
+                "announcements_merged": self.events_received - self.announcements_sent - sum(
+                    len(pending[1]) for pending in self._pending.values())}
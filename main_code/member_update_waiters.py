@@ -0,0 +1,36 @@
+"""This file lets code wait for a specific on_member_update event, instead of polling the member until a change shows up.
+on_member_update has to pass every update to resolve."""
+import asyncio
+
+# The active waiters, as a list of [check, future] pairs
+_waiters = []
+
+
+def expect_update(check, loop: asyncio.AbstractEventLoop) -> asyncio.Future:
+    """Returns a future that gets the updated member as its result when an update comes in for which check(before, after) returns True.
+    Register this before doing the request that causes the update, so the update can't arrive before we're waiting for it.
+    Cancel the future to stop waiting."""
+
+    future = loop.create_future()
+    _waiters.append([check, future])
+
+    return future
+
+
+def resolve(before, after):
+    """Resolves all the waiters that are waiting for this member update."""
+
+    # We drop the waiters that have been cancelled or timed out
+    _waiters[:] = [waiter for waiter in _waiters if not waiter[1].done()]
+
+    for waiter in list(_waiters):
+        check, future = waiter
+
+        if check(before, after):
+            _waiters.remove(waiter)
+            future.set_result(after)
+
+
+def get_waiter_count() -> int:
+    """Returns how many waiters are waiting for a member update."""
+    return sum(1 for waiter in _waiters if not waiter[1].done())
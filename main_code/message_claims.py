@@ -0,0 +1,53 @@
+"""This file contains the message claim mechanism, it lets a command claim a future message (such as a reply to a question) before that message arrives.
+on_message checks the claims as soon as a message is received, so whether a message is ignored by the command dispatcher is decided deterministically without any sleeping."""
+import asyncio
+
+# The active claims, as a list of [check, future] pairs in the order they were registered
+_claims = []
+
+
+def claim_next_message(check, loop: asyncio.AbstractEventLoop) -> asyncio.Future:
+    """Claims the next received message for which check(message) returns True.
+    Returns a future that gets the claimed message as its result, the claimed message is not dispatched as a command.
+    Cancel the future to give up the claim."""
+
+    future = loop.create_future()
+    _claims.append([check, future])
+
+    return future
+
+
+async def wait_for_claimed_message(check, loop: asyncio.AbstractEventLoop, timeout: float = None):
+    """Waits for and returns the next message for which check(message) returns True, without that message being dispatched as a command.
+    Returns None if no such message was received within timeout seconds."""
+
+    future = claim_next_message(check, loop)
+
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        return None
+
+
+def try_claim(message) -> bool:
+    """Gives the message to the first active claim that wants it, returns True if the message was claimed.
+    This has to be called synchronously as soon as the message is received, so no claim can be registered in between."""
+
+    # We drop the claims that have been cancelled or timed out
+    _claims[:] = [claim for claim in _claims if not claim[1].done()]
+
+    for claim in _claims:
+        check, future = claim
+
+        if check(message):
+            # The claim is now fulfilled, so we remove it
+            _claims.remove(claim)
+            future.set_result(message)
+            return True
+
+    return False
+
+
+def get_active_claim_count() -> int:
+    """Returns how many claims are waiting for a message."""
+    return sum(1 for claim in _claims if not claim[1].done())
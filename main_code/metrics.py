@@ -0,0 +1,242 @@
+"""This file contains the latency histograms and event counters, so we can see where the time goes when we handle events and commands.
+Everything here is volatile (it's never written to the config). The metrics, together with the stats counters and gauges,
+can be exported as Prometheus text on a localhost only http endpoint, and are shown by the admin stats command."""
+import bisect
+import contextlib
+import functools
+import re
+import time
+
+import aiohttp.web
+
+from . import stats
+
+# The upper bounds (in seconds) of the histogram buckets, there's an implicit last bucket for everything slower
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60.)
+
+# The histograms and counters keyed by (name, labels), where labels is a sorted tuple of (label name, value) pairs
+_histograms = {}
+_counters = {}
+
+# The http server that serves the Prometheus text, so we don't start more than one of it
+_server = None
+
+
+class Histogram:
+    """A latency histogram with fixed buckets, observing a value is a binary search and an increment."""
+
+    def __init__(self, buckets: tuple = default_buckets):
+        self.buckets = buckets
+
+        # How many values fell in each bucket (not cumulative), the last one is for values larger than every bucket
+        self.bucket_counts = [0] * (len(buckets) + 1)
+
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, seconds: float):
+        self.bucket_counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def get_quantile(self, quantile: float) -> float:
+        """Returns an estimate of the quantile (such as 0.95), which is the upper bound of the bucket it's in (or the max for the last bucket)."""
+        if not self.count:
+            return 0.
+
+        target = quantile * self.count
+        cumulative_count = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            cumulative_count += bucket_count
+            if cumulative_count >= target:
+                return min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+
+        return self.max
+
+    def get_summary(self) -> dict:
+        """Returns a dict with the count, and the average, median, 95th percentile and max in seconds."""
+        return {"count": self.count, "average": self.sum / self.count if self.count else 0.,
+                "p50": self.get_quantile(0.5), "p95": self.get_quantile(0.95), "max": self.max}
+
+
+def _get_key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name: str, seconds: float, **labels):
+    """Records a duration in the histogram with the name and labels."""
+    key = _get_key(name, labels)
+
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = Histogram()
+
+    histogram.observe(seconds)
+
+
+def increment(name: str, amount: int = 1, **labels):
+    """Increments the counter with the name and labels."""
+    key = _get_key(name, labels)
+    _counters[key] = _counters.get(key, 0) + amount
+
+
+@contextlib.contextmanager
+def timed(name: str, **labels):
+    """Records how long the with block took in the histogram with the name and labels (even if it raises)."""
+    start_time = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - start_time, **labels)
+
+
+class StageTimer:
+    """Records how long every stage of handling something takes, by marking the end of each stage as it's reached."""
+
+    def __init__(self, name: str, start_time: float = None):
+        self.name = name
+        self._last_time = time.monotonic() if start_time is None else start_time
+
+    def mark(self, stage: str):
+        """Records the time since the last mark (or since the timer was created) as the duration of the stage."""
+        now = time.monotonic()
+        observe(self.name, now - self._last_time, stage=stage)
+        self._last_time = now
+
+
+def timed_event(event_function):
+    """Decorator for event handlers, it records how long every call takes and counts the ones that raise, by event name.
+    The wrapper keeps the function's name, so it can be registered with client.event."""
+
+    @functools.wraps(event_function)
+    async def timed_event_function(*args, **kwargs):
+        try:
+            with timed("event_duration", event=event_function.__name__):
+                return await event_function(*args, **kwargs)
+        except Exception:
+            increment("event_errors", event=event_function.__name__)
+            raise
+
+    return timed_event_function
+
+
+def timed_command(command_method, command_trigger: str, admin: bool):
+    """Returns a wrapper of the command method that records how long every use of the command takes, and counts its uses and failures."""
+    labels = {"command": command_trigger, "admin": "true" if admin else "false"}
+
+    @functools.wraps(command_method)
+    async def timed_command_method(*args, **kwargs):
+        increment("commands", **labels)
+        try:
+            with timed("command_duration", **labels):
+                return await command_method(*args, **kwargs)
+        except Exception:
+            increment("command_errors", **labels)
+            raise
+
+    return timed_command_method
+
+
+def get_histogram(name: str, **labels) -> Histogram:
+    """Returns the histogram with the name and labels, or None if nothing has been recorded in it yet."""
+    return _histograms.get(_get_key(name, labels))
+
+
+def get_histograms() -> dict:
+    """Returns the histograms keyed by (name, labels)."""
+    return dict(_histograms)
+
+
+def get_counters() -> dict:
+    """Returns the counter values keyed by (name, labels)."""
+    return dict(_counters)
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+
+    # We escape the label values as the Prometheus text format wants
+    return "{" + ",".join('{0}="{1}"'.format(name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace(
+        "\n", "\\n")) for name, value in labels) + "}"
+
+
+def _format_name(name: str) -> str:
+    # Metric names may only contain letters, digits, underscores and colons
+    return "fluxx_" + re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+
+def render_prometheus() -> str:
+    """Returns all the metrics, stats counters and gauges in the Prometheus text exposition format."""
+    lines = []
+
+    # The persisted stats counters (totals since the stats were reset, not since we started)
+    for name, value in sorted(stats.get_counters().items()):
+        metric_name = _format_name("stats_" + name)
+        lines.append("# TYPE {0} gauge".format(metric_name))
+        lines.append("{0} {1}".format(metric_name, value))
+
+    for name, value in sorted(stats.get_gauges().items()):
+        if isinstance(value, (int, float)):
+            metric_name = _format_name(name)
+            lines.append("# TYPE {0} gauge".format(metric_name))
+            lines.append("{0} {1}".format(metric_name, value))
+
+    # The volatile counters and histograms, grouped by name so every name gets one TYPE line
+    typed_names = set()
+    for (name, labels), value in sorted(_counters.items()):
+        metric_name = _format_name(name + "_total")
+        if metric_name not in typed_names:
+            typed_names.add(metric_name)
+            lines.append("# TYPE {0} counter".format(metric_name))
+        lines.append("{0}{1} {2}".format(metric_name, _format_labels(labels), value))
+
+    for (name, labels), histogram in sorted(_histograms.items(), key=lambda item: item[0]):
+        metric_name = _format_name(name + "_seconds")
+        if metric_name not in typed_names:
+            typed_names.add(metric_name)
+            lines.append("# TYPE {0} histogram".format(metric_name))
+
+        cumulative_count = 0
+        for upper_bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+            cumulative_count += bucket_count
+            lines.append("{0}_bucket{1} {2}".format(metric_name, _format_labels(labels + (("le", repr(upper_bound)),)),
+                                                    cumulative_count))
+        lines.append(
+            "{0}_bucket{1} {2}".format(metric_name, _format_labels(labels + (("le", "+Inf"),)), histogram.count))
+        lines.append("{0}_sum{1} {2}".format(metric_name, _format_labels(labels), histogram.sum))
+        lines.append("{0}_count{1} {2}".format(metric_name, _format_labels(labels), histogram.count))
+
+    return "\n".join(lines) + "\n"
+
+
+async def _handle_metrics_request(request):
+    return aiohttp.web.Response(text=render_prometheus(), content_type="text/plain")
+
+
+async def start_server(loop, port: int):
+    """Starts serving the Prometheus text on http://127.0.0.1:port/metrics, if it isn't already being served.
+    We only listen on localhost, so the metrics can't be read from outside the machine."""
+    global _server
+
+    if _server is not None:
+        return
+
+    application = aiohttp.web.Application()
+    application.router.add_get("/metrics", _handle_metrics_request)
+
+    _server = await loop.create_server(application.make_handler(), "127.0.0.1", port)
+
+
+async def stop_server():
+    """Stops serving the Prometheus text, so the port is free for the process that takes over from us."""
+    global _server
+
+    if _server is None:
+        return
+
+    server, _server = _server, None
+    server.close()
+    await server.wait_closed()
@@ -0,0 +1,132 @@
+"""This file contains the per server indexes of roles and channels, keyed by id and by lowercase name.
+They're built the first time a server is looked up, and then kept up to date incrementally from the role and channel events,
+so resolving a mention, id or name is a dict lookup instead of scanning all of the server's roles or channels.
+This doesn't import discord, it only uses the id, name, server, roles and channels attributes of the objects it's passed."""
+
+
+class _ObjectIndex:
+    """An index of discord objects (roles or channels) of one server, by id and by lowercase name."""
+
+    def __init__(self, objects):
+        # The objects keyed by id
+        self.by_id = {}
+
+        # The objects keyed by lowercase name, several objects can have the same name, so every name maps to a dict of ids to objects
+        self.by_name = {}
+
+        # The lowercase name every object was indexed under, keyed by id
+        # discord.py changes the objects in place when they're updated, so the object itself doesn't know its old name anymore
+        self.indexed_names = {}
+
+        for discord_object in objects:
+            self.add(discord_object)
+
+    def add(self, discord_object):
+        name = discord_object.name.lower()
+
+        self.by_id[discord_object.id] = discord_object
+        self.by_name.setdefault(name, {})[discord_object.id] = discord_object
+        self.indexed_names[discord_object.id] = name
+
+    def remove(self, discord_object):
+        # We remove the object by id and by the name it was indexed under, as it might have been renamed since
+        self.by_id.pop(discord_object.id, None)
+        name = self.indexed_names.pop(discord_object.id, None)
+        if name is None:
+            return
+
+        same_name_objects = self.by_name.get(name, {})
+        same_name_objects.pop(discord_object.id, None)
+        if not same_name_objects:
+            self.by_name.pop(name, None)
+
+    def get_by_name(self, name: str):
+        """Returns an object with the name (case insensitive), or None if there isn't one."""
+        same_name_objects = self.by_name.get(name.lower())
+        if not same_name_objects:
+            return None
+
+        return next(iter(same_name_objects.values()))
+
+
+class ServerObjectIndex:
+    """The role and channel indexes of all servers. The update methods have to be called from the role, channel and server events."""
+
+    def __init__(self):
+        # The indexes keyed by server id
+        self._role_indexes = {}
+        self._channel_indexes = {}
+
+    def _get_role_index(self, server) -> _ObjectIndex:
+        role_index = self._role_indexes.get(server.id)
+        if role_index is None:
+            role_index = self._role_indexes[server.id] = _ObjectIndex(server.roles)
+
+        return role_index
+
+    def _get_channel_index(self, server) -> _ObjectIndex:
+        channel_index = self._channel_indexes.get(server.id)
+        if channel_index is None:
+            channel_index = self._channel_indexes[server.id] = _ObjectIndex(server.channels)
+
+        return channel_index
+
+    def get_role_by_id(self, server, role_id: str):
+        """Returns the role on the server with the id, or None if there isn't one."""
+        return self._get_role_index(server).by_id.get(role_id)
+
+    def get_role_by_name(self, server, name: str):
+        """Returns a role on the server with the name (case insensitive), or None if there isn't one."""
+        return self._get_role_index(server).get_by_name(name)
+
+    def get_channel_by_id(self, server, channel_id: str):
+        """Returns the channel on the server with the id, or None if there isn't one."""
+        return self._get_channel_index(server).by_id.get(channel_id)
+
+    def get_channel_by_name(self, server, name: str):
+        """Returns a channel on the server with the name (case insensitive), or None if there isn't one."""
+        return self._get_channel_index(server).get_by_name(name)
+
+    def update_role(self, before, after):
+        """Updates the index with a role that was created (before is None) or changed."""
+        role_index = self._role_indexes.get(after.server.id)
+        if role_index is None:
+            # The server hasn't been indexed yet, so it will be built with the current roles when it is
+            return
+
+        if before is not None:
+            role_index.remove(before)
+        role_index.add(after)
+
+    def remove_role(self, role):
+        """Removes a deleted role from the index."""
+        role_index = self._role_indexes.get(role.server.id)
+        if role_index is not None:
+            role_index.remove(role)
+
+    def update_channel(self, before, after):
+        """Updates the index with a channel that was created (before is None) or changed."""
+        channel_index = self._channel_indexes.get(after.server.id)
+        if channel_index is None:
+            # The server hasn't been indexed yet, so it will be built with the current channels when it is
+            return
+
+        if before is not None:
+            channel_index.remove(before)
+        channel_index.add(after)
+
+    def remove_channel(self, channel):
+        """Removes a deleted channel from the index."""
+        channel_index = self._channel_indexes.get(channel.server.id)
+        if channel_index is not None:
+            channel_index.remove(channel)
+
+    def remove_server(self, server):
+        """Drops the indexes of a server, they are built again from scratch the next time the server is looked up."""
+        self._role_indexes.pop(server.id, None)
+        self._channel_indexes.pop(server.id, None)
+
+    def clear(self):
+        """Drops all the indexes, this should be called when we (re)connect since all the server objects are replaced."""
+        self._role_indexes.clear()
+        self._channel_indexes.clear()
@@ -0,0 +1,166 @@
+"""This file contains the outbound request scheduler, every REST request the client makes goes through it.
+It learns the per route (and per channel/server) rate limit buckets from discord's rate limit response headers,
+so we send as fast as discord allows and only wait when a bucket is actually empty, instead of sleeping a fixed time between every message."""
+import asyncio
+import re
+import time
+import urllib.parse
+
+# The path segments whose following id is a "major parameter", discord gives every channel/server/webhook its own bucket for the same route
+_major_parameter_segments = {"channels", "guilds", "webhooks"}
+
+# Matches path segments that are ids
+_id_segment_regex = re.compile(r"^\d+$")
+
+
+def get_route_key(method: str, url: str) -> str:
+    """Returns the rate limit bucket key for a request, it's the method and the path with all ids except major parameters replaced."""
+
+    segments = urllib.parse.urlsplit(str(url)).path.strip("/").split("/")
+
+    for i, segment in enumerate(segments):
+        if _id_segment_regex.match(segment) and not (i > 0 and segments[i - 1] in _major_parameter_segments):
+            segments[i] = "{id}"
+
+    return method.upper() + " /" + "/".join(segments)
+
+
+class RateLimitBucket:
+    """The rate limit state of a single bucket, as far as we know it from the last response we got for it."""
+
+    def __init__(self):
+        # How many requests we can still send before reset_time, None if we don't know (then we just send)
+        self.remaining = None
+        # The time.monotonic() time at which the bucket is refilled
+        self.reset_time = 0.
+
+    def update_from_headers(self, headers, status: int):
+        """Updates the bucket from the rate limit headers of a response."""
+        now = time.monotonic()
+
+        if "X-RateLimit-Remaining" in headers:
+            self.remaining = int(headers["X-RateLimit-Remaining"])
+
+        if "X-RateLimit-Reset-After" in headers:
+            self.reset_time = now + float(headers["X-RateLimit-Reset-After"])
+        elif "X-RateLimit-Reset" in headers:
+            # The reset header is a unix timestamp, so we convert it to our monotonic clock
+            self.reset_time = now + max(0., float(headers["X-RateLimit-Reset"]) - time.time())
+
+        if status == 429:
+            # We're definitely out of requests, and Retry-After (in milliseconds in the api version we use) is the most accurate reset time
+            self.remaining = 0
+            if "Retry-After" in headers:
+                self.reset_time = now + float(headers["Retry-After"]) / 1000
+
+
+class OutboundScheduler:
+    """Keeps track of all the rate limit buckets and makes requests wait only when their bucket (or the global limit) is exhausted."""
+
+    def __init__(self):
+        # The buckets keyed by route key
+        self.buckets = {}
+
+        # The time.monotonic() time until which all requests have to wait because we hit the global rate limit
+        self.global_reset_time = 0.
+
+        # Stats about the scheduled requests
+        self.requests_sent = 0
+        self.requests_delayed = 0
+        self.rate_limited_responses = 0
+
+    def get_bucket(self, method: str, url: str) -> RateLimitBucket:
+        """Returns the bucket for a request, creating it if this is the first request for its route."""
+        route_key = get_route_key(method, url)
+
+        bucket = self.buckets.get(route_key)
+        if bucket is None:
+            bucket = self.buckets[route_key] = RateLimitBucket()
+
+        return bucket
+
+    async def acquire(self, bucket: RateLimitBucket):
+        """Waits until the bucket and the global limit allow another request, and reserves it."""
+        delayed = False
+
+        while True:
+            now = time.monotonic()
+            wait_until = self.global_reset_time
+
+            if bucket.remaining is not None and bucket.remaining <= 0:
+                if now < bucket.reset_time:
+                    wait_until = max(wait_until, bucket.reset_time)
+                else:
+                    # The bucket has been refilled, but we don't know by how much until we get the next response
+                    bucket.remaining = None
+
+            if wait_until <= now:
+                break
+
+            delayed = True
+            await asyncio.sleep(wait_until - now)
+
+        # We reserve a request from the bucket, so concurrent requests don't all think there's room left
+        if bucket.remaining is not None:
+            bucket.remaining -= 1
+
+        self.requests_sent += 1
+        if delayed:
+            self.requests_delayed += 1
+
+    def update(self, bucket: RateLimitBucket, response):
+        """Updates the bucket (and the global limit) from a response."""
+        bucket.update_from_headers(response.headers, response.status)
+
+        if response.status == 429:
+            self.rate_limited_responses += 1
+
+            if response.headers.get("X-RateLimit-Global"):
+                self.global_reset_time = bucket.reset_time
+
+    def get_stats(self) -> dict:
+        """Returns a dict with the number of known buckets, sent requests, requests that had to wait, and rate limited responses."""
+        return {"buckets": len(self.buckets), "requests_sent": self.requests_sent,
+                "requests_delayed": self.requests_delayed, "rate_limited_responses": self.rate_limited_responses}
+
+    def wrap_session(self, session):
+        """Returns a session that schedules all its requests through us, and otherwise works just like the passed aiohttp session."""
+        if isinstance(session, ScheduledSession):
+            return session
+
+        return ScheduledSession(self, session)
+
+    def install(self, http_client):
+        """Makes all requests from a discord HTTPClient (client.http) go through us, including requests from sessions it recreates later."""
+        http_client.session = self.wrap_session(http_client.session)
+
+        original_recreate = getattr(http_client, "recreate", None)
+        if original_recreate is None:
+            return
+
+        def recreate():
+            original_recreate()
+            http_client.session = self.wrap_session(http_client.session)
+
+        http_client.recreate = recreate
+
+
+class ScheduledSession:
+    """A wrapper around an aiohttp.ClientSession whose request method waits for the rate limit bucket of the request first."""
+
+    def __init__(self, scheduler: OutboundScheduler, session):
+        self.scheduler = scheduler
+        self.session = session
+
+    async def request(self, method: str, url, **kwargs):
+        bucket = self.scheduler.get_bucket(method, url)
+
+        await self.scheduler.acquire(bucket)
+        response = await self.session.request(method, url, **kwargs)
+        self.scheduler.update(bucket, response)
+
+        return response
+
+    def __getattr__(self, name):
+        # Everything except request (such as close and ws_connect) goes straight to the real session
+        return getattr(self.session, name)
@@ -0,0 +1,67 @@
+"""This file contains the cache of the bot user's own permissions and role hierarchy position, per channel and per server.
+Resolving permissions walks all the roles and overwrites, so we only do it again when a role, channel or our own member changes."""
+import discord
+
+
+class PermissionCache:
+    """Caches the bot user's effective permissions per channel, its top role position per server, and the text channels it can send messages in.
+    The invalidate methods have to be called from the role, channel and member update events."""
+
+    def __init__(self):
+        # Our permissions keyed by channel id
+        self._channel_permissions = {}
+
+        # Our top role position keyed by server id
+        self._top_role_positions = {}
+
+        # The text channels we can send messages in (on all servers), None if it has to be recomputed
+        self._sendable_text_channels = None
+
+    def permissions_for(self, channel: discord.Channel) -> discord.Permissions:
+        """Returns the bot user's permissions in the channel."""
+        permissions = self._channel_permissions.get(channel.id)
+
+        if permissions is None:
+            permissions = self._channel_permissions[channel.id] = channel.permissions_for(channel.server.me)
+
+        return permissions
+
+    def top_role_position(self, server: discord.Server) -> int:
+        """Returns the position of the bot user's top role on the server."""
+        position = self._top_role_positions.get(server.id)
+
+        if position is None:
+            position = self._top_role_positions[server.id] = server.me.top_role.position
+
+        return position
+
+    def get_sendable_text_channels(self, client: discord.Client) -> list:
+        """Returns all the text channels, on all servers, that the bot user is allowed to send messages in."""
+
+        if self._sendable_text_channels is None:
+            self._sendable_text_channels = [channel for server in client.servers for channel in server.channels if
+                                            channel.type == discord.ChannelType.text and self.permissions_for(
+                                                channel).send_messages]
+
+        # We return a copy so callers can't change the cached list
+        return list(self._sendable_text_channels)
+
+    def invalidate_channel(self, channel: discord.Channel):
+        """Forgets our permissions in the channel, this should be called when the channel is created, changed or deleted."""
+        self._channel_permissions.pop(channel.id, None)
+        self._sendable_text_channels = None
+
+    def invalidate_server(self, server: discord.Server):
+        """Forgets our permissions in all the server's channels and our top role position on it,
+        this should be called when the server, one of its roles, or our member on it changes."""
+        for channel in server.channels:
+            self._channel_permissions.pop(channel.id, None)
+
+        self._top_role_positions.pop(server.id, None)
+        self._sendable_text_channels = None
+
+    def clear(self):
+        """Forgets everything, this should be called when we (re)connect."""
+        self._channel_permissions.clear()
+        self._top_role_positions.clear()
+        self._sendable_text_channels = None
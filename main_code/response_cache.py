@@ -0,0 +1,114 @@
+"""This file contains the cache we put under external api requests, it's a TTL and LRU cache with a memory cap,
+and it coalesces concurrent identical requests so they share a single request instead of all going to the network."""
+import asyncio
+import collections
+import time
+
+
+class ResponseCache:
+    """A TTL and LRU cache of api response bodies (strings), with request coalescing.
+    Entries expire after the ttl of their endpoint, and the least recently used entries are evicted when there are more than max_entries,
+    or when the cached bodies take up more than max_bytes."""
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 16 * 1024 * 1024, default_ttl: float = 60.,
+                 endpoint_ttls: dict = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+
+        # Per endpoint ttls that override the default, a ttl of 0 means responses from that endpoint aren't cached
+        self.endpoint_ttls = endpoint_ttls or {}
+
+        # The cached entries keyed by request key, as (expire time, body, size of the body in bytes) tuples, ordered from least to most recently used
+        self._entries = collections.OrderedDict()
+        self._total_bytes = 0
+
+        # The tasks of the requests that are currently being done, keyed by request key
+        self._in_flight = {}
+
+        # Stats about how well the cache works
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def get_ttl(self, endpoint: str) -> float:
+        """Returns how long responses from the endpoint should be cached."""
+        return self.endpoint_ttls.get(endpoint, self.default_ttl)
+
+    def _remove(self, key):
+        """Removes an entry from the cache and updates the size of the cached bodies."""
+        expire_time, body, size = self._entries.pop(key)
+        self._total_bytes -= size
+
+    def _get(self, key):
+        """Returns the cached body for the key, or None if it isn't cached (or has expired)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        if entry[0] <= time.monotonic():
+            self._remove(key)
+            return None
+
+        # The entry has now been used most recently
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _put(self, key, body: str, ttl: float):
+        """Caches the body, and evicts the least recently used entries until we're within our limits again."""
+
+        # We don't cache bodies that would never fit, the limit is in bytes, so we count the encoded size and not the characters
+        size = len(body.encode())
+        if ttl <= 0 or size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (time.monotonic() + ttl, body, size)
+        self._total_bytes += size
+
+        while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    async def get_or_fetch(self, key, endpoint: str, fetch, loop: asyncio.AbstractEventLoop) -> str:
+        """Returns the cached body for the key, or awaits fetch() to get it. fetch returns a (body, cacheable) tuple,
+        bodies that aren't cacheable (such as error responses) are only shared with the identical requests that are already waiting.
+        If an identical request is already being done, we wait for that one instead of doing another one."""
+
+        body = self._get(key)
+        if body is not None:
+            self.hits += 1
+            return body
+
+        # We check if someone else is already fetching this, and share their result in that case
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self._in_flight[key] = loop.create_task(self._fetch(key, endpoint, fetch))
+            # We retrieve the exception ourselves, since everyone who was waiting for it might have timed out already
+            task.add_done_callback(lambda done_task: done_task.cancelled() or done_task.exception())
+
+        # The fetch runs in its own task and everyone waits for it through a shield, so one caller timing out doesn't cancel it for everyone else
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, endpoint: str, fetch) -> str:
+        """Fetches the body and caches it if it's cacheable, this runs in its own task."""
+        try:
+            body, cacheable = await fetch()
+        finally:
+            del self._in_flight[key]
+
+        if cacheable:
+            self._put(key, body, self.get_ttl(endpoint))
+
+        return body
+
+    def get_stats(self) -> dict:
+        """Returns a dict with the hit, miss, eviction and coalesced request counts, and the size of the cache."""
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "coalesced": self.coalesced,
+                "entries": len(self._entries), "bytes": self._total_bytes}
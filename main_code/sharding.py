@@ -0,0 +1,89 @@
+"""This file contains the gateway sharding glue between the launcher and the bot processes.
+The launcher starts one bot process per shard and tells it (through environment variables) which shard it is and where to export its stats,
+and it combines the exported stats of all the shards into one view. This only uses the standard library, since the launcher uses it too."""
+import json
+import os
+import time
+
+# The environment variables the launcher passes the shard and the stats file in
+shard_id_variable = "FLUXX_SHARD_ID"
+shard_count_variable = "FLUXX_SHARD_COUNT"
+stats_file_variable = "FLUXX_STATS_FILE"
+
+
+def get_shard_environment(shard_id: int, shard_count: int, stats_file_name: str) -> dict:
+    """Returns the environment variables that tell a bot process which shard it is and where to export its stats.
+    If there's only one shard, the bot isn't told to shard at all."""
+
+    environment = {stats_file_variable: os.path.abspath(stats_file_name)}
+
+    if shard_count > 1:
+        environment[shard_id_variable] = str(shard_id)
+        environment[shard_count_variable] = str(shard_count)
+
+    return environment
+
+
+def get_client_options() -> dict:
+    """Returns the shard_id and shard_count options for the discord client if the launcher started us as a shard, otherwise an empty dict."""
+
+    if shard_count_variable not in os.environ:
+        return {}
+
+    return {"shard_id": int(os.environ[shard_id_variable]), "shard_count": int(os.environ[shard_count_variable])}
+
+
+def get_shard_id() -> int:
+    """Returns which shard we are, 0 if we're not sharded."""
+    return int(os.environ.get(shard_id_variable, 0))
+
+
+def get_stats_file_name():
+    """Returns the file we should export our stats to, or None if the launcher didn't ask for them."""
+    return os.environ.get(stats_file_variable)
+
+
+def get_shard_stats_file_name(stats_file_name: str, shard_id: int) -> str:
+    """Returns the file that the shard exports its stats to, such as fluxx_stats.shard0.json for fluxx_stats.json."""
+    root, extension = os.path.splitext(stats_file_name)
+    return "{0}.shard{1}{2}".format(root, shard_id, extension)
+
+
+def read_shard_stats(file_name: str):
+    """Returns the stats that a shard has exported, or None if it hasn't exported any (yet)."""
+    try:
+        with open(file_name, mode="r", encoding="utf-8") as stats_file:
+            return json.load(stats_file)
+    except (OSError, ValueError):
+        return None
+
+
+def combine_shard_stats(shard_stats: list) -> dict:
+    """Combines the exported stats of the shards (None for shards that haven't exported any) into one view.
+    Counters and numeric gauges are summed, and the dispatch latencies are merged."""
+
+    counters = {}
+    gauges = {}
+    dispatch_latency = {"count": 0, "total": 0., "max": 0.}
+
+    for stats in shard_stats:
+        if stats is None:
+            continue
+
+        for name, value in stats["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+
+        for name, value in stats["gauges"].items():
+            if isinstance(value, (int, float)):
+                gauges[name] = gauges.get(name, 0) + value
+
+        dispatch_latency["count"] += stats["dispatch_latency"]["count"]
+        dispatch_latency["total"] += stats["dispatch_latency"]["total"]
+        dispatch_latency["max"] = max(dispatch_latency["max"], stats["dispatch_latency"]["max"])
+
+    dispatch_latency["average"] = dispatch_latency["total"] / dispatch_latency["count"] if dispatch_latency[
+        "count"] else 0.
+
+    return {"time": time.time(), "shards_reporting": sum(1 for stats in shard_stats if stats is not None),
+            "shard_count": len(shard_stats), "counters": counters, "gauges": gauges,
+            "dispatch_latency": dispatch_latency, "shards": shard_stats}
@@ -0,0 +1,124 @@
+"""This file contains the stats counters, they are kept in memory and written out to the config file in the background instead of on every message."""
+import asyncio
+import os
+import time
+
+from . import config_writer
+from . import helpers
+from . import metrics
+from . import sharding
+
+# The counter increments that haven't been written to the config file yet
+_pending_counters = {}
+
+# The persisted counter values from the last time we read or wrote the config file
+_persisted_counters = {}
+
+# The counter increments made by this process, these are what we export for the launcher, since the config file totals are shared between shards
+_session_counters = {}
+
+# The functions that report the current value of a volatile gauge (such as the size of a data structure), keyed by gauge name
+_gauges = {}
+
+# The task that periodically flushes the counters, so we don't start more than one of them
+_flush_task = None
+
+
+def increment(counter_name: str, amount: int = 1):
+    """Increments the stats counter with the passed name, this only touches memory, the counter is written out on the next flush."""
+    _pending_counters[counter_name] = _pending_counters.get(counter_name, 0) + amount
+    _session_counters[counter_name] = _session_counters.get(counter_name, 0) + amount
+
+
+def load(passed_config: dict):
+    """Loads the persisted counter values from the passed config dict, so get_counters can report the full totals."""
+    _persisted_counters.clear()
+    _persisted_counters.update(
+        {name: value for name, value in passed_config["stats"].items() if isinstance(value, int)})
+
+
+def get_counters() -> dict:
+    """Returns a dict of all the stats counters, including the increments that haven't been written out yet."""
+    counters = dict(_persisted_counters)
+    for name, amount in _pending_counters.items():
+        counters[name] = counters.get(name, 0) + amount
+
+    return counters
+
+
+def register_gauge(gauge_name: str, value_function):
+    """Registers a function that returns the current value of the gauge with the passed name, gauges are never written to the config."""
+    _gauges[gauge_name] = value_function
+
+
+def get_gauges() -> dict:
+    """Returns a dict of the current values of all the registered gauges."""
+    return {name: value_function() for name, value_function in _gauges.items()}
+
+
+def flush():
+    """Hands all the pending counter increments to the config file writer, which adds them to the values in the file.
+    The writer applies them on top of what's in the file, so we don't overwrite other changes that have been made to it."""
+
+    # We don't touch the file if there's nothing to write
+    if not _pending_counters:
+        return
+
+    increments = dict(_pending_counters)
+
+    def add_increments(current_config: dict) -> dict:
+        # We add the pending increments to the values in the file
+        for name, amount in increments.items():
+            current_config["stats"][name] = current_config["stats"].get(name, 0) + amount
+        return current_config
+
+    helpers.config_file_writer.update(add_increments)
+
+    # The writer owns the increments now, so we count them as persisted and start counting from zero again
+    for name, amount in increments.items():
+        _persisted_counters[name] = _persisted_counters.get(name, 0) + amount
+    _pending_counters.clear()
+
+
+def get_export() -> dict:
+    """Returns the stats of this process in the format the launcher combines the stats of the shards from."""
+
+    # How long it takes from receiving a message until its command starts, from the metrics histogram
+    dispatch_latency_histogram = metrics.get_histogram("dispatch_latency")
+    if dispatch_latency_histogram is None:
+        dispatch_latency = {"count": 0, "total": 0., "max": 0.}
+    else:
+        dispatch_latency = {"count": dispatch_latency_histogram.count, "total": dispatch_latency_histogram.sum,
+                            "max": dispatch_latency_histogram.max}
+
+    return {"shard_id": sharding.get_shard_id(), "pid": os.getpid(), "time": time.time(),
+            "counters": dict(_session_counters), "gauges": get_gauges(), "dispatch_latency": dispatch_latency}
+
+
+async def export(loop: asyncio.AbstractEventLoop):
+    """Writes the stats of this process to the file the launcher asked for (in an executor), if it asked for one."""
+    stats_file_name = sharding.get_stats_file_name()
+
+    if stats_file_name:
+        await loop.run_in_executor(None, config_writer.write_json_atomically, stats_file_name, get_export())
+
+
+async def _flush_periodically(loop: asyncio.AbstractEventLoop, interval: float):
+    """Flushes the stats counters (and exports the stats for the launcher) every interval seconds, forever."""
+    while True:
+        await asyncio.sleep(interval)
+
+        try:
+            flush()
+            await export(loop)
+        except (OSError, ValueError) as e:
+            # We keep the pending counters, so they get written on the next flush instead
+            helpers.log_warning("Wasn't able to flush the stats counters, error message: {0}".format(str(e)))
+
+
+def start_flushing(loop: asyncio.AbstractEventLoop, interval: float):
+    """Starts the background task that flushes the stats counters every interval seconds, if it isn't already running."""
+    global _flush_task
+
+    if _flush_task is None or _flush_task.done():
+        _flush_task = loop.create_task(_flush_periodically(loop, interval))
@@ -0,0 +1,329 @@
+"""This file contains the process management that the launcher's supervisor mode uses: the restart policy, the liveness watchdog,
+and the supervisor that restarts the bot and hands off from a running bot process to a new one without downtime.
+This only uses the standard library, since the launcher runs before the requirements are verified."""
+import os
+import random
+import subprocess
+import sys
+import time
+
+from . import child_logs
+from . import handoff
+from . import heartbeat
+
+
+class RestartBackoff:
+    """Decides how long to wait before restarting the bot. The wait grows exponentially (with jitter, so several bots don't restart in lockstep)
+    with every restart in a row, and goes back to the start once the bot has run for stable_time seconds."""
+
+    def __init__(self, base: float = 1., maximum: float = 300., stable_time: float = 600.):
+        self.base = base
+        self.maximum = maximum
+        self.stable_time = stable_time
+
+        # How many times in a row the bot has been restarted without running stably in between
+        self.attempts = 0
+
+    def get_delay(self, run_time: float) -> float:
+        """Returns how many seconds to wait before restarting the bot, which ran for run_time seconds before it exited."""
+
+        if run_time >= self.stable_time:
+            self.attempts = 0
+
+        # We use "full jitter", a random wait between 0 and the exponential cap
+        delay = random.uniform(0, min(self.maximum, self.base * 2 ** self.attempts))
+        self.attempts += 1
+
+        return delay
+
+
+class HeartbeatWatchdog:
+    """Checks the heartbeat file that the bot touches from its event loop (see main_code.heartbeat).
+    The bot is considered hung if the file hasn't been touched for timeout seconds,
+    or if it hasn't been created startup_timeout seconds after the bot was started (it's only touched once the bot has logged in)."""
+
+    def __init__(self, file_name: str, interval: float = 10., timeout: float = 60., startup_timeout: float = 180.):
+        self.file_name = file_name
+        self.interval = interval
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+
+        self._start_time = time.time()
+
+    def get_environment(self) -> dict:
+        """Returns the environment variables that tell the bot where and how often to send heartbeats."""
+        return {heartbeat.heartbeat_file_variable: os.path.abspath(self.file_name),
+                heartbeat.heartbeat_interval_variable: str(self.interval)}
+
+    def reset(self):
+        """Removes the old heartbeat file, this should be called right before the bot is started."""
+        try:
+            os.remove(self.file_name)
+        except OSError:
+            pass
+
+        self._start_time = time.time()
+
+    def get_silence(self) -> float:
+        """Returns how many seconds it's been since the last heartbeat (or since the bot was started, if there hasn't been any heartbeat)."""
+        try:
+            last_heartbeat_time = os.path.getmtime(self.file_name)
+        except OSError:
+            last_heartbeat_time = None
+
+        if last_heartbeat_time is None or last_heartbeat_time < self._start_time:
+            return time.time() - self._start_time
+
+        return time.time() - last_heartbeat_time
+
+    def has_heartbeat(self) -> bool:
+        """Returns True if the bot has sent a heartbeat since it was started, which it does once it's logged in and ready."""
+        try:
+            return os.path.getmtime(self.file_name) >= self._start_time
+        except OSError:
+            return False
+
+    def is_hung(self) -> bool:
+        """Returns True if the bot hasn't sent a heartbeat in time."""
+        return self.get_silence() > (self.timeout if self.has_heartbeat() else self.startup_timeout)
+
+    def remove_file(self):
+        """Removes the heartbeat file, this should be called once the bot has exited."""
+        try:
+            os.remove(self.file_name)
+        except OSError:
+            pass
+
+
+class FluxxProcess:
+    """A running bot process. Its stdout and stderr are streamed into the log file line by line,
+    and if it has a watchdog, it's told to send heartbeats."""
+
+    def __init__(self, start_cmd: tuple, log_file: child_logs.RotatingLogFile,
+                 watchdog: HeartbeatWatchdog = None, environment: dict = None, log_function=print):
+        self.watchdog = watchdog
+        self.log_function = log_function
+
+        # Our own output goes through the text layer and the bot's output is echoed directly to the buffer, so we flush ours first to keep the order
+        sys.stdout.flush()
+
+        # The bot's stdout is a pipe, so we make it unbuffered to get its output line by line as it happens
+        process_environment = dict(os.environ, PYTHONUNBUFFERED="1")
+        process_environment.update(environment or {})
+
+        if watchdog is not None:
+            watchdog.reset()
+            process_environment.update(watchdog.get_environment())
+
+        self.process = subprocess.Popen(start_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, env=process_environment)
+        self._pump_threads = child_logs.start_pumping(self.process, log_file)
+
+        self.start_time = time.monotonic()
+
+        # When we told the process to drain, None if we haven't
+        self.drain_time = None
+
+    def poll(self):
+        """Returns the exit code of the process, or None if it's still running."""
+        return self.process.poll()
+
+    def get_run_time(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def is_ready(self) -> bool:
+        """Returns True if the bot has logged in, a bot in standby is ready to take over then."""
+        return self.watchdog is not None and self.watchdog.has_heartbeat()
+
+    def is_hung(self) -> bool:
+        return self.watchdog is not None and self.watchdog.is_hung()
+
+    def drain(self):
+        """Tells the bot to stop handling new events, finish what it's doing, and exit."""
+        self.drain_time = time.monotonic()
+
+        try:
+            # The bot stops reading its stdin after the drain command, so we close it
+            self.process.stdin.write(handoff.drain_command)
+            self.process.stdin.close()
+        except OSError:
+            # The process has already exited
+            pass
+
+    def take_over(self):
+        """Tells a bot in standby to start handling events."""
+        try:
+            # We keep the bot's stdin open, since we'll tell it to drain through it when it gets replaced itself
+            self.process.stdin.write(handoff.takeover_command)
+            self.process.stdin.flush()
+        except OSError:
+            # The process has already exited
+            pass
+
+    def stop(self):
+        """Stops a process that doesn't respond, first by asking it to terminate, and then by killing it."""
+        self.process.terminate()
+
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.log_function("fluxx-bot didn't terminate, killing it.")
+            self.process.kill()
+            self.process.wait()
+
+    def finish(self):
+        """Waits for the process to exit and for all its output to be written, and cleans up after it."""
+        self.process.wait()
+
+        for thread in self._pump_threads:
+            thread.join()
+
+        if self.watchdog is not None:
+            self.watchdog.remove_file()
+
+
+class ProcessSupervisor:
+    """Keeps one bot running. The bot is restarted with exponential backoff when it exits, and stopped when it stops sending heartbeats.
+    A handoff starts a new bot process in standby while the old one keeps running. Once the new one is ready, the old one is told to drain and exit,
+    and right after that the new one is told to take over, so events are never handled by both.
+    Nothing here blocks, poll has to be called regularly."""
+
+    def __init__(self, start_cmd: tuple, log_file: child_logs.RotatingLogFile, backoff: RestartBackoff,
+                 heartbeat_file: str, heartbeat_interval: float = 10., heartbeat_timeout: float = 60.,
+                 startup_timeout: float = 180., drain_timeout: float = 60., environment: dict = None,
+                 start_delay: float = 0., name: str = "fluxx-bot", log_function=print):
+        self.start_cmd = start_cmd
+        self.log_file = log_file
+        self.backoff = backoff
+        self.heartbeat_file = heartbeat_file
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.drain_timeout = drain_timeout
+        self.environment = environment
+        self.name = name
+        self.log_function = log_function
+
+        # The process that is handling events, the process that is starting up to replace it, and the old processes that are draining
+        self.current = None
+        self.replacement = None
+        self.draining = []
+
+        # When (in time.monotonic time) we should start the bot again after it exited, the first start can be delayed so several shards don't log in at once
+        self._restart_time = time.monotonic() + start_delay
+
+        # How many processes we've started, every process gets its own heartbeat file since the old and new ones run at the same time during a handoff
+        self._process_count = 0
+
+    def _log(self, message: str):
+        self.log_function("{0}: {1}".format(self.name, message))
+
+    def _start_process(self, standby: bool = False) -> FluxxProcess:
+        self._process_count += 1
+        watchdog = HeartbeatWatchdog("{0}.{1}".format(self.heartbeat_file, self._process_count),
+                                     interval=self.heartbeat_interval, timeout=self.heartbeat_timeout,
+                                     startup_timeout=self.startup_timeout)
+
+        # We tell the bot to listen for the drain and takeover commands on stdin
+        environment = dict(self.environment or {})
+        environment[handoff.control_variable] = "1"
+
+        # A bot that replaces a running one doesn't handle any events until we tell it to take over
+        if standby:
+            environment[handoff.standby_variable] = "1"
+
+        process = FluxxProcess(self.start_cmd, self.log_file, watchdog, environment, self.log_function)
+        self._log("Started process {0}.".format(process.process.pid))
+
+        return process
+
+    def request_handoff(self):
+        """Starts a new bot process that takes over from the current one once it's ready, such as to deploy new code.
+        If the bot isn't running it's started right away instead."""
+
+        if self.replacement is not None:
+            self._log("A handoff is already in progress.")
+        elif self.current is None:
+            self._log("Not running, so starting right away instead of handing off.")
+            self._restart_time = 0
+        else:
+            self._log("Starting a new process to hand off to.")
+            self.replacement = self._start_process(standby=True)
+
+    def poll(self):
+        """Checks on all the processes and starts, hands off to, or stops them as needed."""
+        now = time.monotonic()
+
+        # The old processes that are draining should exit by themselves, but we make sure they don't linger
+        for process in list(self.draining):
+            if process.poll() is not None:
+                self._log("Process {0} exited with code {1} after draining.".format(process.process.pid,
+                                                                                     process.poll()))
+                process.finish()
+                self.draining.remove(process)
+            elif now - process.drain_time > self.drain_timeout:
+                self._log("Process {0} didn't finish draining in {1} seconds, stopping it.".format(
+                    process.process.pid, self.drain_timeout))
+                process.stop()
+
+        if self.replacement is not None:
+            if self.replacement.poll() is not None:
+                self._log("The new process exited with code {0} before it was ready, the handoff failed.".format(
+                    self.replacement.poll()))
+                self.replacement.finish()
+                self.replacement = None
+            elif self.replacement.is_ready():
+                # The new process is connected, so the old one can stop handling events and the new one can start
+                if self.current is not None:
+                    self._log("Process {0} is ready, draining process {1}.".format(self.replacement.process.pid,
+                                                                                   self.current.process.pid))
+                    self.current.drain()
+                    self.draining.append(self.current)
+
+                self.replacement.take_over()
+                self.current = self.replacement
+                self.replacement = None
+            elif self.replacement.is_hung():
+                self._log("The new process didn't get ready in {0} seconds, the handoff failed.".format(
+                    self.startup_timeout))
+                self.replacement.stop()
+                self.replacement.finish()
+                self.replacement = None
+
+        if self.current is not None:
+            if self.current.poll() is not None:
+                run_time = self.current.get_run_time()
+                self._log("Process {0} exited with code {1} after running for {2} seconds.".format(
+                    self.current.process.pid, self.current.poll(), round(run_time)))
+                self.current.finish()
+
+                if self.replacement is not None:
+                    # We were already starting a new process, so it takes over right away
+                    self._log("Letting the new process take over.")
+                    self.replacement.take_over()
+                    self.current = self.replacement
+                    self.replacement = None
+                else:
+                    self.current = None
+                    delay = self.backoff.get_delay(run_time)
+                    self._restart_time = now + delay
+                    self._log("Restarting in {0} seconds (restart {1} in a row).".format(round(delay, 1),
+                                                                                         self.backoff.attempts))
+            elif self.current.is_hung():
+                self._log("Process {0} hasn't sent a heartbeat in {1} seconds, stopping it.".format(
+                    self.current.process.pid, round(self.current.watchdog.get_silence())))
+                self.current.stop()
+        elif now >= self._restart_time:
+            self.current = self._start_process()
+
+    def is_handing_off(self) -> bool:
+        return self.replacement is not None
+
+    def get_processes(self) -> list:
+        """Returns all the processes, the current one first."""
+        return [process for process in [self.current, self.replacement] + self.draining if process is not None]
+
+    def wait_for_exit(self):
+        """Waits for all the processes to exit, such as after they got a CTRL+C."""
+        for process in self.get_processes():
+            process.finish()
@@ -0,0 +1,48 @@
+"""Tests for the command prefix trie."""
+import unittest
+
+from main_code import command_router
+
+
+def make_command(trigger: str) -> dict:
+    return {"command": trigger, "help": "", "method": None}
+
+
+class CommandRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.hello = make_command("hello")
+        self.hello_there = make_command("Hello there")
+        self.stats = make_command("stats")
+        self.admin_hello = make_command("hello")
+        self.admin_stats = make_command("stats")
+
+        self.router = command_router.CommandRouter([self.hello, self.hello_there, self.stats],
+                                                   [self.admin_hello, self.admin_stats])
+
+    def match(self, content: str, allow_admin: bool = False):
+        return self.router.match(command_router.normalize_command_content(content), allow_admin)
+
+    def test_longest_trigger_wins(self):
+        self.assertIs(self.match("hello there friend")[0], self.hello_there)
+        self.assertIs(self.match("hello you")[0], self.hello)
+
+    def test_no_match(self):
+        self.assertEqual(self.match("goodbye"), (None, False))
+        self.assertEqual(self.match("hell"), (None, False))
+        self.assertEqual(self.match(""), (None, False))
+
+    def test_content_is_normalized(self):
+        self.assertIs(self.match("  HELLO THERE  ")[0], self.hello_there)
+
+    def test_admin_commands_need_permission(self):
+        self.assertEqual(self.match("admin stats"), (None, False))
+        self.assertEqual(self.match("admin stats", allow_admin=True), (self.admin_stats, True))
+
+    def test_public_command_wins_over_admin_command_with_the_same_trigger(self):
+        router = command_router.CommandRouter([make_command("admin stats")], [self.admin_stats])
+        command, is_admin_command = router.match("admin stats", True)
+        self.assertFalse(is_admin_command)
+
+
+if __name__ == "__main__":
+    unittest.main()
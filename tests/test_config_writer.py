@@ -0,0 +1,90 @@
+"""Tests for the coalescing, crash safe config file writer."""
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from main_code import config_writer
+
+
+class ConfigWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        self.file_name = os.path.join(self.directory, "config.json")
+        with open(self.file_name, mode="w", encoding="utf-8") as config_file:
+            json.dump({"stats": {"messages": 0}, "name": "fluxx"}, config_file)
+
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        self.logged = []
+        self.writer = config_writer.ConfigWriter(self.file_name, self.loop, interval=0.01,
+                                                 log_function=self.logged.append)
+
+    def read_file(self) -> dict:
+        with open(self.file_name, mode="r", encoding="utf-8") as config_file:
+            return json.load(config_file)
+
+    def run_updates(self, *update_functions):
+        """Makes the updates from the running loop, and waits until they have been written."""
+
+        async def update():
+            for update_function in update_functions:
+                self.writer.update(update_function)
+            await asyncio.sleep(0.1)
+
+        self.loop.run_until_complete(update())
+
+    @staticmethod
+    def add_message(current_config: dict) -> dict:
+        current_config["stats"]["messages"] += 1
+        return current_config
+
+    def test_updates_are_coalesced_into_one_write(self):
+        self.run_updates(self.add_message, self.add_message, self.add_message)
+
+        self.assertEqual(self.read_file()["stats"]["messages"], 3)
+        self.assertEqual(self.writer.get_stats(), {"updates_received": 3, "writes_done": 1, "pending_updates": 0})
+
+    def test_updates_are_written_right_away_without_a_running_loop(self):
+        self.writer.update(self.add_message)
+
+        self.assertEqual(self.read_file()["stats"]["messages"], 1)
+
+    def test_a_broken_update_only_loses_itself(self):
+        self.run_updates(self.add_message, lambda current_config: current_config["missing"],
+                         lambda current_config: dict(current_config, unserializable=object()), self.add_message)
+
+        self.assertEqual(self.read_file()["stats"]["messages"], 2)
+        self.assertNotIn("unserializable", self.read_file())
+        self.assertTrue(self.logged)
+
+    def test_updates_are_applied_on_top_of_a_replace(self):
+        self.run_updates(lambda current_config: {"stats": {"messages": 5}}, self.add_message)
+        self.writer.replace({"stats": {"messages": 10}})
+        self.writer.update(self.add_message)
+
+        self.assertEqual(self.read_file(), {"stats": {"messages": 11}})
+
+    def test_write_listeners_get_the_file_signatures(self):
+        signatures = []
+        self.writer.add_write_listener(lambda previous, current: signatures.append((previous, current)))
+        previous_signature = config_writer.get_file_signature(self.file_name)
+
+        self.writer.update(self.add_message)
+
+        self.assertEqual(signatures, [(previous_signature, config_writer.get_file_signature(self.file_name))])
+
+    def test_write_json_atomically_leaves_no_temporary_file(self):
+        config_writer.write_json_atomically(self.file_name, {"a": 1})
+
+        self.assertEqual(self.read_file(), {"a": 1})
+        self.assertEqual(os.listdir(self.directory), ["config.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
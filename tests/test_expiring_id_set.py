@@ -0,0 +1,56 @@
+"""Tests for the bounded, expiring id set."""
+import unittest
+import unittest.mock
+
+from main_code import expiring_id_set
+
+
+class ExpiringIdSetTest(unittest.TestCase):
+    def setUp(self):
+        # We control the clock, so the tests don't have to sleep
+        self.now = 1000.
+        patcher = unittest.mock.patch.object(expiring_id_set.time, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_list_methods(self):
+        ids = expiring_id_set.ExpiringIdSet(["1"])
+        ids.append("2")
+        ids.extend(["3", "4"])
+        ids.remove("1")
+
+        self.assertEqual(list(ids), ["2", "3", "4"])
+
+        # Just like list.remove, removing an id that isn't there raises ValueError
+        with self.assertRaises(ValueError):
+            ids.remove("1")
+
+        ids.discard("1")
+        ids.discard("2")
+        self.assertNotIn("2", ids)
+
+    def test_oldest_ids_are_dropped_over_max_size(self):
+        ids = expiring_id_set.ExpiringIdSet(["1", "2", "3"], max_size=2)
+        self.assertEqual(list(ids), ["2", "3"])
+
+        # Adding an id again makes it the newest
+        ids.add("2")
+        ids.add("4")
+        self.assertEqual(list(ids), ["2", "4"])
+
+    def test_ids_expire(self):
+        ids = expiring_id_set.ExpiringIdSet(["1"], ttl=10.)
+        self.now += 5
+        ids.add("2")
+
+        self.now += 6
+        self.assertNotIn("1", ids)
+        self.assertIn("2", ids)
+        self.assertEqual(len(ids), 1)
+
+        self.now += 5
+        self.assertEqual(len(ids), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""Tests for the per server role and channel indexes."""
+import copy
+import unittest
+
+from main_code import object_index
+
+
+class FakeObject:
+    """Has the attributes of a discord.py role or channel that the index uses."""
+
+    def __init__(self, object_id: str, name: str, server=None):
+        self.id = object_id
+        self.name = name
+        self.server = server
+
+
+class FakeServer:
+    def __init__(self, server_id: str):
+        self.id = server_id
+        self.roles = []
+        self.channels = []
+
+
+class ServerObjectIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer("1")
+        self.mods = FakeObject("10", "Mods", self.server)
+        self.everyone = FakeObject("11", "everyone", self.server)
+        self.server.roles = [self.mods, self.everyone]
+        self.general = FakeObject("20", "General", self.server)
+        self.server.channels = [self.general]
+
+        self.index = object_index.ServerObjectIndex()
+
+    def test_lookups(self):
+        self.assertIs(self.index.get_role_by_id(self.server, "10"), self.mods)
+        self.assertIs(self.index.get_role_by_name(self.server, "MODS"), self.mods)
+        self.assertIs(self.index.get_channel_by_name(self.server, "general"), self.general)
+        self.assertIsNone(self.index.get_role_by_name(self.server, "admins"))
+        self.assertIsNone(self.index.get_channel_by_id(self.server, "10"))
+
+    def test_role_renamed_in_place(self):
+        self.index.get_role_by_id(self.server, "10")
+
+        # discord.py passes a copy as before, and changes the role object itself
+        before = copy.copy(self.mods)
+        self.mods.name = "Admins"
+        self.index.update_role(before, self.mods)
+
+        self.assertIsNone(self.index.get_role_by_name(self.server, "mods"))
+        self.assertIs(self.index.get_role_by_name(self.server, "admins"), self.mods)
+
+    def test_objects_with_the_same_name(self):
+        other_general = FakeObject("21", "general", self.server)
+        self.index.get_channel_by_id(self.server, "20")
+        self.index.update_channel(None, other_general)
+
+        self.index.remove_channel(self.general)
+        self.assertIs(self.index.get_channel_by_name(self.server, "General"), other_general)
+
+        self.index.remove_channel(other_general)
+        self.assertIsNone(self.index.get_channel_by_name(self.server, "general"))
+
+    def test_created_role_and_dropped_server(self):
+        self.index.get_role_by_id(self.server, "10")
+        new_role = FakeObject("12", "New", self.server)
+        self.index.update_role(None, new_role)
+        self.assertIs(self.index.get_role_by_name(self.server, "new"), new_role)
+
+        self.index.remove_role(new_role)
+        self.assertIsNone(self.index.get_role_by_id(self.server, "12"))
+
+        # After the server is dropped it's indexed again from its current roles
+        self.server.roles.append(new_role)
+        self.index.remove_server(self.server)
+        self.assertIs(self.index.get_role_by_id(self.server, "12"), new_role)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+"""Tests for the outbound request scheduler, against a local fake of discord's REST api that sends rate limit headers.
+Run them from the repository root with: python -m unittest discover tests"""
+import asyncio
+import time
+import unittest
+
+try:
+    import aiohttp
+    import aiohttp.web
+except ImportError:
+    # The scheduler itself doesn't need aiohttp, only the fake server and the client session in these tests do
+    aiohttp = None
+
+from main_code import outbound
+
+# How long the fake server makes an exhausted bucket (or the global limit) wait, in seconds
+reset_after = 0.3
+
+
+class FakeDiscordServer:
+    """A local http server that answers every request with 200, except for the responses queued for a path, which it sends first."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+        # The (status, headers) responses that are sent (in order) for the next requests to a path
+        self.queued_responses = {}
+
+        # The (method, path, time.monotonic() time) of every request we got
+        self.requests = []
+
+        self._handler = None
+        self._server = None
+        self.url = None
+
+    def queue_response(self, path: str, status: int, headers: dict):
+        self.queued_responses.setdefault(path, []).append((status, headers))
+
+    async def _handle_request(self, request):
+        self.requests.append((request.method, request.path, time.monotonic()))
+
+        status, headers = 200, {}
+        if self.queued_responses.get(request.path):
+            status, headers = self.queued_responses[request.path].pop(0)
+
+        return aiohttp.web.json_response({}, status=status, headers=headers)
+
+    async def start(self):
+        application = aiohttp.web.Application()
+        application.router.add_route("*", "/{path:.*}", self._handle_request)
+
+        self._handler = application.make_handler(loop=self.loop)
+        self._server = await self.loop.create_server(self._handler, "127.0.0.1", 0)
+        self.url = "http://127.0.0.1:{0}".format(self._server.sockets[0].getsockname()[1])
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        await self._handler.shutdown()
+
+    def get_request_times(self, path: str) -> list:
+        return [request_time for method, request_path, request_time in self.requests if request_path == path]
+
+
+class RouteKeyTest(unittest.TestCase):
+    def test_route_keys(self):
+        # Every channel gets its own bucket, but message ids don't
+        self.assertNotEqual(outbound.get_route_key("POST", "/api/channels/1/messages"),
+                            outbound.get_route_key("POST", "/api/channels/2/messages"))
+        self.assertEqual(outbound.get_route_key("DELETE", "/api/channels/1/messages/10"),
+                         outbound.get_route_key("delete", "https://discordapp.com/api/channels/1/messages/20"))
+        self.assertEqual(outbound.get_route_key("GET", "/api/users/123"), "GET /api/users/{id}")
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp isn't installed")
+class OutboundSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.server = FakeDiscordServer(self.loop)
+        self.loop.run_until_complete(self.server.start())
+
+        self.scheduler = outbound.OutboundScheduler()
+        self.session = self.scheduler.wrap_session(aiohttp.ClientSession(loop=self.loop))
+
+    def tearDown(self):
+        self.session.close()
+        self.loop.run_until_complete(self.server.stop())
+        self.loop.close()
+
+    def request(self, method: str, path: str) -> int:
+        """Sends a request through the scheduler and returns the response status."""
+
+        async def send_request():
+            response = await self.session.request(method, self.server.url + path)
+            await response.read()
+            return response.status
+
+        return self.loop.run_until_complete(send_request())
+
+    def test_exhausted_bucket_waits_for_reset(self):
+        path = "/api/channels/1/messages"
+        self.server.queue_response(path, 200, {"X-RateLimit-Remaining": "0",
+                                               "X-RateLimit-Reset-After": str(reset_after)})
+
+        self.request("POST", path)
+        self.request("POST", path)
+
+        first_time, second_time = self.server.get_request_times(path)
+        self.assertGreaterEqual(second_time - first_time, reset_after * 0.9)
+        self.assertEqual(self.scheduler.requests_delayed, 1)
+
+    def test_buckets_are_separate_per_channel(self):
+        exhausted_path = "/api/channels/1/messages"
+        other_path = "/api/channels/2/messages"
+        self.server.queue_response(exhausted_path, 200, {"X-RateLimit-Remaining": "0",
+                                                         "X-RateLimit-Reset-After": "60"})
+
+        self.request("POST", exhausted_path)
+
+        # The other channel isn't affected by the first channel's empty bucket
+        start_time = time.monotonic()
+        self.request("POST", other_path)
+        self.request("POST", other_path)
+
+        self.assertLess(time.monotonic() - start_time, reset_after)
+        self.assertEqual(self.scheduler.requests_delayed, 0)
+        self.assertEqual(self.scheduler.get_stats()["buckets"], 2)
+
+    def test_global_rate_limit_delays_every_route(self):
+        limited_path = "/api/channels/1/messages"
+        other_path = "/api/guilds/2/members"
+        self.server.queue_response(limited_path, 429, {"X-RateLimit-Global": "true",
+                                                       "Retry-After": str(int(reset_after * 1000))})
+
+        self.assertEqual(self.request("POST", limited_path), 429)
+        self.request("GET", other_path)
+
+        limited_time, = self.server.get_request_times(limited_path)
+        other_time, = self.server.get_request_times(other_path)
+        self.assertGreaterEqual(other_time - limited_time, reset_after * 0.9)
+        self.assertEqual(self.scheduler.rate_limited_responses, 1)
+        self.assertEqual(self.scheduler.requests_delayed, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+"""Tests for the api response cache and its request coalescing."""
+import asyncio
+import unittest
+import unittest.mock
+
+from main_code import response_cache
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        self.cache = response_cache.ResponseCache(max_entries=2, max_bytes=10, default_ttl=60.,
+                                                  endpoint_ttls={"uncached": 0})
+
+        # How many times every key was actually fetched
+        self.fetch_counts = {}
+
+    def make_fetch(self, body: str, cacheable: bool = True, delay: float = 0.):
+        async def fetch():
+            self.fetch_counts[body] = self.fetch_counts.get(body, 0) + 1
+            await asyncio.sleep(delay)
+            return body, cacheable
+
+        return fetch
+
+    def get(self, key, body: str, endpoint: str = "endpoint", cacheable: bool = True) -> str:
+        return self.loop.run_until_complete(
+            self.cache.get_or_fetch(key, endpoint, self.make_fetch(body, cacheable), self.loop))
+
+    def test_hits_and_misses(self):
+        self.assertEqual(self.get("a", "A"), "A")
+        self.assertEqual(self.get("a", "A"), "A")
+
+        self.assertEqual(self.fetch_counts["A"], 1)
+        self.assertEqual(self.cache.get_stats()["hits"], 1)
+        self.assertEqual(self.cache.get_stats()["misses"], 1)
+
+    def test_uncacheable_responses_and_endpoints(self):
+        self.get("a", "error", cacheable=False)
+        self.get("a", "error", cacheable=False)
+        self.get("b", "B", endpoint="uncached")
+        self.get("b", "B", endpoint="uncached")
+
+        self.assertEqual(self.fetch_counts, {"error": 2, "B": 2})
+        self.assertEqual(self.cache.get_stats()["entries"], 0)
+
+    def test_entries_expire(self):
+        with unittest.mock.patch.object(response_cache.time, "monotonic", lambda: 0.):
+            self.get("a", "A")
+
+        with unittest.mock.patch.object(response_cache.time, "monotonic", lambda: 61.):
+            self.get("a", "A")
+
+        self.assertEqual(self.fetch_counts["A"], 2)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.get("a", "A")
+        self.get("b", "B")
+        self.get("a", "A")
+        self.get("c", "C")
+
+        # b was used least recently, so it was evicted for c
+        self.get("a", "A")
+        self.get("b", "B")
+        self.assertEqual(self.fetch_counts, {"A": 1, "B": 2, "C": 1})
+
+    def test_bodies_over_the_byte_limit(self):
+        self.get("a", "12345")
+        self.get("b", "123456")
+        self.assertEqual(self.cache.get_stats()["entries"], 1)
+        self.assertLessEqual(self.cache.get_stats()["bytes"], 10)
+
+        self.get("c", "x" * 11)
+        self.get("c", "x" * 11)
+        self.assertEqual(self.fetch_counts["x" * 11], 2)
+
+    def test_byte_limit_counts_encoded_bytes(self):
+        # Six characters, but twelve bytes
+        self.get("a", "\u00e9\u00e9\u00e9\u00e9\u00e9\u00e9")
+        self.assertEqual(self.cache.get_stats()["entries"], 0)
+
+        self.get("b", "\u00e9\u00e9")
+        self.assertEqual(self.cache.get_stats()["bytes"], 4)
+
+    def test_concurrent_requests_are_coalesced(self):
+        fetch = self.make_fetch("A", delay=0.05)
+
+        async def get_concurrently():
+            return await asyncio.gather(*[self.cache.get_or_fetch("a", "endpoint", fetch, self.loop) for _ in range(3)])
+
+        results = self.loop.run_until_complete(get_concurrently())
+
+        self.assertEqual(results, ["A", "A", "A"])
+        self.assertEqual(self.fetch_counts["A"], 1)
+        self.assertEqual(self.cache.get_stats()["coalesced"], 2)
+
+    def test_a_caller_timing_out_doesnt_cancel_the_fetch_for_the_others(self):
+        fetch = self.make_fetch("A", delay=0.1)
+
+        async def impatient_get():
+            return await asyncio.wait_for(self.cache.get_or_fetch("a", "endpoint", fetch, self.loop), 0.01)
+
+        async def get_concurrently():
+            return await asyncio.gather(impatient_get(), self.cache.get_or_fetch("a", "endpoint", fetch, self.loop),
+                                        return_exceptions=True)
+
+        results = self.loop.run_until_complete(get_concurrently())
+
+        self.assertIsInstance(results[0], asyncio.TimeoutError)
+        self.assertEqual(results[1], "A")
+        self.assertEqual(self.fetch_counts["A"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+"""Tests for combining the stats that the shards export."""
+import unittest
+
+from main_code import sharding
+
+
+def make_shard_stats(counters: dict, gauges: dict, count: int, total: float, maximum: float) -> dict:
+    return {"counters": counters, "gauges": gauges,
+            "dispatch_latency": {"count": count, "total": total, "max": maximum}}
+
+
+class CombineShardStatsTest(unittest.TestCase):
+    def test_counters_and_numeric_gauges_are_summed(self):
+        combined = sharding.combine_shard_stats([
+            make_shard_stats({"messages": 3, "commands": 1}, {"servers": 10, "version": "a"}, 2, 0.5, 0.4),
+            None,
+            make_shard_stats({"messages": 4}, {"servers": 5, "version": "b"}, 3, 1.5, 0.9)])
+
+        self.assertEqual(combined["counters"], {"messages": 7, "commands": 1})
+        self.assertEqual(combined["gauges"], {"servers": 15})
+        self.assertEqual(combined["shards_reporting"], 2)
+        self.assertEqual(combined["shard_count"], 3)
+
+    def test_dispatch_latencies_are_merged(self):
+        combined = sharding.combine_shard_stats([make_shard_stats({}, {}, 2, 0.5, 0.4),
+                                                 make_shard_stats({}, {}, 3, 1.5, 0.9)])
+
+        self.assertEqual(combined["dispatch_latency"]["count"], 5)
+        self.assertAlmostEqual(combined["dispatch_latency"]["average"], 0.4)
+        self.assertEqual(combined["dispatch_latency"]["max"], 0.9)
+
+    def test_no_shards_reporting(self):
+        combined = sharding.combine_shard_stats([None, None])
+
+        self.assertEqual(combined["shards_reporting"], 0)
+        self.assertEqual(combined["dispatch_latency"]["average"], 0.)
+
+    def test_shard_environment(self):
+        self.assertNotIn(sharding.shard_id_variable, sharding.get_shard_environment(0, 1, "stats.json"))
+
+        environment = sharding.get_shard_environment(2, 4, "stats.json")
+        self.assertEqual(environment[sharding.shard_id_variable], "2")
+        self.assertEqual(environment[sharding.shard_count_variable], "4")
+        self.assertEqual(sharding.get_shard_stats_file_name("stats.json", 2), "stats.shard2.json")
+
+
+if __name__ == "__main__":
+    unittest.main()
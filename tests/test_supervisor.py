@@ -0,0 +1,34 @@
+"""Tests for the launcher's restart policy."""
+import unittest
+import unittest.mock
+
+from main_code import supervisor
+
+
+class RestartBackoffTest(unittest.TestCase):
+    def setUp(self):
+        # We always take the upper bound of the jitter, so the delays are predictable
+        patcher = unittest.mock.patch.object(supervisor.random, "uniform", lambda low, high: high)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_delay_grows_exponentially_up_to_the_maximum(self):
+        backoff = supervisor.RestartBackoff(base=1., maximum=10., stable_time=600.)
+        self.assertEqual([backoff.get_delay(5.) for _ in range(6)], [1., 2., 4., 8., 10., 10.])
+
+    def test_delay_resets_after_a_stable_run(self):
+        backoff = supervisor.RestartBackoff(base=1., maximum=10., stable_time=600.)
+        backoff.get_delay(5.)
+        backoff.get_delay(5.)
+
+        self.assertEqual(backoff.get_delay(600.), 1.)
+        self.assertEqual(backoff.get_delay(5.), 2.)
+
+    def test_delay_has_jitter(self):
+        backoff = supervisor.RestartBackoff(base=1., maximum=10.)
+        with unittest.mock.patch.object(supervisor.random, "uniform", lambda low, high: low):
+            self.assertEqual(backoff.get_delay(5.), 0.)
+
+
+if __name__ == "__main__":
+    unittest.main()